@@ -0,0 +1,260 @@
+"""Синтетические данные и сценарии для команд benchmark и explain_queries."""
+import random
+import re
+import statistics
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.test import APIClient
+
+from recipes.models import (Cart, CartProduct, FavoritesRecipes, Ingredients,
+                            Product, Recipe, Tag)
+from users.models import Subscriptions
+
+User = get_user_model()
+
+DEFAULT_SIZES = {
+    'users': 50,
+    'products': 2000,
+    'recipes': 500,
+    'ingredients_per_recipe': 8,
+    'favorites_per_user': 20,
+    'cart_per_user': 10,
+    'subscriptions_per_user': 20,
+}
+TAG_COLORS = ('#00ff00', '#ff0000', '#ffff00', '#0000ff', '#ff00ff')
+# Строки плана, означающие чтение таблицы целиком: SQLite пишет
+# «SCAN таблица» без «USING ... INDEX», PostgreSQL - «Seq Scan on таблица».
+SEQUENTIAL_SCAN = {
+    'sqlite': re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS \w+)?$'),
+    'postgresql': re.compile(r'Seq Scan on (\w+)'),
+}
+SUBQUERY = re.compile(r'^(?:CO-ROUTINE|MATERIALIZE) (\w+)')
+EXPLAIN = {
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+    'postgresql': 'EXPLAIN ',
+}
+
+
+@contextmanager
+def benchmark_database():
+    """Временная тестовая база текущего движка (SQLite, PostgreSQL) и
+    отдельный кэш, чтобы не смешивать её данные с общим кэшем
+    приложения."""
+    # Как в тестах: с DEBUG журнал запросов переполняется при заполнении
+    # базы и замедляет каждый запрос.
+    settings.DEBUG = False
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        with override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'benchmark',
+        }}):
+            yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def seed(sizes, random_seed=0):
+    """Заполняет базу синтетическими данными. Возвращает пользователя, от
+    имени которого выполняются сценарии, и id одного из рецептов."""
+    rnd = random.Random(random_seed)
+    User.objects.bulk_create(
+        User(username=f'user{i}', email=f'user{i}@example.com',
+             first_name='Имя', last_name='Фамилия')
+        for i in range(sizes['users'])
+    )
+    users = list(User.objects.order_by('id'))
+    Tag.objects.bulk_create(
+        Tag(name=f'Тэг {i}', color=color, slug=f'tag{i}')
+        for i, color in enumerate(TAG_COLORS)
+    )
+    tags = list(Tag.objects.all())
+    Product.objects.bulk_create(
+        Product(name=f'продукт {i}', measurement_unit=rnd.choice('гкшл'))
+        for i in range(sizes['products'])
+    )
+    products = list(Product.objects.values_list('id', flat=True))
+    Recipe.objects.bulk_create(
+        Recipe(author=rnd.choice(users), name=f'Рецепт {i}',
+               text='Описание рецепта. ' * 20,
+               cooking_time=rnd.randint(5, 120))
+        for i in range(sizes['recipes'])
+    )
+    recipes = list(Recipe.objects.values_list('id', flat=True))
+    Ingredients.objects.bulk_create(
+        Ingredients(recipe_id=recipe_id, ingredients_id=product_id,
+                    amount=rnd.randint(1, 500))
+        for recipe_id in recipes
+        for product_id in rnd.sample(
+            products, min(sizes['ingredients_per_recipe'], len(products)))
+    )
+    Recipe.tags.through.objects.bulk_create(
+        Recipe.tags.through(recipe_id=recipe_id, tag_id=tag.id)
+        for recipe_id in recipes
+        for tag in rnd.sample(tags, 2)
+    )
+    for model, size in ((FavoritesRecipes, 'favorites_per_user'),
+                        (Cart, 'cart_per_user')):
+        model.objects.bulk_create(
+            model(user=user, recipe_id=recipe_id)
+            for user in users
+            for recipe_id in rnd.sample(
+                recipes, min(sizes[size], len(recipes)))
+        )
+    Subscriptions.objects.bulk_create(
+        Subscriptions(user=user, author=author)
+        for user in users
+        for author in rnd.sample(
+            users, min(sizes['subscriptions_per_user'] + 1, len(users)))
+        if author != user
+    )
+    CartProduct.objects.rebuild()
+    for model in (Recipe, Subscriptions, FavoritesRecipes, Cart):
+        model.objects.recount()
+    return users[0], recipes[0]
+
+
+def scenarios(recipe_id, products):
+    """Сценарии: (название, метод, url, тело запроса). Тело может быть
+    функцией номера повтора, чтобы создаваемые рецепты не совпадали."""
+    ingredients = [{'id': product_id, 'amount': 10}
+                   for product_id in products[:8]]
+
+    def recipe_payload(iteration):
+        return {
+            'name': f'Новый рецепт {iteration}',
+            'text': 'Описание',
+            'cooking_time': 10,
+            'tags': [Tag.objects.values_list('id', flat=True).first()],
+            'ingredients': ingredients,
+        }
+
+    return (
+        ('recipe_list', 'get', '/api/recipes/?limit=6', None),
+        ('recipe_list_cursor', 'get', '/api/recipes/?limit=6&cursor=', None),
+        ('recipe_list_favorited', 'get',
+         '/api/recipes/?limit=6&is_favorited=1', None),
+        ('recipe_list_in_cart', 'get',
+         '/api/recipes/?limit=6&is_in_shopping_cart=1', None),
+        ('recipe_list_tags', 'get',
+         '/api/recipes/?limit=6&tags=tag0&tags=tag1', None),
+        ('recipe_list_trending', 'get',
+         '/api/recipes/?limit=6&ordering=trending', None),
+        ('recipe_search', 'get', '/api/recipes/?limit=6&search=рецепт 1',
+         None),
+        ('recipe_by_products', 'get',
+         f'/api/recipes/?limit=6&ingredients={products[0]},{products[1]}',
+         None),
+        ('recipe_detail', 'get', f'/api/recipes/{recipe_id}/', None),
+        ('subscriptions', 'get',
+         '/api/users/subscriptions/?limit=6&recipes_limit=3', None),
+        ('timeline', 'get', '/api/recipes/timeline/?limit=6', None),
+        ('download_shopping_cart', 'get',
+         '/api/recipes/download_shopping_cart/', None),
+        ('ingredient_search', 'get', '/api/ingredients/?name=продукт 1',
+         None),
+        ('tags', 'get', '/api/tags/', None),
+        ('recipe_create', 'post', '/api/recipes/', recipe_payload),
+        ('recipe_update', 'patch', f'/api/recipes/{recipe_id}/',
+         lambda iteration: recipe_payload(f'изменённый {iteration}')),
+    )
+
+
+def request(client, method, url, payload, iteration):
+    data = payload(iteration) if callable(payload) else payload
+    response = getattr(client, method)(url, data=data, format='json')
+    if response.streaming:
+        b''.join(response.streaming_content)
+    return response
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def measure(client, method, url, payload, iterations):
+    """Число запросов к базе, задержка (p50/p95, мс) и пик выделенной
+    памяти (КБ) для одного сценария."""
+    request(client, method, url, payload, 'прогрев')
+    timings = []
+    for iteration in range(iterations):
+        started = time.perf_counter()
+        response = request(client, method, url, payload, iteration)
+        timings.append((time.perf_counter() - started) * 1000)
+    with CaptureQueriesContext(connection) as queries:
+        request(client, method, url, payload, 'запросы')
+    # Журнал запросов очищается в начале каждого запроса.
+    query_count = len(queries)
+    tracemalloc.start()
+    request(client, method, url, payload, 'память')
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        'status': response.status_code,
+        'queries': query_count,
+        'p50_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(percentile(timings, 0.95), 3),
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+
+def prepare(sizes, random_seed):
+    """Заполняет базу и возвращает клиента от имени пользователя
+    сценариев и сами сценарии."""
+    user, recipe_id = seed(sizes, random_seed)
+    Recipe.objects.filter(id=recipe_id).update(author=user)
+    client = APIClient()
+    client.force_authenticate(user)
+    products = list(Product.objects.values_list('id', flat=True)[:8])
+    return client, scenarios(recipe_id, products)
+
+
+def run(sizes, iterations, random_seed=0):
+    client, items = prepare(sizes, random_seed)
+    return {
+        name: measure(client, method, url, payload, iterations)
+        for name, method, url, payload in items
+    }
+
+
+def sequential_scans(sql):
+    """Таблицы, которые запрос читает целиком, и план запроса."""
+    with connection.cursor() as cursor:
+        cursor.execute(EXPLAIN[connection.vendor] + sql)
+        plan = [row[-1] for row in cursor.fetchall()]
+    pattern = SEQUENTIAL_SCAN[connection.vendor]
+    tables = []
+    # Подзапросы из FROM SQLite тоже «сканирует», но это не таблицы.
+    subqueries = set()
+    for line in plan:
+        match = SUBQUERY.search(line.strip())
+        if match:
+            subqueries.add(match.group(1))
+        match = pattern.search(line.strip())
+        if match and match.group(1) not in subqueries:
+            tables.append(match.group(1))
+    return tables, plan
+
+
+def explain(sizes, random_seed=0):
+    """План каждого SELECT, который выполняют сценарии:
+    {сценарий: [(sql, таблицы без индекса, план)]}."""
+    client, items = prepare(sizes, random_seed)
+    report = {}
+    for name, method, url, payload in items:
+        with CaptureQueriesContext(connection) as queries:
+            request(client, method, url, payload, 'план')
+        plans = []
+        for sql in dict.fromkeys(query['sql'] for query in queries):
+            if sql.lstrip().upper().startswith('SELECT'):
+                plans.append((sql, *sequential_scans(sql)))
+        report[name] = plans
+    return report
@@ -0,0 +1,336 @@
+import hashlib
+import random
+import time
+from contextlib import contextmanager
+from functools import wraps
+from threading import Lock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+from recipes.models import (PRODUCTS_CATALOG, TAGS_CATALOG, CatalogVersion,
+                            Recipe)
+
+MISSING = object()
+# Сколько ждать, пока ключ вычисляет другой процесс, прежде чем вычислить
+# самому.
+COMPUTE_LOCK_TIMEOUT = 10
+COMPUTE_WAIT_INTERVAL = 0.05
+
+
+def jittered(timeout):
+    """Время жизни со случайным разбросом, чтобы записи, созданные
+    одновременно, не устаревали тоже одновременно."""
+    jitter = settings.CACHE_TTL_JITTER
+    return max(1, round(timeout * random.uniform(1 - jitter, 1 + jitter)))
+
+
+class KeyLocks:
+    """Блокировки по ключу кэша внутри процесса."""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.locks = {}
+
+    @contextmanager
+    def __call__(self, key):
+        with self.lock:
+            entry = self.locks.setdefault(key, [Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self.lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self.locks[key]
+
+
+key_locks = KeyLocks()
+
+
+def get_or_compute(key, compute, timeout, cacheable=lambda value: True):
+    """Значение из общего кэша или вычисленное compute(). Пока одно
+    вычисление идёт, остальные запросы того же ключа ждут его результата:
+    потоки процесса - на блокировке, другие процессы - на ключе-замке в
+    кэше (cache.add атомарен в redis и locmem)."""
+    value = cache.get(key, MISSING)
+    if value is not MISSING:
+        return value
+    with key_locks(key):
+        value = cache.get(key, MISSING)
+        if value is not MISSING:
+            return value
+        lock_key = f'{key}:lock'
+        deadline = time.monotonic() + COMPUTE_LOCK_TIMEOUT
+        locked = cache.add(lock_key, True, COMPUTE_LOCK_TIMEOUT)
+        while not locked and time.monotonic() < deadline:
+            time.sleep(COMPUTE_WAIT_INTERVAL)
+            value = cache.get(key, MISSING)
+            if value is not MISSING:
+                return value
+            locked = cache.add(lock_key, True, COMPUTE_LOCK_TIMEOUT)
+        try:
+            value = compute()
+            if cacheable(value):
+                cache.set(key, value, jittered(timeout))
+        finally:
+            if locked:
+                cache.delete(lock_key)
+        return value
+
+
+def response_key(view, method, request, per_user, state):
+    parts = [
+        type(view).__name__, method.__name__,
+        request.build_absolute_uri(),
+        request.accepted_renderer.format,
+    ]
+    if per_user:
+        parts.append(request.user.pk)
+    if state is not None:
+        parts.append(state(request))
+    return 'response:' + hashlib.sha1(
+        repr(parts).encode('utf-8')).hexdigest()
+
+
+def cached_response(timeout=60, per_user=False, state=None):
+    """Кэширует GET-ответы метода вида в общем кэше.
+    Ключ - адрес запроса и формат ответа, с per_user ещё и пользователь.
+    state(request) - отпечаток данных (версия, счётчики), который тоже
+    входит в ключ: когда он меняется, ответ считается заново раньше
+    timeout. Кэшируются только ответы 200 с data (Response); остальные,
+    например 304 самого метода, отдаются как есть. ETag кэшированного
+    ответа проверяется, так что 304 отдаётся и из кэша."""
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            if request.method != 'GET':
+                return method(self, request, *args, **kwargs)
+            key = response_key(self, method, request, per_user, state)
+
+            def compute():
+                response = method(self, request, *args, **kwargs)
+                if (response.status_code != 200
+                        or not isinstance(response, Response)):
+                    return response
+                headers = {
+                    header: value for header, value in response.items()
+                    if header != 'Content-Type'
+                }
+                return response.status_code, response.data, headers
+
+            value = get_or_compute(
+                key, compute, timeout,
+                cacheable=lambda value: isinstance(value, tuple))
+            if not isinstance(value, tuple):
+                return value
+            status, data, headers = value
+            if 'ETag' in headers:
+                response = get_conditional_response(
+                    request, etag=headers['ETag'])
+                if response is not None:
+                    return response
+            return Response(data, status=status, headers=headers)
+
+        return wrapper
+
+    return decorator
+
+
+class CatalogCache:
+    """Сериализованные справочники в памяти процесса. Запись считается
+    устаревшей, как только версия справочника в базе меняется."""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.payloads = {}
+
+    def get(self, name, version, build):
+        cached = self.payloads.get(name)
+        if cached is None or cached[0] != version:
+            with self.lock:
+                cached = self.payloads.get(name)
+                if cached is None or cached[0] != version:
+                    cached = (version, build())
+                    self.payloads[name] = cached
+        return cached[1]
+
+
+catalog_cache = CatalogCache()
+
+
+class CachedCatalogMixin:
+    """list и retrieve справочника из catalog_cache с ETag и
+    Last-Modified. Если справочник не менялся с прошлого запроса
+    клиента, отвечает 304 без обращения к данным."""
+    catalog_name = None
+
+    def get_catalog(self, version):
+        """Справочник целиком: {id: сериализованный объект}."""
+        return catalog_cache.get(
+            self.catalog_name, version,
+            lambda: {item['id']: item for item in self.get_serializer(
+                self.get_queryset(), many=True).data},
+        )
+
+    def conditional_response(self, request, build):
+        version, updated_at = CatalogVersion.objects.current(
+            self.catalog_name)
+        etag = f'"{self.catalog_name}-{version}"'
+        last_modified = updated_at and int(updated_at.timestamp())
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = build(version)
+        response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params:
+            return self.conditional_response(
+                request,
+                lambda version: super(CachedCatalogMixin, self).list(
+                    request, *args, **kwargs))
+        return self.conditional_response(
+            request,
+            lambda version: Response(list(
+                self.get_catalog(version).values())))
+
+    def retrieve(self, request, *args, **kwargs):
+        def build(version):
+            try:
+                return Response(self.get_catalog(version)[
+                    int(kwargs[self.lookup_field])])
+            except (KeyError, ValueError):
+                return super(CachedCatalogMixin, self).retrieve(
+                    request, *args, **kwargs)
+
+        return self.conditional_response(request, build)
+
+
+class ConditionalRecipeMixin:
+    """Строгий ETag для рецепта и страницы рецептов. Считается по
+    состоянию рецептов (etag_state) и версиям справочников, поэтому
+    ответ 304 отдаётся без сериализации.
+    Тело ответа собирается из общей для всех пользователей части (она
+    кэшируется по каждому рецепту) и флагов пользователя из того же
+    etag_state, так что персональных запросов к базе не добавляется."""
+    shared_recipe_timeout = 300
+
+    def catalog_versions(self):
+        if not hasattr(self, '_catalog_versions'):
+            self._catalog_versions = sorted(
+                CatalogVersion.objects.filter(
+                    name__in=(TAGS_CATALOG, PRODUCTS_CATALOG),
+                ).values_list('name', 'version'))
+        return self._catalog_versions
+
+    def make_etag(self, *state):
+        digest = hashlib.sha1(repr(
+            (state, self.catalog_versions())).encode('utf-8')).hexdigest()
+        return f'"{digest}"'
+
+    def not_modified(self, request, etag):
+        return get_conditional_response(request, etag=etag)
+
+    def shared_recipes(self, state):
+        """Общая часть выдачи рецептов страницы {id: данные}. Ключ кэша
+        меняется с updated_at рецепта, датой изменения профиля автора и
+        версиями тэгов и продуктов."""
+        context = self.get_serializer_context()
+        prefix = hashlib.sha1(repr((
+            self.request.get_host(),
+            context.get('image_rendition'),
+            self.catalog_versions(),
+        )).encode('utf-8')).hexdigest()
+        keys = {
+            self.shared_recipe_key(prefix, row): row['id'] for row in state
+        }
+        cached = cache.get_many(keys)
+        shared = {keys[key]: data for key, data in cached.items()}
+        missing = [key for key in keys if key not in cached]
+        if missing:
+            recipes = Recipe.objects.shared().in_bulk(
+                [keys[key] for key in missing])
+            fresh = {}
+            for key in missing:
+                recipe = recipes.get(keys[key])
+                if recipe is not None:
+                    fresh[key] = self.get_serializer(recipe).data
+                    shared[keys[key]] = fresh[key]
+            cache.set_many(fresh, jittered(self.shared_recipe_timeout))
+        return shared
+
+    @staticmethod
+    def shared_recipe_key(prefix, row):
+        author_updated_at = row['author_updated_at']
+        return (f"recipe:{prefix}:{row['id']}:{row['updated_at'].timestamp()}"
+                f':{author_updated_at and author_updated_at.timestamp()}')
+
+    def personalize(self, data, row):
+        """Накладывает флаги пользователя на общую часть выдачи."""
+        data = {
+            **data,
+            'is_favorited': row['is_favorited'],
+            'is_in_shopping_cart': row['is_in_shopping_cart'],
+        }
+        if data['author'] is not None:
+            data['author'] = {
+                **data['author'],
+                'is_subscribed': row['author_is_subscribed'],
+            }
+        return data
+
+    def render_recipes(self, state):
+        shared = self.shared_recipes(state)
+        return [self.personalize(shared[row['id']], row)
+                for row in state if row['id'] in shared]
+
+    def render_recipe_ids(self, recipe_ids):
+        """{id: данные} рецептов, порядок которых посчитан не в базе
+        (подбор по продуктам, рекомендации)."""
+        state = list(Recipe.objects.filter(id__in=recipe_ids).etag_state(
+            self.request.user))
+        return {data['id']: data for data in self.render_recipes(state)}
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        state = self.paginate_queryset(
+            queryset.etag_state(request.user))
+        if state is None:
+            return super().list(request, *args, **kwargs)
+        etag = self.make_etag(
+            self.paginator.count, self.paginator.search_total,
+            [tuple(row.values()) for row in state])
+        response = self.not_modified(request, etag)
+        if response is None:
+            response = self.get_paginated_response(
+                self.render_recipes(state))
+        response['ETag'] = etag
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            state = self.get_queryset().filter(
+                pk=kwargs[self.lookup_url_kwarg or self.lookup_field],
+            ).etag_state(request.user).first()
+        except (TypeError, ValueError):
+            state = None
+        if state is None:
+            return super().retrieve(request, *args, **kwargs)
+        etag = self.make_etag(tuple(state.values()))
+        response = self.not_modified(request, etag)
+        if response is None:
+            recipes = self.render_recipes([state])
+            if not recipes:
+                return super().retrieve(request, *args, **kwargs)
+            response = Response(recipes[0])
+        response['ETag'] = etag
+        return response
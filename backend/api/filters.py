@@ -1,29 +1,98 @@
+from django.db.models import Count
 from django_filters.rest_framework import FilterSet, filters
-from rest_framework.filters import SearchFilter
+from rest_framework.filters import BaseFilterBackend
 
-from recipes.models import Recipe
+from recipes.models import Ingredients, Recipe
 
+from .search import (RECIPE_SEARCH_MAX_RESULTS, get_product_search,
+                     get_recipe_search)
 
-class ProductSearchFilter(SearchFilter):
+PRODUCT_SEARCH_LIMIT = 20
+PRODUCT_SEARCH_MAX_LIMIT = 100
+
+
+class ProductSearchFilter(BaseFilterBackend):
+    """Поиск продуктов для автодополнения: сначала совпадения по началу
+    названия, затем по подстроке, затем похожие названия. Не больше limit
+    результатов."""
     search_param = 'name'
+    limit_param = 'limit'
+
+    def get_limit(self, request):
+        try:
+            limit = int(request.query_params[self.limit_param])
+        except (KeyError, ValueError):
+            return PRODUCT_SEARCH_LIMIT
+        return min(max(limit, 1), PRODUCT_SEARCH_MAX_LIMIT)
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '').strip()
+        if not query:
+            return queryset
+        return get_product_search().search(
+            queryset, query, self.get_limit(request))
+
+
+class NumberInFilter(filters.BaseInFilter, filters.NumberFilter):
+    pass
 
 
 class RecipesFilter(FilterSet):
+    """search - полнотекстовый поиск по названию, продуктам и описанию,
+    результаты по убыванию релевантности (выдача по cursor - только без
+    search). Без PostgreSQL выдаются RECIPE_SEARCH_MAX_RESULTS лучших.
+    ingredients=1,2,3 - рецепты, в которых есть все эти продукты.
+    ordering=trending - «популярное сейчас» по Recipe.trending_score
+    (выдача по cursor - только без ordering)."""
     tags = filters.AllValuesMultipleFilter(field_name='tags__slug')
     is_favorited = filters.BooleanFilter(method='filter_is_favorited')
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_is_in_shopping_cart')
+    search = filters.CharFilter(method='filter_search')
+    ingredients = NumberInFilter(method='filter_ingredients')
+    ordering = filters.ChoiceFilter(
+        choices=(('trending', 'Популярное сейчас'),),
+        method='filter_ordering',
+    )
 
     class Meta:
         model = Recipe
-        fields = ('is_favorited', 'is_in_shopping_cart', 'author', 'tags')
+        fields = ('is_favorited', 'is_in_shopping_cart', 'author', 'tags',
+                  'search', 'ingredients', 'ordering')
 
     def filter_is_favorited(self, qs, name, value):
         if value:
-            return qs.filter(in_favorites__user=self.request.user)
+            return qs.filter(is_favorited=True)
         return qs
 
     def filter_is_in_shopping_cart(self, qs, name, value):
         if value:
-            return qs.filter(in_cart__user=self.request.user)
+            return qs.filter(is_in_shopping_cart=True)
+        return qs
+
+    def filter_search(self, qs, name, value):
+        value = value.strip()
+        if not value:
+            return qs
+        qs, total = get_recipe_search().search(qs, value)
+        if (total is not None and total > RECIPE_SEARCH_MAX_RESULTS
+                and self.request is not None):
+            self.request.search_total = total
+        return qs
+
+    def filter_ingredients(self, qs, name, value):
+        """Одна группировка по индексу (ingredients, recipe): рецепты, у
+        которых нашлись все заданные продукты."""
+        product_ids = {int(product_id) for product_id in value}
+        if not product_ids:
+            return qs
+        return qs.filter(id__in=Ingredients.objects.filter(
+            ingredients__in=product_ids,
+        ).values('recipe').annotate(
+            found=Count('ingredients'),
+        ).filter(found=len(product_ids)).values('recipe'))
+
+    def filter_ordering(self, qs, name, value):
+        if value == 'trending':
+            return qs.order_by('-trending_score', '-id')
         return qs
@@ -0,0 +1,72 @@
+import json
+
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+
+from api.benchmark import DEFAULT_SIZES, benchmark_database, run
+
+
+class Command(BaseCommand):
+    help = ('Замеряет число запросов к базе, задержку и память основных '
+            'эндпоинтов API на синтетических данных. Данные создаются во '
+            'временной тестовой базе текущего движка (SQLite, PostgreSQL)')
+
+    def add_arguments(self, parser):
+        for name, default in DEFAULT_SIZES.items():
+            parser.add_argument(
+                f"--{name.replace('_', '-')}",
+                type=int,
+                default=default,
+                dest=name,
+            )
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--output',
+            help='Записать отчёт в json файл',
+        )
+        parser.add_argument(
+            '--compare',
+            help='json отчёт прошлого запуска для сравнения',
+        )
+
+    def handle(self, *args, **options):
+        sizes = {name: options[name] for name in DEFAULT_SIZES}
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare'], encoding='utf8') as file:
+                    baseline = json.load(file)['results']
+            except (OSError, ValueError, KeyError) as error:
+                raise CommandError(f'Не удалось прочитать отчёт: {error}')
+        with benchmark_database():
+            results = run(sizes, options['iterations'], options['seed'])
+        report = {
+            'vendor': connection.vendor,
+            'sizes': sizes,
+            'iterations': options['iterations'],
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+        else:
+            self.stdout.write(json.dumps(report, ensure_ascii=False,
+                                         indent=2))
+        if baseline:
+            self.write_comparison(baseline, results)
+
+    def write_comparison(self, baseline, results):
+        self.stdout.write(
+            f"{'сценарий':<24}{'запросы':>14}{'p50, мс':>20}{'p95, мс':>20}"
+        )
+        for name, result in results.items():
+            old = baseline.get(name)
+            if old is None:
+                continue
+            self.stdout.write(
+                f'{name:<24}'
+                f"{old['queries']:>6} -> {result['queries']:<5}"
+                f"{old['p50_ms']:>9.2f} -> {result['p50_ms']:<7.2f}"
+                f"{old['p95_ms']:>9.2f} -> {result['p95_ms']:<7.2f}"
+            )
@@ -0,0 +1,62 @@
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+
+from api.benchmark import DEFAULT_SIZES, EXPLAIN, benchmark_database, explain
+
+
+class Command(BaseCommand):
+    help = ('Выполняет EXPLAIN для каждого SELECT сценариев команды '
+            'benchmark на синтетических данных и отмечает запросы, '
+            'которые читают таблицу целиком, без индекса')
+
+    def add_arguments(self, parser):
+        for name, default in DEFAULT_SIZES.items():
+            parser.add_argument(
+                f"--{name.replace('_', '-')}",
+                type=int,
+                default=default,
+                dest=name,
+            )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--allow',
+            action='append',
+            default=[],
+            metavar='TABLE',
+            help='Таблица, которую можно читать целиком (справочники)',
+        )
+        parser.add_argument(
+            '--verbose-plans',
+            action='store_true',
+            help='Выводить план каждого запроса, а не только отмеченных',
+        )
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Завершиться с ошибкой, если есть отмеченные запросы',
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor not in EXPLAIN:
+            raise CommandError(
+                f'EXPLAIN для {connection.vendor} не поддерживается')
+        sizes = {name: options[name] for name in DEFAULT_SIZES}
+        allowed = set(options['allow'])
+        with benchmark_database():
+            report = explain(sizes, options['seed'])
+        flagged = 0
+        for name, plans in report.items():
+            self.stdout.write(f'{name}: запросов {len(plans)}')
+            for sql, tables, plan in plans:
+                tables = [table for table in tables if table not in allowed]
+                if tables:
+                    flagged += 1
+                    self.stdout.write(self.style.WARNING(
+                        f"  без индекса: {', '.join(tables)}"))
+                if tables or options['verbose_plans']:
+                    self.stdout.write(f'    {sql}')
+                    for line in plan:
+                        self.stdout.write(f'      {line}')
+        self.stdout.write(f'Запросов без индекса: {flagged}')
+        if flagged and options['check']:
+            raise CommandError('Есть запросы, читающие таблицу целиком')
@@ -1,11 +1,169 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .search import RECIPE_SEARCH_MAX_RESULTS
 
 
 class RecipePagination(PageNumberPagination):
+    """Постраничная выдача рецептов.
+    С параметром cursor (можно пустым - первая страница) включается
+    выдача по ключу (pub_date, id): без OFFSET и без COUNT(*), count
+    считается только с параметром with_count. Выборка с другим порядком
+    (ordering, search) по курсору не выдаётся - ответ 400.
+    Если поиск выдал не все найденные рецепты (RECIPE_SEARCH_MAX_RESULTS),
+    в ответе есть search_limit и search_total - сколько нашлось всего."""
     page_size_query_param = 'limit'
     page_size = 6
+    cursor_query_param = 'cursor'
+    with_count_query_param = 'with_count'
+    invalid_cursor_message = 'Неверный курсор'
+    cursor_orderings = ((), ('-pub_date', '-id'))
+    cursor_ordering_message = ('Выдача по курсору возможна только по дате '
+                               'публикации, без ordering и search')
 
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.search_total = getattr(request, 'search_total', None)
+        self.cursor_mode = self.cursor_query_param in request.query_params
+        if not self.cursor_mode:
+            page = super().paginate_queryset(queryset, request, view)
+            self.count = self.page.paginator.count if page is not None else 0
+            return page
+        if tuple(queryset.query.order_by) not in self.cursor_orderings:
+            raise ValidationError(
+                {self.cursor_query_param: [self.cursor_ordering_message]})
+        page_size = self.get_page_size(request)
+        reverse, position = self.decode_cursor(request)
+        self.count = None
+        if request.query_params.get(self.with_count_query_param):
+            self.count = queryset.count()
+        ordering = ('pub_date', 'id') if reverse else ('-pub_date', '-id')
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            pub_date, pk = position
+            if reverse:
+                queryset = queryset.filter(
+                    Q(pub_date__gt=pub_date)
+                    | Q(pub_date=pub_date, id__gt=pk))
+            else:
+                queryset = queryset.filter(
+                    Q(pub_date__lt=pub_date)
+                    | Q(pub_date=pub_date, id__lt=pk))
+        page = list(queryset[:page_size + 1])
+        has_more = len(page) > page_size
+        page = page[:page_size]
+        if reverse:
+            page.reverse()
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+        self.cursor_page = page
+        return page
 
-class RecipeSubscribePagination(PageNumberPagination):
+    @staticmethod
+    def get_position(item):
+        if isinstance(item, dict):
+            return item['pub_date'], item['id']
+        return item.pub_date, item.id
+
+    def encode_cursor(self, item, reverse):
+        pub_date, pk = self.get_position(item)
+        value = f"{'p' if reverse else 'n'}|{pub_date.isoformat()}|{pk}"
+        return urlsafe_b64encode(value.encode()).decode()
+
+    def decode_cursor(self, request):
+        cursor = request.query_params[self.cursor_query_param]
+        if not cursor:
+            return False, None
+        try:
+            direction, pub_date, pk = urlsafe_b64decode(
+                cursor.encode()).decode().split('|')
+            pub_date = parse_datetime(pub_date)
+            pk = int(pk)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if direction not in ('n', 'p') or pub_date is None:
+            raise NotFound(self.invalid_cursor_message)
+        return direction == 'p', (pub_date, pk)
+
+    def get_cursor_link(self, item, reverse):
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.page_query_param)
+        return replace_query_param(
+            url, self.cursor_query_param, self.encode_cursor(item, reverse))
+
+    def get_next_link(self):
+        if not self.cursor_mode:
+            return super().get_next_link()
+        if not self.has_next or not self.cursor_page:
+            return None
+        return self.get_cursor_link(self.cursor_page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.cursor_mode:
+            return super().get_previous_link()
+        if not self.has_previous or not self.cursor_page:
+            return None
+        return self.get_cursor_link(self.cursor_page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        if not self.cursor_mode:
+            response = super().get_paginated_response(data)
+            if self.search_total is not None:
+                response.data['search_limit'] = RECIPE_SEARCH_MAX_RESULTS
+                response.data['search_total'] = self.search_total
+            return response
+        return Response({
+            'count': self.count,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+
+class TimelinePagination(RecipePagination):
+    """Лента подписок: только вперёд по курсору (pub_date, id), без
+    count и ссылки на предыдущую страницу."""
+
+    def paginate_timeline(self, read, request):
+        """read(position, limit) - записи ленты после position."""
+        self.request = request
+        self.cursor_mode = True
+        self.count = None
+        page_size = self.get_page_size(request)
+        reverse, position = False, None
+        if request.query_params.get(self.cursor_query_param):
+            reverse, position = self.decode_cursor(request)
+        if reverse:
+            raise NotFound(self.invalid_cursor_message)
+        page = read(position, page_size + 1)
+        self.has_next = len(page) > page_size
+        self.has_previous = False
+        self.cursor_page = page[:page_size]
+        return self.cursor_page
+
+
+class RankedPagination(PageNumberPagination):
+    """Постраничная выдача рецептов, отсортированных в памяти (подбор по
+    продуктам, рекомендации): курсор не нужен."""
     page_size_query_param = 'limit'
+    page_size = 6
+
+
+class UserPagination(PageNumberPagination):
+    page_size_query_param = 'limit'
+    page_size = 6
+
+
+class RecipeSubscribePagination(PageNumberPagination):
+    """Сколько рецептов показывать у каждого автора в подписках."""
+    page_size_query_param = 'recipes_limit'
     page_size = 3
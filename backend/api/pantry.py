@@ -0,0 +1,105 @@
+"""Подбор рецептов по продуктам, которые есть у пользователя."""
+from collections import Counter
+from datetime import timedelta
+from threading import Lock
+
+from recipes.models import (RECIPE_INGREDIENTS_VERSION, CatalogVersion,
+                            Ingredients, Recipe)
+
+# Изменения, зафиксированные позже соседних, но с более ранним
+# updated_at, перечитываются с таким запасом.
+WATERMARK_OVERLAP = timedelta(minutes=1)
+
+
+class PantryIndex:
+    """Инвертированный индекс в памяти процесса: продукт -> рецепты, в
+    которых он есть, и рецепт -> его продукты.
+    Когда версия RECIPE_INGREDIENTS_VERSION меняется, индекс
+    дочитывает только рецепты с updated_at не раньше последнего
+    прочитанного (с запасом WATERMARK_OVERLAP) и убирает рецепты, которых
+    больше нет в базе."""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.version = None
+        self.watermark = None
+        self.product_recipes = {}
+        self.recipe_products = {}
+
+    def set_recipe(self, recipe_id, products):
+        for product_id in self.recipe_products.get(recipe_id, ()):
+            if product_id not in products:
+                self.product_recipes[product_id].discard(recipe_id)
+        for product_id in products:
+            self.product_recipes.setdefault(product_id, set()).add(recipe_id)
+        self.recipe_products[recipe_id] = products
+
+    def remove_recipe(self, recipe_id):
+        for product_id in self.recipe_products.pop(recipe_id, ()):
+            self.product_recipes[product_id].discard(recipe_id)
+
+    def load(self):
+        """Перечитывает состав рецептов, изменённых после watermark,
+        при первом вызове - всех."""
+        recipes = Recipe.objects.all()
+        ingredients = Ingredients.objects.all()
+        if self.watermark is not None:
+            since = self.watermark - WATERMARK_OVERLAP
+            recipes = recipes.filter(updated_at__gte=since)
+            ingredients = ingredients.filter(recipe__updated_at__gte=since)
+        products = {}
+        latest = self.watermark
+        for recipe_id, updated_at in recipes.values_list('id', 'updated_at'):
+            products[recipe_id] = set()
+            if latest is None or updated_at > latest:
+                latest = updated_at
+        for recipe_id, product_id in ingredients.values_list(
+                'recipe', 'ingredients'):
+            if recipe_id in products:
+                products[recipe_id].add(product_id)
+        for recipe_id, recipe_products in products.items():
+            self.set_recipe(recipe_id, frozenset(recipe_products))
+        self.watermark = latest
+
+    def remove_deleted(self):
+        existing = set(Recipe.objects.values_list('id', flat=True))
+        for recipe_id in set(self.recipe_products) - existing:
+            self.remove_recipe(recipe_id)
+
+    def refresh(self):
+        version = CatalogVersion.objects.current(
+            RECIPE_INGREDIENTS_VERSION)[0]
+        if self.version == version:
+            return
+        with self.lock:
+            if self.version == version:
+                return
+            self.load()
+            self.remove_deleted()
+            self.version = version
+
+    def match(self, pantry, max_missing=None):
+        """Рецепты, в которых есть хоть один продукт из pantry, по
+        убыванию доли имеющихся продуктов, затем по числу недостающих и
+        от новых к старым: список (recipe_id, доля, сколько не хватает)."""
+        self.refresh()
+        with self.lock:
+            found = Counter()
+            for product_id in pantry:
+                found.update(self.product_recipes.get(product_id, ()))
+            matches = []
+            for recipe_id, count in found.items():
+                size = len(self.recipe_products[recipe_id])
+                if max_missing is None or size - count <= max_missing:
+                    matches.append((-count / size, size - count, -recipe_id))
+        matches.sort()
+        return [(-recipe_id, -coverage, missing)
+                for coverage, missing, recipe_id in matches]
+
+    def missing_products(self, recipe_id, pantry):
+        """Каких продуктов рецепта нет в pantry."""
+        return sorted(self.recipe_products.get(recipe_id, frozenset())
+                      - pantry)
+
+
+pantry_index = PantryIndex()
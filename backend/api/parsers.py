@@ -0,0 +1,24 @@
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import BaseParser, DataAndFiles
+
+from .uploads import read_image
+
+
+class ImageUploadParser(BaseParser):
+    """Тело запроса - само фото (Content-Type: image/...). Фото пишется во
+    временный файл по мере чтения и попадает в request.data['image'].
+    Ошибки проверки фото возвращаются, как ошибки поля image."""
+    media_type = 'image/*'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = parser_context['request']
+        try:
+            content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            content_length = 0
+        content_type = media_type.split(';')[0].strip()
+        try:
+            image = read_image(stream, content_type, content_length)
+        except ValidationError as error:
+            raise ValidationError({'image': error.detail})
+        return DataAndFiles({}, {'image': image})
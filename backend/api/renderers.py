@@ -0,0 +1,152 @@
+import csv
+import json
+from abc import ABC, abstractmethod
+
+from rest_framework.renderers import BaseRenderer
+
+PDF_PAGE_WIDTH = 595
+PDF_PAGE_HEIGHT = 842
+PDF_MARGIN = 56
+PDF_FONT_SIZE = 12
+PDF_LEADING = 16
+PDF_LINES_ON_PAGE = (PDF_PAGE_HEIGHT - 2 * PDF_MARGIN) // PDF_LEADING
+PDF_ENCODING = 'cp1251'
+# Имена глифов кириллицы (Adobe Glyph List) для кодов cp1251: Ё, ё и
+# А-я с 0xC0. В списке Adobe Ё и ё стоят внутри алфавита, их пропускаем.
+PDF_CYRILLIC_GLYPHS = '168 /afii10023 184 /afii10071 192 ' + ' '.join(
+    f'/afii{code}' for code in (
+        *range(10017, 10023), *range(10024, 10050),
+        *range(10065, 10071), *range(10072, 10098),
+    )
+)
+
+
+class ShoppingListRenderer(ABC, BaseRenderer):
+    """Формат выгрузки списка покупок.
+    Renderer участвует в выборе формата (?format= или Accept), сам список
+    отдаётся потоком через stream(). Через render() проходят только ответы
+    с ошибками."""
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+    @property
+    def content_type(self):
+        if self.charset:
+            return f'{self.media_type}; charset={self.charset}'
+        return self.media_type
+
+    @abstractmethod
+    def stream(self, title, rows):
+        """Части выгрузки: строки или байты."""
+
+
+class ShoppingListTextRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, title, rows):
+        yield f'{title}\n\n'
+        for num, row in enumerate(rows):
+            separator = '\n' if num else ''
+            yield (f"{separator}{row['name']} - {row['amount']}"
+                   f"{row['measurement_unit']}")
+
+
+class _Echo:
+    """Файлоподобный объект для csv.writer: возвращает строку, а не
+    пишет её."""
+
+    def write(self, value):
+        return value
+
+
+class ShoppingListCSVRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, title, rows):
+        writer = csv.writer(_Echo())
+        yield writer.writerow(('name', 'amount', 'measurement_unit'))
+        for row in rows:
+            yield writer.writerow(
+                (row['name'], row['amount'], row['measurement_unit']))
+
+
+class ShoppingListPDFRenderer(ShoppingListRenderer):
+    """PDF без сторонних библиотек. Каждая страница записывается в поток
+    сразу после заполнения, в памяти держатся только смещения объектов."""
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+
+    def stream(self, title, rows):
+        offsets = {}
+        position = 0
+        page_ids = []
+
+        def write_object(obj_id, body):
+            nonlocal position
+            offsets[obj_id] = position
+            chunk = b'%d 0 obj\n' % obj_id + body + b'\nendobj\n'
+            position += len(chunk)
+            return chunk
+
+        def write_page(lines):
+            obj_id = 4 + 2 * len(page_ids)
+            page_ids.append(obj_id + 1)
+            content = self._page_content(lines)
+            return (
+                write_object(obj_id, b'<< /Length %d >>\nstream\n%s\n'
+                             b'endstream' % (len(content), content))
+                + write_object(obj_id + 1, (
+                    b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] '
+                    b'/Resources << /Font << /F1 3 0 R >> >> '
+                    b'/Contents %d 0 R >>'
+                    % (PDF_PAGE_WIDTH, PDF_PAGE_HEIGHT, obj_id)))
+            )
+
+        header = b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n'
+        position = len(header)
+        yield header
+        yield write_object(3, (
+            '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica '
+            '/Encoding << /Type /Encoding /BaseEncoding /WinAnsiEncoding '
+            f'/Differences [{PDF_CYRILLIC_GLYPHS}] >> >>'
+        ).encode('ascii'))
+        lines = [title, '']
+        for row in rows:
+            lines.append(f"{row['name']} - {row['amount']}"
+                         f"{row['measurement_unit']}")
+            if len(lines) == PDF_LINES_ON_PAGE:
+                yield write_page(lines)
+                lines = []
+        if lines or not page_ids:
+            yield write_page(lines)
+        kids = b' '.join(b'%d 0 R' % page_id for page_id in page_ids)
+        yield write_object(2, b'<< /Type /Pages /Kids [%s] /Count %d >>'
+                           % (kids, len(page_ids)))
+        yield write_object(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+        size = max(offsets) + 1
+        xref = [b'xref\n0 %d\n' % size, b'0000000000 65535 f \n']
+        xref.extend(b'%010d 00000 n \n' % offsets[obj_id]
+                    for obj_id in range(1, size))
+        xref.append(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n'
+                    b'%%%%EOF\n' % (size, position))
+        yield b''.join(xref)
+
+    @staticmethod
+    def _escape(line):
+        return (line.encode(PDF_ENCODING, errors='replace')
+                .replace(b'\\', b'\\\\')
+                .replace(b'(', b'\\(')
+                .replace(b')', b'\\)'))
+
+    def _page_content(self, lines):
+        content = [b'BT /F1 %d Tf %d TL %d %d Td' % (
+            PDF_FONT_SIZE, PDF_LEADING, PDF_MARGIN,
+            PDF_PAGE_HEIGHT - PDF_MARGIN)]
+        content.extend(b'(%s) Tj T*' % self._escape(line) for line in lines)
+        content.append(b'ET')
+        return b'\n'.join(content)
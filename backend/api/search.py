@@ -0,0 +1,373 @@
+import re
+from bisect import bisect_left
+from collections import Counter
+from threading import Lock
+
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            TrigramSimilarity)
+from django.db import connection
+from django.db.models import Case, Count, F, IntegerField, Max, Q, When
+
+from recipes.models import (PRODUCTS_CATALOG, CatalogVersion, Ingredients,
+                            Product, Recipe)
+
+from .pantry import WATERMARK_OVERLAP
+
+FUZZY_MIN_SIMILARITY = 0.3
+# Сколько лучших рецептов выдаёт поиск без PostgreSQL: порядок задаётся
+# в запросе списком id. Если нашлось больше, страница выдачи сообщает об
+# этом (search_limit и search_total, см. RecipePagination).
+RECIPE_SEARCH_MAX_RESULTS = 1000
+# Веса полей рецепта, как у ts_rank для A, B и C.
+RECIPE_FIELD_WEIGHTS = {'name': 1.0, 'products': 0.4, 'text': 0.2}
+WORD = re.compile(r'\w+')
+RUSSIAN_ENDINGS = sorted((
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ее',
+    'ие', 'ые', 'ое', 'ей', 'ий', 'ый', 'ой', 'ем', 'им', 'ым', 'ом', 'ах',
+    'ях', 'ию', 'ью', 'ия', 'ья', 'ов', 'ев', 'ам', 'ям', 'ую', 'юю', 'ая',
+    'яя', 'а', 'я', 'о', 'е', 'и', 'ы', 'у', 'ю', 'ь', 'й',
+), key=len, reverse=True)
+STOP_WORDS = frozenset((
+    'и', 'в', 'во', 'на', 'с', 'со', 'по', 'для', 'из', 'к', 'от', 'до',
+    'не', 'а', 'но', 'или', 'за', 'у', 'о', 'об',
+))
+
+
+def substrings(value, size=3):
+    return {value[i:i + size] for i in range(len(value) - size + 1)}
+
+
+def trigrams(value):
+    """Триграммы строки так же, как их считает pg_trgm: каждое слово
+    дополняется двумя пробелами в начале и одним в конце."""
+    result = set()
+    for word in value.lower().split():
+        word = f'  {word} '
+        result.update(word[i:i + 3] for i in range(len(word) - 2))
+    return result
+
+
+class PostgresProductSearch:
+    """Поиск по индексам pg_trgm (см. миграцию 0005_product_search)."""
+
+    def search(self, queryset, query, limit):
+        similar = Q(name__trigram_similar=query)
+        return queryset.filter(
+            Q(name__icontains=query) | similar
+        ).annotate(
+            rank=Case(
+                When(name__istartswith=query, then=0),
+                When(name__icontains=query, then=1),
+                default=2,
+                output_field=IntegerField(),
+            ),
+            similarity=TrigramSimilarity('name', query),
+        ).order_by('rank', '-similarity', 'name')[:limit]
+
+
+class InMemoryProductSearch:
+    """Индекс продуктов в памяти процесса для баз без pg_trgm.
+    Отсортированный массив названий для поиска по префиксу, полный
+    просмотр для поиска подстроки и инвертированный индекс триграмм для
+    нечёткого поиска. Индекс пересобирается, когда меняется версия
+    справочника продуктов."""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.version = None
+        # (названия, id, подстрока из трёх символов -> позиции названий,
+        # триграмма -> id, id -> число триграмм) заменяются целиком, чтобы
+        # поиск не видел наполовину пересобранный индекс.
+        self.index = ((), (), {}, {}, {})
+
+    def build(self, version):
+        rows = sorted(
+            (name.lower(), product_id)
+            for product_id, name in Product.objects.values_list('id', 'name')
+        )
+        substring_index = {}
+        trigram_index = {}
+        trigram_counts = {}
+        for position, (name, product_id) in enumerate(rows):
+            for substring in substrings(name):
+                substring_index.setdefault(substring, []).append(position)
+            name_trigrams = trigrams(name)
+            trigram_counts[product_id] = len(name_trigrams)
+            for trigram in name_trigrams:
+                trigram_index.setdefault(trigram, []).append(product_id)
+        self.index = (
+            [name for name, product_id in rows],
+            [product_id for name, product_id in rows],
+            substring_index,
+            trigram_index,
+            trigram_counts,
+        )
+        self.version = version
+
+    def ensure_built(self):
+        version, updated_at = CatalogVersion.objects.current(
+            PRODUCTS_CATALOG)
+        if self.version != version:
+            with self.lock:
+                if self.version != version:
+                    self.build(version)
+
+    def ranked_ids(self, query, limit):
+        (names, ids, substring_index,
+         trigram_index, trigram_counts) = self.index
+        query = query.lower()
+        found = []
+        position = bisect_left(names, query)
+        while (len(found) < limit and position < len(names)
+               and names[position].startswith(query)):
+            found.append(ids[position])
+            position += 1
+        seen = set(found)
+        if len(found) < limit:
+            for position in self.substring_positions(
+                    query, substring_index, len(names)):
+                product_id = ids[position]
+                if product_id not in seen and query in names[position]:
+                    found.append(product_id)
+                    seen.add(product_id)
+                    if len(found) == limit:
+                        break
+        if len(found) < limit:
+            found.extend(self.fuzzy_ids(
+                query, limit - len(found), seen,
+                trigram_index, trigram_counts))
+        return found
+
+    @staticmethod
+    def substring_positions(query, substring_index, size):
+        """Позиции названий, в которых есть все трёхсимвольные подстроки
+        запроса. Для коротких запросов - все названия."""
+        postings = sorted(
+            (substring_index.get(substring, ())
+             for substring in substrings(query)),
+            key=len,
+        )
+        if not postings:
+            return range(size)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates.intersection_update(posting)
+            if not candidates:
+                break
+        return sorted(candidates)
+
+    @staticmethod
+    def fuzzy_ids(query, limit, exclude, trigram_index, trigram_counts):
+        query_trigrams = trigrams(query)
+        common = Counter()
+        for trigram in query_trigrams:
+            common.update(trigram_index.get(trigram, ()))
+        # Сходство не больше count / len(query_trigrams): кандидаты с малым
+        # числом общих триграмм отбрасываются без подсчёта сходства.
+        min_count = FUZZY_MIN_SIMILARITY * len(query_trigrams)
+        scored = []
+        for product_id, count in common.items():
+            if count < min_count or product_id in exclude:
+                continue
+            similarity = count / (len(query_trigrams)
+                                  + trigram_counts[product_id] - count)
+            if similarity >= FUZZY_MIN_SIMILARITY:
+                scored.append((-similarity, product_id))
+        scored.sort()
+        return [product_id for similarity, product_id in scored[:limit]]
+
+    def search(self, queryset, query, limit):
+        self.ensure_built()
+        ids = self.ranked_ids(query, limit)
+        if not ids:
+            return queryset.none()
+        return queryset.filter(id__in=ids).order_by(Case(
+            *(When(id=product_id, then=position)
+              for position, product_id in enumerate(ids)),
+            output_field=IntegerField(),
+        ))
+
+
+def stem(word):
+    """Упрощённый стемминг: отбрасывает одно падежное или родовое
+    окончание, оставляя основу не короче трёх букв."""
+    for ending in RUSSIAN_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+    return word
+
+
+def terms(text):
+    return {
+        stem(word) for word in WORD.findall(text.lower().replace('ё', 'е'))
+        if word not in STOP_WORDS
+    }
+
+
+class PostgresRecipeSearch:
+    """Полнотекстовый поиск по Recipe.search_vector (GIN индекс, см.
+    миграцию 0010_recipe_search)."""
+
+    def search(self, queryset, query):
+        """Найденные рецепты по убыванию релевантности и None: выдача не
+        ограничена."""
+        search_query = SearchQuery(
+            query, config='russian', search_type='websearch')
+        return queryset.filter(search_vector=search_query).annotate(
+            rank=SearchRank(F('search_vector'), search_query),
+        ).order_by('-rank', '-pub_date', '-id'), None
+
+
+class InMemoryRecipeSearch:
+    """Инвертированный индекс рецептов в памяти процесса для баз без
+    полнотекстового поиска: основа слова -> {id рецепта: вес}. Находятся
+    рецепты, в которых есть все слова запроса; вес слова - наибольший из
+    весов полей, где оно встретилось. Когда меняются рецепты (их число или
+    последний updated_at), индекс дочитывает только рецепты с updated_at
+    не раньше последнего прочитанного (с запасом WATERMARK_OVERLAP) и
+    убирает удалённые; при смене справочника продуктов - пересобирается."""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.version = None
+        self.products_version = None
+        self.clear()
+
+    def clear(self):
+        self.watermark = None
+        self.postings = {}
+        self.recipe_terms = {}
+        # id -> ключ сортировки от новых рецептов к старым.
+        self.recency = {}
+
+    @staticmethod
+    def current_version():
+        state = Recipe.objects.aggregate(Count('id'), Max('updated_at'))
+        version, updated_at = CatalogVersion.objects.current(
+            PRODUCTS_CATALOG)
+        return tuple(state.values()) + (version,)
+
+    def discard(self, term, recipe_id):
+        posting = self.postings[term]
+        posting.pop(recipe_id, None)
+        if not posting:
+            del self.postings[term]
+
+    def set_recipe(self, recipe_id, recipe_terms):
+        for term in self.recipe_terms.get(recipe_id, {}):
+            if term not in recipe_terms:
+                self.discard(term, recipe_id)
+        for term, weight in recipe_terms.items():
+            self.postings.setdefault(term, {})[recipe_id] = weight
+        self.recipe_terms[recipe_id] = recipe_terms
+
+    def remove_recipe(self, recipe_id):
+        for term in self.recipe_terms.pop(recipe_id, {}):
+            self.discard(term, recipe_id)
+        self.recency.pop(recipe_id, None)
+
+    def load(self):
+        """Перечитывает рецепты, изменённые после watermark, при первом
+        вызове - все."""
+        recipes = Recipe.objects.all()
+        ingredients = Ingredients.objects.all()
+        if self.watermark is not None:
+            since = self.watermark - WATERMARK_OVERLAP
+            recipes = recipes.filter(updated_at__gte=since)
+            ingredients = ingredients.filter(recipe__updated_at__gte=since)
+        products = {}
+        for recipe_id, name in ingredients.values_list(
+                'recipe', 'ingredients__name'):
+            products.setdefault(recipe_id, []).append(name)
+        latest = self.watermark
+        for recipe_id, name, text, pub_date, updated_at in (
+                recipes.values_list(
+                    'id', 'name', 'text', 'pub_date', 'updated_at')):
+            if latest is None or updated_at > latest:
+                latest = updated_at
+            self.recency[recipe_id] = (-pub_date.timestamp(), -recipe_id)
+            fields = {
+                'name': name,
+                'products': ' '.join(products.get(recipe_id, ())),
+                'text': text,
+            }
+            recipe_terms = {}
+            for field, value in fields.items():
+                weight = RECIPE_FIELD_WEIGHTS[field]
+                for term in terms(value):
+                    if recipe_terms.get(term, 0) < weight:
+                        recipe_terms[term] = weight
+            self.set_recipe(recipe_id, recipe_terms)
+        self.watermark = latest
+
+    def remove_deleted(self):
+        existing = set(Recipe.objects.values_list('id', flat=True))
+        for recipe_id in set(self.recipe_terms) - existing:
+            self.remove_recipe(recipe_id)
+
+    def ensure_built(self):
+        version = self.current_version()
+        if self.version == version:
+            return
+        with self.lock:
+            if self.version == version:
+                return
+            if self.products_version != version[-1]:
+                # Названия продуктов могли измениться у любых рецептов.
+                self.clear()
+                self.products_version = version[-1]
+            self.load()
+            self.remove_deleted()
+            self.version = version
+
+    def ranked_ids(self, query):
+        with self.lock:
+            query_postings = sorted(
+                (self.postings.get(term, {}) for term in terms(query)),
+                key=len)
+            if not query_postings:
+                return []
+            candidates = set(query_postings[0])
+            for posting in query_postings[1:]:
+                candidates.intersection_update(posting)
+            return sorted(
+                candidates,
+                key=lambda recipe_id: (
+                    -sum(posting[recipe_id] for posting in query_postings),
+                    self.recency[recipe_id],
+                ),
+            )
+
+    def search(self, queryset, query):
+        """Не больше RECIPE_SEARCH_MAX_RESULTS лучших рецептов и сколько
+        рецептов нашлось всего (до фильтров queryset)."""
+        self.ensure_built()
+        ids = self.ranked_ids(query)
+        if not ids:
+            return queryset.none(), 0
+        return queryset.filter(
+            id__in=ids[:RECIPE_SEARCH_MAX_RESULTS],
+        ).order_by(Case(
+            *(When(id=recipe_id, then=position)
+              for position, recipe_id in enumerate(
+                  ids[:RECIPE_SEARCH_MAX_RESULTS])),
+            output_field=IntegerField(),
+        )), len(ids)
+
+
+in_memory_product_search = InMemoryProductSearch()
+postgres_product_search = PostgresProductSearch()
+in_memory_recipe_search = InMemoryRecipeSearch()
+postgres_recipe_search = PostgresRecipeSearch()
+
+
+def get_product_search():
+    if connection.vendor == 'postgresql':
+        return postgres_product_search
+    return in_memory_product_search
+
+
+def get_recipe_search():
+    if connection.vendor == 'postgresql':
+        return postgres_recipe_search
+    return in_memory_recipe_search
@@ -1,11 +1,16 @@
 from django.contrib.auth import get_user_model
+from django.db import transaction
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
-from recipes.models import (Cart, FavoritesRecipes, Ingredients, Product,
-                            Recipe, Tag)
-from users.serializers import Base64ImageField, UserFoodgramSerializer
+from recipes import timeline
+from recipes.models import (RECIPE_INGREDIENTS_VERSION, Cart, CartProduct,
+                            CatalogVersion, FavoritesRecipes, Ingredients,
+                            Product, Recipe, Tag)
+from users.serializers import (Base64ImageField, ImageSrcsetField,
+                               UserFoodgramSerializer)
 
+from .uploads import check_size, strip_metadata
 from .validators import ingredients_validate
 
 User = get_user_model()
@@ -34,7 +39,9 @@ class RecipeSerializer(serializers.ModelSerializer):
     author = UserFoodgramSerializer(read_only=True, many=False)
     ingredients = serializers.SerializerMethodField()
     tags = TagSerializer(read_only=True, many=True, )
-    image = Base64ImageField(required=False, allow_null=True)
+    image = Base64ImageField(
+        rendition='full', required=False, allow_null=True)
+    image_srcset = ImageSrcsetField()
 
     class Meta:
         fields = ('id',
@@ -45,22 +52,29 @@ class RecipeSerializer(serializers.ModelSerializer):
                   'is_in_shopping_cart',
                   'name',
                   'image',
+                  'image_srcset',
                   'text',
                   'cooking_time',
                   )
         model = Recipe
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         user = self.context.get('request').user
         return (user.is_authenticated
                 and obj.in_favorites.filter(user=user).exists())
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         user = self.context.get('request').user
         return user.is_authenticated and obj.in_cart.filter(user=user).exists()
 
     def get_ingredients(self, obj):
-        qs = Ingredients.objects.filter(recipe=obj)
+        qs = obj.product.all()
+        if 'product' not in getattr(obj, '_prefetched_objects_cache', {}):
+            qs = qs.select_related('ingredients')
         return IngredientsSerializer(qs, many=True).data
 
 
@@ -96,16 +110,11 @@ class ChangeRecipeSerializer(serializers.ModelSerializer):
         model = Recipe
 
     def validate_name(self, value):
-        if self.instance is None:
-            if Recipe.objects.filter(name__iexact=value).exists():
-                raise ValidationError('Такой рецепт уже есть')
-        else:
-            if Recipe.objects.filter(
-                    name__iexact=value,
-                    id=self.instance.id).exclude(
-                id=self.instance.id
-            ).exists():
-                raise ValidationError('Такой рецепт уже есть')
+        recipes = Recipe.objects.filter(name__iexact=value)
+        if self.instance is not None:
+            recipes = recipes.exclude(pk=self.instance.pk)
+        if recipes.exists():
+            raise ValidationError('Такой рецепт уже есть')
         return value
 
     def validate_cooking_time(self, value):
@@ -117,11 +126,11 @@ class ChangeRecipeSerializer(serializers.ModelSerializer):
         return set(value)
 
     def validate(self, data):
-        tags = data.get('tags')
-        if not tags:
-            raise ValidationError('Укажите тэг')
+        if not self.partial or 'tags' in data:
+            if not data.get('tags'):
+                raise ValidationError('Укажите тэг')
         ingredients = [
-            item['id'] for item in data['ingredients']]
+            item['id'] for item in data.get('ingredients', ())]
         if len(ingredients) > len(set(ingredients)):
             raise serializers.ValidationError(
                 'Нельзя один и тот же ингредиент добавить несколько раз'
@@ -133,7 +142,10 @@ class ChangeRecipeSerializer(serializers.ModelSerializer):
         context = {'request': request}
         return RecipeSerializer(instance, context=context).data
 
+    @transaction.atomic
     def create(self, validate_data):
+        """Рецепт создаётся целиком или никак. Версия составов рецептов и
+        ленты подписок обновляются только после фиксации транзакции."""
         ingredients = validate_data.pop('ingredients')
         tags = validate_data.pop('tags')
         recipe_obj = Recipe.objects.create(
@@ -142,39 +154,118 @@ class ChangeRecipeSerializer(serializers.ModelSerializer):
         list_ingredients = ingredients_validate(ingredients, recipe_obj)
         Ingredients.objects.bulk_create(list_ingredients)
         recipe_obj.tags.set(tags)
+        Recipe.objects.filter(pk=recipe_obj.pk).update_search_vector()
+        transaction.on_commit(
+            lambda: CatalogVersion.objects.bump(RECIPE_INGREDIENTS_VERSION))
+        transaction.on_commit(lambda: timeline.publish(recipe_obj))
         return recipe_obj
 
+    @transaction.atomic
     def update(self, obj, validate_data):
-        obj.tags.clear()
-        Ingredients.objects.filter(recipe=obj, ).delete()
-        ingredients = validate_data.pop('ingredients')
-        tags = validate_data.pop('tags')
-        list_ingredients = ingredients_validate(ingredients, obj)
-        Ingredients.objects.bulk_create(list_ingredients)
-        obj.tags.set(tags)
-        return super().update(obj, validate_data)
+        """Меняет только то, что изменилось. При частичном обновлении
+        (PATCH) без ingredients или tags эти таблицы не затрагиваются."""
+        ingredients = validate_data.pop('ingredients', None)
+        tags = validate_data.pop('tags', None)
+        if ingredients is not None:
+            self.update_ingredients(obj, ingredients)
+            CatalogVersion.objects.bump(RECIPE_INGREDIENTS_VERSION)
+        if tags is not None:
+            obj.tags.set(tags)
+        obj = super().update(obj, validate_data)
+        Recipe.objects.filter(pk=obj.pk).update_search_vector()
+        return obj
+
+    @staticmethod
+    def update_ingredients(obj, ingredients):
+        current = {
+            item.ingredients_id: item
+            for item in Ingredients.objects.filter(recipe=obj)
+        }
+        old_amounts = {
+            product_id: item.amount for product_id, item in current.items()
+        }
+        new_amounts = {}
+        created = []
+        changed = []
+        for item in ingredients_validate(ingredients, obj):
+            product_id = item.ingredients.id
+            new_amounts[product_id] = item.amount
+            existing = current.get(product_id)
+            if existing is None:
+                created.append(item)
+            elif existing.amount != item.amount:
+                existing.amount = item.amount
+                changed.append(existing)
+        removed = old_amounts.keys() - new_amounts.keys()
+        if removed:
+            Ingredients.objects.filter(
+                recipe=obj, ingredients__in=removed).delete()
+        if changed:
+            Ingredients.objects.bulk_update(changed, ('amount',))
+        if created:
+            Ingredients.objects.bulk_create(created)
+        if old_amounts != new_amounts:
+            CartProduct.objects.change_recipe(obj, old_amounts, new_amounts)
+
+
+class RecipeImageSerializer(serializers.ModelSerializer):
+    """Замена фото рецепта файлом, без base64."""
+    image = serializers.ImageField()
+
+    class Meta:
+        fields = ('image',)
+        model = Recipe
+
+    def to_internal_value(self, data):
+        # Размер проверяется раньше, чем Pillow откроет файл.
+        image = data.get('image')
+        if getattr(image, 'size', None) is not None:
+            check_size(image.size)
+        return super().to_internal_value(data)
+
+    def validate_image(self, value):
+        return strip_metadata(value)
+
+    def to_representation(self, instance):
+        return RecipeSerializer(instance, context=self.context).data
+
+
+class PantrySerializer(serializers.Serializer):
+    """Продукты, которые есть у пользователя, и сколько продуктов рецепта
+    может не хватать."""
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=500,
+    )
+    max_missing = serializers.IntegerField(min_value=0, required=False)
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    """Список id рецептов для пакетных операций с избранным и списком
+    покупок. Повторы убираются, порядок сохраняется."""
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=100,
+    )
+
+    def validate_recipes(self, value):
+        return list(dict.fromkeys(value))
 
 
 class IngredientsSerializer(serializers.ModelSerializer):
     """Получение данных для выдачи полноценного рецепта со всеми полями как
     указано в redoc."""
-    id = serializers.SerializerMethodField()
-    name = serializers.SerializerMethodField()
-    measurement_unit = serializers.SerializerMethodField()
+    id = serializers.ReadOnlyField(source='ingredients.id')
+    name = serializers.ReadOnlyField(source='ingredients.name')
+    measurement_unit = serializers.ReadOnlyField(
+        source='ingredients.measurement_unit')
 
     class Meta:
         fields = ('id', 'name', 'measurement_unit', 'amount')
         model = Ingredients
 
-    def get_id(self, obj):
-        return obj.ingredients.id
-
-    def get_name(self, obj):
-        return obj.ingredients.name
-
-    def get_measurement_unit(self, obj):
-        return obj.ingredients.measurement_unit
-
 
 class FavoritesRecipesSerializer(serializers.ModelSerializer):
     """Избранные рецепты."""
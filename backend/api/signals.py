@@ -0,0 +1,83 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from recipes.images import image_pipeline
+from recipes.models import (PRODUCTS_CATALOG, RECIPE_INGREDIENTS_VERSION,
+                            TAGS_CATALOG, Cart, CartProduct, CatalogVersion,
+                            FavoritesRecipes, Product, Recipe, Tag)
+from users.models import Subscriptions
+
+User = get_user_model()
+
+COUNTED_MODELS = (Recipe, FavoritesRecipes, Cart, Subscriptions)
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def bump_tags_version(**kwargs):
+    CatalogVersion.objects.bump(TAGS_CATALOG)
+
+
+@receiver((post_save, post_delete), sender=Product)
+def bump_products_version(**kwargs):
+    CatalogVersion.objects.bump(PRODUCTS_CATALOG)
+
+
+@receiver(post_save, sender=Product)
+def update_recipes_search_vector(instance, created, **kwargs):
+    if not created:
+        Recipe.objects.filter(
+            ingredients=instance).update_search_vector()
+
+
+@receiver(post_save, sender=Recipe)
+def schedule_image_processing(instance, **kwargs):
+    image_pipeline.schedule(instance)
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_from_cart_products(instance, **kwargs):
+    """Удаление рецепта из API, админки и запросом: корзины удаляются
+    каскадом, а из сводных списков покупок рецепт вычитается здесь."""
+    CartProduct.objects.remove_recipe(
+        instance.in_cart.values_list('user', flat=True), instance)
+
+
+@receiver(post_delete, sender=Recipe)
+def bump_recipe_ingredients_version(**kwargs):
+    CatalogVersion.objects.bump(RECIPE_INGREDIENTS_VERSION)
+
+
+def counter_row(instance):
+    return {
+        field_name: getattr(
+            instance, instance._meta.get_field(field_name).attname)
+        for field_name in instance.counters
+    }
+
+
+def count_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        sender.objects.update_counters([counter_row(instance)], 1)
+
+
+@receiver(post_delete, sender=Recipe)
+def count_deleted(sender, instance, **kwargs):
+    sender.objects.update_counters([counter_row(instance)], -1)
+
+
+@receiver(pre_delete, sender=User)
+def discount_user_relations(instance, **kwargs):
+    """Избранное, корзина и подписки пользователя удаляются каскадом
+    одним DELETE на таблицу; счётчики рецептов и авторов меняются здесь
+    группировкой, а не по строке."""
+    for model in (FavoritesRecipes, Cart, Subscriptions):
+        relations = model.objects.filter(user=instance)
+        relations.discount()
+        model.on_remove(relations)
+
+
+# Счётчики меняет Model.save(). Связи удаляют свои строки без сигналов
+# (см. RelationModel), запросы RelationQuerySet меняют счётчики сами.
+for model in COUNTED_MODELS:
+    post_save.connect(count_created, sender=model)
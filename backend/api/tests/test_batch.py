@@ -0,0 +1,71 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from recipes.models import Cart, FavoritesRecipes, Recipe
+
+User = get_user_model()
+
+
+class BatchRelationsTest(TestCase):
+    """Пакетное добавление в избранное и список покупок."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(
+            username='author', email='author@example.com')
+        cls.user = User.objects.create(
+            username='user', email='user@example.com')
+        cls.recipes = [
+            Recipe.objects.create(
+                author=cls.author, name=f'Рецепт {i}', text='Описание',
+                cooking_time=10)
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_all_duplicates(self):
+        """Если все рецепты уже добавлены, ответ 200 со статусом exists,
+        а счётчики не меняются."""
+        ids = [recipe.id for recipe in self.recipes]
+        for url, model, counter in (
+                ('/api/recipes/favorite/', FavoritesRecipes,
+                 'favorites_count'),
+                ('/api/recipes/shopping_cart/', Cart, 'cart_count')):
+            with self.subTest(url=url):
+                response = self.client.post(
+                    url, {'recipes': ids}, format='json')
+                self.assertEqual(response.status_code, 200)
+                response = self.client.post(
+                    url, {'recipes': ids}, format='json')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(
+                    [item['status'] for item in response.data['results']],
+                    ['exists'] * len(ids))
+                self.assertEqual(
+                    model.objects.filter(user=self.user).count(), len(ids))
+                self.assertEqual(
+                    list(Recipe.objects.filter(id__in=ids).values_list(
+                        counter, flat=True)),
+                    [1] * len(ids))
+
+    def test_create_many_empty(self):
+        self.assertEqual(FavoritesRecipes.objects.create_many([]), 0)
+
+    def test_create_many_recounts_only_given_recipes(self):
+        """Если часть строк уже была, пересчитываются только счётчики
+        рецептов из этих строк."""
+        first, second, other = self.recipes
+        FavoritesRecipes.objects.create(user=self.user, recipe=first)
+        Recipe.objects.filter(id=other.id).update(favorites_count=5)
+        inserted = FavoritesRecipes.objects.create_many([
+            {'user': self.user, 'recipe_id': first.id},
+            {'user': self.user, 'recipe_id': second.id},
+        ])
+        self.assertEqual(inserted, 1)
+        self.assertEqual(
+            dict(Recipe.objects.values_list('id', 'favorites_count')),
+            {first.id: 1, second.id: 1, other.id: 5})
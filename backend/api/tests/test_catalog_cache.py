@@ -0,0 +1,28 @@
+from django.core.cache import cache
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from recipes.models import Product
+
+
+class ProductCacheTest(TestCase):
+    """Условные запросы к справочнику продуктов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        Product.objects.create(name='соль', measurement_unit='г')
+
+    def setUp(self):
+        self.client = APIClient()
+        cache.clear()
+
+    def test_if_none_match_on_cold_cache(self):
+        for url in ('/api/ingredients/', '/api/ingredients/?name=со'):
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                cache.clear()
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.data), 1)
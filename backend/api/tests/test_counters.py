@@ -0,0 +1,69 @@
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from recipes.models import Cart, FavoritesRecipes, Recipe
+from users.models import Subscriptions
+
+User = get_user_model()
+
+
+class CascadeCountersTest(TestCase):
+    """Счётчики при каскадном удалении рецептов и пользователей."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(
+            username='author', email='author@example.com')
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='Рецепт', text='Описание',
+            cooking_time=10)
+        cls.other = Recipe.objects.create(
+            author=cls.author, name='Другой рецепт', text='Описание',
+            cooking_time=10)
+        cls.users = User.objects.bulk_create(
+            User(username=f'user{i}', email=f'user{i}@example.com')
+            for i in range(30))
+        cls.users = list(User.objects.exclude(id=cls.author.id))
+        for model in (FavoritesRecipes, Cart):
+            model.objects.create_many(
+                [{'user': user, 'recipe': recipe}
+                 for user in cls.users for recipe in (cls.recipe, cls.other)])
+        Subscriptions.objects.create_many(
+            [{'user': user, 'author': cls.author} for user in cls.users])
+
+    def test_recipe_delete_does_not_depend_on_relations(self):
+        """Удаление рецепта не делает запрос на каждую строку избранного
+        и корзины."""
+        client = APIClient()
+        client.force_authenticate(self.author)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.delete(f'/api/recipes/{self.recipe.id}/')
+        self.assertEqual(response.status_code, 204)
+        self.assertLess(len(queries), len(self.users))
+        self.assertFalse(FavoritesRecipes.objects.filter(
+            recipe=self.recipe.id).exists())
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 1)
+
+    def test_user_delete_discounts_relations(self):
+        user = self.users[0]
+        user.delete()
+        self.other.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual(self.other.favorites_count, len(self.users) - 1)
+        self.assertEqual(self.other.cart_count, len(self.users) - 1)
+        self.assertEqual(self.author.subscribers_count, len(self.users) - 1)
+        self.assertEqual([
+            drift for model in (Recipe, FavoritesRecipes, Cart, Subscriptions)
+            for drift in model.objects.counter_drift()
+        ], [])
+
+    def test_queryset_and_instance_delete(self):
+        FavoritesRecipes.objects.filter(user__in=self.users[:3]).delete()
+        Cart.objects.get(user=self.users[0], recipe=self.other).delete()
+        self.other.refresh_from_db()
+        self.assertEqual(self.other.favorites_count, len(self.users) - 3)
+        self.assertEqual(self.other.cart_count, len(self.users) - 1)
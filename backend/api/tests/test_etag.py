@@ -0,0 +1,40 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from recipes.models import Recipe
+
+User = get_user_model()
+
+
+class AuthorProfileEtagTest(TestCase):
+    """Изменение профиля автора меняет ETag и тело выдачи рецептов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(
+            username='author', email='author@example.com',
+            first_name='Анна')
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='Рецепт', text='Описание',
+            cooking_time=10)
+
+    def setUp(self):
+        self.client = APIClient()
+        cache.clear()
+
+    def test_profile_change(self):
+        for url, author in (
+                (f'/api/recipes/{self.recipe.id}/',
+                 lambda data: data['author']),
+                ('/api/recipes/', lambda data: data['results'][0]['author'])):
+            with self.subTest(url=url):
+                self.author.first_name = 'Анна'
+                self.author.save()
+                etag = self.client.get(url)['ETag']
+                self.author.first_name = 'Мария'
+                self.author.save()
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(author(response.data)['first_name'], 'Мария')
@@ -0,0 +1,39 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from recipes.models import Recipe
+
+User = get_user_model()
+
+
+class RecipeCursorTest(TestCase):
+    """Выдача по курсору не подменяет запрошенный порядок."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create(
+            username='author', email='author@example.com')
+        for number in range(3):
+            Recipe.objects.create(
+                author=author, name=f'Суп {number}', text='Описание',
+                cooking_time=10, trending_score=number)
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_cursor_by_date(self):
+        response = self.client.get('/api/recipes/?cursor=&limit=2')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(response.data['next'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_cursor_with_other_order(self):
+        for query in ('ordering=trending', 'search=суп'):
+            with self.subTest(query=query):
+                response = self.client.get(f'/api/recipes/?cursor=&{query}')
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('cursor', response.data)
+                response = self.client.get(f'/api/recipes/?{query}')
+                self.assertEqual(response.status_code, 200)
@@ -0,0 +1,50 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from recipes.models import Ingredients, Product, Recipe, Tag
+
+User = get_user_model()
+
+
+class RecipeListQueriesTest(TestCase):
+    """Число запросов выдачи рецептов не зависит от размера страницы."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(
+            username='user', email='user@example.com')
+        tags = [
+            Tag.objects.create(name=f'Тэг {i}', color=color, slug=f'tag{i}')
+            for i, color in enumerate(('#00ff00', '#ff0000'))]
+        products = [
+            Product.objects.create(name=f'продукт {i}', measurement_unit='г')
+            for i in range(4)]
+        for i in range(8):
+            recipe = Recipe.objects.create(
+                author=cls.user, name=f'Рецепт {i}', text='Описание',
+                cooking_time=10)
+            recipe.tags.set(tags)
+            Ingredients.objects.bulk_create(
+                Ingredients(recipe=recipe, ingredients=product, amount=1)
+                for product in products)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_list_queries_do_not_grow_with_page_size(self):
+        """Без кэша: фильтр тэгов, count, состояние страницы, версии
+        справочников, рецепты, авторы, ингредиенты и тэги. С кэшем общей
+        части выдачи - только первые четыре."""
+        for limit in (2, 6):
+            cache.clear()
+            url = f'/api/recipes/?limit={limit}'
+            with self.subTest(limit=limit):
+                with self.assertNumQueries(8):
+                    response = self.client.get(url)
+                self.assertEqual(len(response.data['results']), limit)
+                with self.assertNumQueries(4):
+                    self.client.get(url)
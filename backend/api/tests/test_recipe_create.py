@@ -0,0 +1,53 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from recipes.models import Product, Recipe, RecipeQuerySet, Tag, TimelineEntry
+from users.models import Subscriptions
+
+User = get_user_model()
+
+
+class RecipeCreateTest(TestCase):
+    """Рецепт создаётся в одной транзакции, в ленты - после неё."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(
+            username='author', email='author@example.com')
+        cls.follower = User.objects.create(
+            username='follower', email='follower@example.com')
+        Subscriptions.objects.create(user=cls.follower, author=cls.author)
+        cls.tag = Tag.objects.create(name='Тэг', color='#00ff00', slug='tag')
+        cls.product = Product.objects.create(
+            name='продукт', measurement_unit='г')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def create(self):
+        return self.client.post('/api/recipes/', {
+            'name': 'Рецепт', 'text': 'Описание', 'cooking_time': 10,
+            'tags': [self.tag.id],
+            'ingredients': [{'id': self.product.id, 'amount': 1}],
+        }, format='json')
+
+    def test_published_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.create()
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.follower, recipe=response.data['id']).exists())
+
+    def test_failure_leaves_nothing(self):
+        with self.captureOnCommitCallbacks() as callbacks, mock.patch.object(
+                RecipeQuerySet, 'update_search_vector',
+                side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.create()
+        self.assertEqual(callbacks, [])
+        self.assertFalse(Recipe.objects.exists())
+        self.assertFalse(TimelineEntry.objects.exists())
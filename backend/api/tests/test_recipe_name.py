@@ -0,0 +1,36 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from recipes.models import Recipe
+
+User = get_user_model()
+
+
+class RecipeNameTest(TestCase):
+    """Название рецепта не повторяет названия других рецептов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(
+            username='user', email='user@example.com')
+        cls.recipe, cls.other = (
+            Recipe.objects.create(author=cls.user, name=name,
+                                  text='Описание', cooking_time=10)
+            for name in ('Борщ', 'Щи'))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def rename(self, name):
+        return self.client.patch(
+            f'/api/recipes/{self.recipe.id}/', {'name': name}, format='json')
+
+    def test_own_name_in_other_case(self):
+        self.assertEqual(self.rename('БОРЩ').status_code, 200)
+
+    def test_name_of_other_recipe(self):
+        response = self.rename('Щи')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('name', response.data)
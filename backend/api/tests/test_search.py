@@ -0,0 +1,82 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from api import filters, pagination, search
+from recipes.models import Recipe
+
+User = get_user_model()
+
+
+class InMemoryRecipeSearchTest(TestCase):
+    """Индекс рецептов дочитывает изменения, а не пересобирается."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create(
+            username='author', email='author@example.com')
+        cls.soup, cls.salad, cls.cake = (
+            Recipe.objects.create(author=author, name=name, text='Описание',
+                                  cooking_time=10)
+            for name in ('Борщ', 'Салат', 'Торт'))
+        for days, recipe in enumerate((cls.cake, cls.salad, cls.soup), 1):
+            Recipe.objects.filter(pk=recipe.pk).update(
+                updated_at=timezone.now() - timedelta(days=days))
+
+    def setUp(self):
+        self.index = search.InMemoryRecipeSearch()
+
+    def found(self, query):
+        recipes, total = self.index.search(Recipe.objects.all(), query)
+        return list(recipes.values_list('id', flat=True))
+
+    def test_reads_only_changed_recipes(self):
+        self.assertEqual(self.found('борщ'), [self.soup.id])
+        self.salad.name = 'Винегрет'
+        self.salad.save()
+        with mock.patch.object(search, 'terms', wraps=search.terms) as terms:
+            self.assertEqual(self.found('винегрет'), [self.salad.id])
+        # Поля изменённого рецепта, последнего прочитанного (запас
+        # WATERMARK_OVERLAP) и запрос, но не остальных рецептов.
+        self.assertEqual(terms.call_count, 7)
+        self.assertEqual(self.found('салат'), [])
+
+    def test_drops_deleted_recipes(self):
+        self.assertEqual(self.found('торт'), [self.cake.id])
+        self.cake.delete()
+        self.assertEqual(self.found('торт'), [])
+        self.assertNotIn(self.cake.id, self.index.recency)
+
+
+class SearchLimitTest(TestCase):
+    """Поиск без PostgreSQL сообщает, что выдал не все рецепты."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create(
+            username='author', email='author@example.com')
+        for number in range(5):
+            Recipe.objects.create(author=author, name=f'Суп {number}',
+                                  text='Описание', cooking_time=10)
+
+    def get(self, query):
+        return APIClient().get(f'/api/recipes/?limit=2&search={query}')
+
+    def setUp(self):
+        for module in (search, filters, pagination):
+            patcher = mock.patch.object(
+                module, 'RECIPE_SEARCH_MAX_RESULTS', 3)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_truncated_search(self):
+        response = self.get('суп')
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual(response.data['search_limit'], 3)
+        self.assertEqual(response.data['search_total'], 5)
+        response = self.get('суп 1')
+        self.assertNotIn('search_total', response.data)
@@ -0,0 +1,120 @@
+import base64
+import shutil
+import tempfile
+from io import BytesIO
+
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.test import TestCase, override_settings
+from PIL import Image
+from rest_framework.test import APIClient
+
+from recipes.models import Product, Recipe, Tag
+
+User = get_user_model()
+MEDIA_ROOT = tempfile.mkdtemp()
+GPS_TAG = 0x8825
+
+
+def jpeg_with_exif():
+    image = Image.new('RGB', (40, 20), (200, 30, 30))
+    exif = Image.Exif()
+    exif[0x010F] = 'Camera'
+    exif[GPS_TAG] = {1: 'N', 2: (55.0, 45.0, 0.0)}
+    buffer = BytesIO()
+    image.save(buffer, format='JPEG', exif=exif)
+    return buffer.getvalue()
+
+
+def truncated_jpeg():
+    """JPEG, у которого заголовок цел, а данных нет наполовину: проверку
+    ImageField он проходит."""
+    buffer = BytesIO()
+    Image.effect_noise((400, 300), 64).convert('RGB').save(
+        buffer, format='JPEG')
+    data = buffer.getvalue()
+    return data[:len(data) // 2]
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, IMAGE_PIPELINE_MODE='queue')
+class UploadMetadataTest(TestCase):
+    """Исходное фото сохраняется без EXIF."""
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(
+            username='user', email='user@example.com')
+        cls.tag = Tag.objects.create(name='Тэг', color='#00ff00', slug='tag')
+        cls.product = Product.objects.create(
+            name='продукт', measurement_unit='г')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assert_stripped(self, recipe_id):
+        recipe = Recipe.objects.get(id=recipe_id)
+        with default_storage.open(recipe.image.name) as file:
+            image = Image.open(BytesIO(file.read()))
+        self.assertEqual(image.format, 'JPEG')
+        self.assertEqual(dict(image.getexif()), {})
+        self.assertEqual(image.size, (40, 20))
+        self.assertNotIn('temp', recipe.image.name)
+
+    def test_base64_image(self):
+        data = base64.b64encode(jpeg_with_exif()).decode()
+        response = self.client.post('/api/recipes/', {
+            'name': 'Рецепт', 'text': 'Описание', 'cooking_time': 10,
+            'tags': [self.tag.id],
+            'ingredients': [{'id': self.product.id, 'amount': 1}],
+            'image': f'data:image/jpeg;base64,{data}',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assert_stripped(response.data['id'])
+
+    def test_raw_upload(self):
+        recipe = Recipe.objects.create(
+            author=self.user, name='Рецепт', text='Описание',
+            cooking_time=10)
+        response = self.client.put(
+            f'/api/recipes/{recipe.id}/image/', jpeg_with_exif(),
+            content_type='image/jpeg')
+        self.assertEqual(response.status_code, 200)
+        self.assert_stripped(recipe.id)
+
+    def test_raw_upload_error_is_keyed_by_field(self):
+        recipe = Recipe.objects.create(
+            author=self.user, name='Рецепт', text='Описание',
+            cooking_time=10)
+        response = self.client.put(
+            f'/api/recipes/{recipe.id}/image/', b'not an image',
+            content_type='image/jpeg')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(response.data), ['image'])
+
+    def test_truncated_base64_image(self):
+        data = base64.b64encode(truncated_jpeg()).decode()
+        response = self.client.post('/api/recipes/', {
+            'name': 'Рецепт', 'text': 'Описание', 'cooking_time': 10,
+            'tags': [self.tag.id],
+            'ingredients': [{'id': self.product.id, 'amount': 1}],
+            'image': f'data:image/jpeg;base64,{data}',
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('image', response.data)
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_truncated_raw_upload(self):
+        recipe = Recipe.objects.create(
+            author=self.user, name='Рецепт', text='Описание',
+            cooking_time=10)
+        response = self.client.put(
+            f'/api/recipes/{recipe.id}/image/', truncated_jpeg(),
+            content_type='image/jpeg')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('image', response.data)
@@ -0,0 +1,159 @@
+"""Приём загружаемых фото: base64 из JSON и тело запроса пишутся по
+частям во временный файл с ограничением размера. Перед сохранением фото
+пересохраняется без метаданных."""
+import base64
+import binascii
+import re
+import uuid
+
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from PIL import Image, ImageOps
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+# Кратно 4, чтобы части декодировались независимо.
+BASE64_CHUNK_SIZE = 64 * 1024
+UPLOAD_CHUNK_SIZE = 64 * 1024
+DATA_URI = re.compile(r'data:(?P<content_type>image/[\w.+-]+);base64,')
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'BM', 'bmp'),
+)
+ORIENTATION_TAG = 0x0112
+
+
+class RequestEntityTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Слишком большой файл'
+    default_code = 'too_large'
+
+
+class UploadedImage(TemporaryUploadedFile):
+    """Фото во временном файле. Загруженные так файлы не закрывает запрос,
+    а временный файл уже может быть перенесён в хранилище, поэтому файл
+    закрывается при удалении объекта."""
+
+    def __del__(self):
+        self.close()
+
+
+def image_extension(head):
+    """Расширение по первым байтам файла или None, если это не фото."""
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    for signature, extension in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return extension
+    return None
+
+
+def check_size(size):
+    limit = settings.IMAGE_UPLOAD_MAX_SIZE
+    if size > limit:
+        raise RequestEntityTooLarge(
+            f'Размер фото больше {limit / (1024 * 1024):.3g} МБ')
+
+
+def save_chunks(chunks, content_type):
+    """Записывает фото по частям во временный файл. Тип проверяется по
+    первым байтам, размер - по мере записи, так что неподходящие данные
+    отбрасываются сразу, не дочитываясь до конца. Имя файла случайное:
+    исходное имя в data URI и теле запроса не передаётся."""
+    file = UploadedImage('temp', content_type, 0, None)
+    size = 0
+    extension = None
+    try:
+        for chunk in chunks:
+            if not chunk:
+                continue
+            if extension is None:
+                extension = image_extension(chunk)
+                if extension is None:
+                    raise ValidationError(
+                        'Загрузите фото в формате jpeg, png, gif, bmp '
+                        'или webp')
+            size += len(chunk)
+            check_size(size)
+            file.write(chunk)
+        if extension is None:
+            raise ValidationError('Пустой файл')
+    except Exception:
+        file.close()
+        raise
+    file.seek(0)
+    file.size = size
+    file.name = f'{uuid.uuid4().hex}.{extension}'
+    return file
+
+
+def strip_metadata(file):
+    """Фото без EXIF (в том числе координат съёмки) и XMP: исходное фото
+    отдаётся как есть, пока не готовы уменьшенные копии. Фото
+    поворачивается по EXIF; JPEG без поворота пересохраняется с прежними
+    таблицами квантования, почти без потерь. Цветовой профиль ICC
+    остаётся. Фото, которое не удаётся прочитать целиком (например,
+    обрезанное), - ошибка проверки."""
+    file.seek(0)
+    stripped = UploadedImage(file.name, file.content_type, 0, None)
+    try:
+        image = Image.open(file)
+        options = {'format': image.format}
+        if image.info.get('icc_profile'):
+            options['icc_profile'] = image.info['icc_profile']
+        if getattr(image, 'is_animated', False):
+            options['save_all'] = True
+        elif image.getexif().get(ORIENTATION_TAG, 1) != 1:
+            image = ImageOps.exif_transpose(image)
+        elif image.format == 'JPEG':
+            options.update(quality='keep', subsampling='keep')
+        image.save(stripped, **options)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        stripped.close()
+        raise ValidationError('Фото повреждено или обрезано')
+    except Exception:
+        stripped.close()
+        raise
+    stripped.size = stripped.tell()
+    stripped.seek(0)
+    return stripped
+
+
+def decode_base64(value, start):
+    tail = ''
+    for position in range(start, len(value), BASE64_CHUNK_SIZE):
+        chunk = tail + ''.join(
+            value[position:position + BASE64_CHUNK_SIZE].split())
+        cut = len(chunk) - len(chunk) % 4
+        tail = chunk[cut:]
+        try:
+            yield base64.b64decode(chunk[:cut], validate=True)
+        except binascii.Error:
+            raise ValidationError('Некорректные данные base64')
+    if tail:
+        raise ValidationError('Некорректные данные base64')
+
+
+def decode_base64_image(value):
+    """Декодирует data URI во временный файл на диске по частям. Размер
+    оценивается ещё до декодирования."""
+    match = DATA_URI.match(value)
+    if match is None:
+        raise ValidationError('Ожидается фото в формате data:image/...;base64')
+    start = match.end()
+    # Переводы строк в base64 допустимы и в размер не входят.
+    check_size((len(value) - start - value.count('\n', start)
+                - value.count('\r', start)) * 3 // 4 - 2)
+    return save_chunks(decode_base64(value, start), match['content_type'])
+
+
+def read_image(stream, content_type, content_length=None):
+    """Читает фото из тела запроса по частям во временный файл. Заявленный
+    размер проверяется до чтения."""
+    if content_length:
+        check_size(content_length)
+    return save_chunks(
+        iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b''), content_type)
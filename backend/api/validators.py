@@ -20,5 +20,5 @@ def ingredients_validate(ingredients, recipe_obj):
     return list_ingredients
 
 
-def list_shopping_filename(user_obj):
-    return f'{user_obj.username}_shopping_list.txt'
+def list_shopping_filename(user_obj, extension='txt'):
+    return f'{user_obj.username}_shopping_list.{extension}'
@@ -1,43 +1,62 @@
 from django.contrib.auth import get_user_model
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.db import transaction
+from django.db.models import F
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
-from recipes.models import (Cart, FavoritesRecipes, Ingredients, Product,
-                            Recipe, Tag)
+from recipes import timeline
+from recipes.models import (PRODUCTS_CATALOG, TAGS_CATALOG, Cart, CartProduct,
+                            CatalogVersion, FavoritesRecipes, Product, Recipe,
+                            Tag)
+from recipes.recommendations import recommend
 from users.serializers import RecipeOfSubscribersSerializer
 
+from .cache import CachedCatalogMixin, ConditionalRecipeMixin, cached_response
 from .filters import ProductSearchFilter, RecipesFilter
-from .pagination import RecipePagination
+from .pagination import RankedPagination, RecipePagination, TimelinePagination
+from .pantry import pantry_index
+from .parsers import ImageUploadParser
 from .permissions import IsAuthorOrReadOnly
+from .renderers import (ShoppingListCSVRenderer, ShoppingListPDFRenderer,
+                        ShoppingListTextRenderer)
 from .serializers import (CartSerializer, ChangeRecipeSerializer,
-                          FavoritesRecipesSerializer, ProductSerializer,
-                          RecipeSerializer, TagSerializer)
+                          FavoritesRecipesSerializer, PantrySerializer,
+                          ProductSerializer, RecipeIdsSerializer,
+                          RecipeImageSerializer, RecipeSerializer,
+                          TagSerializer)
 from .validators import list_shopping_filename
 
 User = get_user_model()
 
 
-class TagViewSet(viewsets.ModelViewSet):
+class TagViewSet(CachedCatalogMixin, viewsets.ModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
+    catalog_name = TAGS_CATALOG
 
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(CachedCatalogMixin, viewsets.ModelViewSet):
     queryset = Product.objects.all()
+    catalog_name = PRODUCTS_CATALOG
     serializer_class = ProductSerializer
     pagination_class = None
     filter_backends = (ProductSearchFilter,)
-    search_fields = ('^name',)
 
+    @cached_response(timeout=300, state=lambda request: (
+        CatalogVersion.objects.current(PRODUCTS_CATALOG)[0]))
+    def list(self, request, *args, **kwargs):
+        """Результаты поиска по названию общие для всех процессов."""
+        return super().list(request, *args, **kwargs)
 
-class RecipeViewSet(viewsets.ModelViewSet):
+
+class RecipeViewSet(ConditionalRecipeMixin, viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     serializer_class = RecipeSerializer
     filterset_class = RecipesFilter
@@ -45,8 +64,20 @@ class RecipeViewSet(viewsets.ModelViewSet):
     permission_classes = (IsAuthorOrReadOnly,)
     pagination_class = RecipePagination
 
-    def get_serializer_class(self):
+    def get_queryset(self):
         if self.action in ('retrieve', 'list'):
+            return Recipe.objects.for_user(self.request.user)
+        return super().get_queryset()
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action in ('list', 'pantry', 'recommended', 'timeline'):
+            context['image_rendition'] = 'card'
+        return context
+
+    def get_serializer_class(self):
+        if self.action in ('retrieve', 'list', 'pantry', 'recommended',
+                           'timeline'):
             return RecipeSerializer
         return ChangeRecipeSerializer
 
@@ -54,87 +85,225 @@ class RecipeViewSet(viewsets.ModelViewSet):
             url_path='shopping_cart')
     def shopping_cart(self, request, pk):
         user = self.request.user
+        if request.method == 'DELETE':
+            with transaction.atomic():
+                removed = Cart.objects.remove(recipe=pk, user=user)
+                if removed:
+                    CartProduct.objects.remove_recipe((user.id,), pk)
+            if removed:
+                return Response(status=status.HTTP_204_NO_CONTENT)
+            get_object_or_404(Recipe, id=pk)
+            return Response({'detail': 'Такого рецепта нет в списке '
+                                       'покупок'},
+                            status=status.HTTP_400_BAD_REQUEST)
         recipe = get_object_or_404(Recipe, id=pk)
-        exist_rel = Cart.objects.filter(recipe=recipe,
-                                        user=user).first()
-        if request.method == 'POST':
-            if exist_rel:
-                return Response(
-                    {'detail': 'Рецепт уже есть в списке покупок'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            Cart.objects.create(
-                recipe=recipe,
-                user=user
+        with transaction.atomic():
+            created = Cart.objects.create_if_absent(recipe=recipe, user=user)
+            if created:
+                CartProduct.objects.add_recipe((user.id,), recipe)
+        if not created:
+            return Response(
+                {'detail': 'Рецепт уже есть в списке покупок'},
+                status=status.HTTP_400_BAD_REQUEST
             )
-            serializer = RecipeOfSubscribersSerializer(recipe)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        elif request.method == 'DELETE':
-            if not exist_rel:
-                return Response({'detail': 'Такого рецепта нет в списке '
-                                           'покупок'},
-                                status=status.HTTP_400_BAD_REQUEST)
-            exist_rel.delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
+        serializer = RecipeOfSubscribersSerializer(recipe)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def add_many(self, model, recipe_ids, on_add=None):
+        """Добавляет рецепты в избранное или список покупок одним
+        INSERT. Возвращает найденные рецепты и id добавленных."""
+        user = self.request.user
+        recipes = Recipe.objects.in_bulk(recipe_ids)
+        with transaction.atomic():
+            existing = set(model.objects.filter(
+                user=user, recipe__in=recipes,
+            ).values_list('recipe', flat=True))
+            created = [pk for pk in recipes if pk not in existing]
+            model.objects.create_many(
+                [{'user': user, 'recipe_id': pk} for pk in created])
+            if on_add is not None and created:
+                on_add((user.id,), created)
+        return recipes, set(created)
+
+    def remove_many(self, model, recipe_ids, on_remove=None):
+        """Убирает рецепты одним DELETE. Возвращает id убранных."""
+        user = self.request.user
+        with transaction.atomic():
+            removed = [row['recipe'] for row in model.objects.filter(
+                user=user, recipe__in=recipe_ids).remove_all()]
+            if on_remove is not None and removed:
+                on_remove((user.id,), removed)
+        return set(removed)
+
+    def change_many(self, request, model, on_add=None, on_remove=None):
+        """Пакетные POST и DELETE с телом {"recipes": [id, ...]}: итог по
+        каждому рецепту в поле status - created, exists, deleted, absent
+        (рецепта не было в списке) или not_found."""
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = serializer.validated_data['recipes']
+        if request.method == 'DELETE':
+            removed = self.remove_many(model, recipe_ids, on_remove)
+            return Response({'results': [
+                {'id': pk, 'status': 'deleted' if pk in removed else 'absent'}
+                for pk in recipe_ids
+            ]})
+        recipes, created = self.add_many(model, recipe_ids, on_add)
+        results = []
+        for pk in recipe_ids:
+            if pk not in recipes:
+                results.append({'id': pk, 'status': 'not_found'})
+                continue
+            results.append({
+                **RecipeOfSubscribersSerializer(
+                    recipes[pk], context=self.get_serializer_context()).data,
+                'status': 'created' if pk in created else 'exists',
+            })
+        return Response({'results': results})
+
+    @action(methods=['delete', 'post'], detail=False,
+            url_path='shopping_cart', url_name='shopping-cart-many',
+            permission_classes=(IsAuthenticated,), )
+    def shopping_cart_many(self, request):
+        """Пакетная версия shopping_cart."""
+        return self.change_many(
+            request, Cart,
+            on_add=CartProduct.objects.add_recipes,
+            on_remove=CartProduct.objects.remove_recipes)
+
+    @action(methods=['delete', 'post'], detail=False,
+            url_path='favorite', url_name='favorite-many',
+            permission_classes=(IsAuthenticated,), )
+    def favorite_many(self, request):
+        """Пакетная версия favorite."""
+        return self.change_many(request, FavoritesRecipes)
 
     @action(methods=['get'], detail=False,
-            url_path='download_shopping_cart', )
+            url_path='download_shopping_cart',
+            permission_classes=(IsAuthenticated,),
+            renderer_classes=(ShoppingListTextRenderer,
+                              ShoppingListCSVRenderer,
+                              ShoppingListPDFRenderer), )
     def download_shopping_cart(self, request):
+        """Список покупок потоком в формате txt, csv или pdf (?format=).
+        Суммы берутся из сводного списка покупок CartProduct, отдельно для
+        каждого продукта и единицы измерения."""
         user = self.request.user
-        filename = list_shopping_filename(user)
-        purchases = f'Список покупок {user.username}\n\n'
-        shopping_dict = {}
-        ingredients = Ingredients.objects.filter(
-            recipe__in_cart__user=user).values(
-            'ingredients__name', 'ingredients__measurement_unit'
-        ).annotate(amount=Sum('amount'))
-        for num, i in enumerate(ingredients):
-            name = i['ingredients__name']
-            amount = i['amount']
-            measur = i['ingredients__measurement_unit']
-            if name not in shopping_dict:
-                shopping_dict[name] = {
-                    "amount": amount,
-                    "measur": measur,
-                }
-            else:
-                shopping_dict[name]["amount"] += amount
-        purchases += "\n".join([f"{name} - {values['amount']}"
-                                f"{values['measur']}"
-                                for (name, values) in shopping_dict.items()])
-        response = HttpResponse(purchases,
-                                content_type='text/plain; charset=utf-8')
+        renderer = request.accepted_renderer
+        filename = list_shopping_filename(user, renderer.format)
+        ingredients = CartProduct.objects.filter(user=user).values(
+            'amount',
+            name=F('product__name'),
+            measurement_unit=F('product__measurement_unit'),
+        ).order_by('name', 'measurement_unit')
+        response = StreamingHttpResponse(
+            renderer.stream(f'Список покупок {user.username}',
+                            ingredients.iterator()),
+            content_type=renderer.content_type)
         response['Content-Disposition'] = f'attachment; filename={filename}'
         return response
 
+    @action(methods=['post'], detail=False, url_path='pantry',
+            permission_classes=(IsAuthenticated,), )
+    def pantry(self, request):
+        """Рецепты, которые можно приготовить из продуктов пользователя:
+        по убыванию доли имеющихся продуктов рецепта (coverage), затем по
+        числу недостающих (missing). Подбор идёт по индексу в памяти, из
+        базы читается только страница выдачи."""
+        serializer = PantrySerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        pantry = set(serializer.validated_data['ingredients'])
+        matches = pantry_index.match(
+            pantry, serializer.validated_data.get('max_missing'))
+        paginator = RankedPagination()
+        page = paginator.paginate_queryset(matches, request, view=self)
+        recipes = self.render_recipe_ids(
+            [recipe_id for recipe_id, *_ in page])
+        missing = {
+            recipe_id: pantry_index.missing_products(recipe_id, pantry)
+            for recipe_id in recipes
+        }
+        products = Product.objects.in_bulk(
+            {product_id for ids in missing.values() for product_id in ids})
+        results = []
+        for recipe_id, coverage, missing_count in page:
+            if recipe_id not in recipes:
+                continue
+            results.append({
+                **recipes[recipe_id],
+                'coverage': round(coverage, 4),
+                'missing': missing_count,
+                'missing_ingredients': ProductSerializer(
+                    [products[product_id] for product_id in missing[recipe_id]
+                     if product_id in products], many=True).data,
+            })
+        return paginator.get_paginated_response(results)
+
+    @action(methods=['get'], detail=False, url_path='recommended',
+            permission_classes=(IsAuthenticated,), )
+    def recommended(self, request):
+        """Рецепты, похожие на избранное и список покупок пользователя
+        (см. recipes/recommendations.py), с оценкой score."""
+        paginator = RankedPagination()
+        page = paginator.paginate_queryset(
+            recommend(request.user), request, view=self)
+        recipes = self.render_recipe_ids(
+            [recipe_id for recipe_id, score in page])
+        return paginator.get_paginated_response([
+            {**recipes[recipe_id], 'score': round(score, 4)}
+            for recipe_id, score in page if recipe_id in recipes
+        ])
+
+    @action(methods=['get'], detail=False, url_path='timeline',
+            permission_classes=(IsAuthenticated,), )
+    def timeline(self, request):
+        """Новые рецепты авторов, на которых подписан пользователь, по
+        курсору (?cursor=)."""
+        paginator = TimelinePagination()
+        page = paginator.paginate_timeline(
+            lambda position, limit: timeline.read(
+                request.user, position, limit),
+            request)
+        recipes = self.render_recipe_ids([item['id'] for item in page])
+        return paginator.get_paginated_response([
+            recipes[item['id']] for item in page if item['id'] in recipes
+        ])
+
+    @action(methods=['put'], detail=True, url_path='image',
+            parser_classes=(ImageUploadParser, MultiPartParser), )
+    def image(self, request, pk):
+        """Замена фото файлом: телом запроса (Content-Type: image/...) или
+        полем image в multipart/form-data. Права проверяются до чтения
+        тела запроса."""
+        recipe = self.get_object()
+        serializer = RecipeImageSerializer(
+            recipe, data=request.data, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data)
+
     @action(methods=['delete', 'post'],
             detail=True,
             url_path='favorite',
             permission_classes=(IsAuthenticated,), )
     def favorite(self, request, pk):
         user = self.request.user
+        if request.method == 'DELETE':
+            if FavoritesRecipes.objects.remove(recipe=pk, user=user):
+                return Response(status=status.HTTP_204_NO_CONTENT)
+            get_object_or_404(Recipe, id=pk)
+            return Response({'detail': 'Ошибка удаления рецепта из '
+                                       'избранного'},
+                            status=status.HTTP_400_BAD_REQUEST)
         recipe = get_object_or_404(Recipe, id=pk)
-        exist_rel = FavoritesRecipes.objects.filter(recipe=recipe,
-                                                    user=user).first()
-        if request.method == 'POST':
-            if exist_rel:
-                return Response(
-                    {'detail': 'Рецепт уже был ранее добавлен в Избранное'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            FavoritesRecipes.objects.create(
-                recipe=recipe,
-                user=user
+        if not FavoritesRecipes.objects.create_if_absent(
+                recipe=recipe, user=user):
+            return Response(
+                {'detail': 'Рецепт уже был ранее добавлен в Избранное'},
+                status=status.HTTP_400_BAD_REQUEST
             )
-            serializer = RecipeOfSubscribersSerializer(recipe)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        elif request.method == 'DELETE':
-            if not exist_rel:
-                return Response({'detail': 'Ошибка удаления рецепта из '
-                                           'избранного'},
-                                status=status.HTTP_400_BAD_REQUEST)
-            exist_rel.delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
+        serializer = RecipeOfSubscribersSerializer(recipe)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
 class FavoritesRecipesViewSet(viewsets.ModelViewSet):
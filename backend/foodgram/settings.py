@@ -1,6 +1,9 @@
 import os
+import tempfile
 from pathlib import Path
 
+from django.utils.module_loading import import_string
+
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 SECRET_KEY = os.getenv('SECRET_KEY', 'super_secret_key')
@@ -19,6 +22,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'rest_framework',
     'corsheaders',
@@ -76,6 +80,11 @@ DATABASES = {
     }
 }
 
+# Покрывающие индексы (Index(include=...)) есть только в PostgreSQL. На
+# SQLite, где запускаются тесты, include пропускается, и индекс остаётся
+# обычным, так что предупреждение models.W040 ничего не сообщает.
+SILENCED_SYSTEM_CHECKS = ['models.W040']
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation'
@@ -142,5 +151,51 @@ DJOSER = {
     }
 }
 
+# Общий для всех процессов кэш: locmem (только внутри процесса), file или
+# redis. Для тестов без сервера redis соединение можно заменить на
+# CACHE_REDIS_CONNECTION_CLASS=fakeredis.FakeConnection.
+CACHE_BACKENDS = {
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', 'foodgram'),
+    'file': ('django.core.cache.backends.filebased.FileBasedCache',
+             os.path.join(tempfile.gettempdir(), 'foodgram-cache')),
+    'redis': ('django_redis.cache.RedisCache', 'redis://localhost:6379/0'),
+}
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'locmem')
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND][0],
+        'LOCATION': os.getenv('CACHE_LOCATION',
+                              CACHE_BACKENDS[CACHE_BACKEND][1]),
+        'KEY_PREFIX': 'foodgram',
+        'TIMEOUT': 300,
+    }
+}
+if os.getenv('CACHE_REDIS_CONNECTION_CLASS'):
+    CACHES['default']['OPTIONS'] = {
+        'CONNECTION_POOL_KWARGS': {
+            'connection_class': import_string(
+                os.getenv('CACHE_REDIS_CONNECTION_CLASS')),
+        },
+    }
+# Разброс времени жизни записей кэша, доля от timeout.
+CACHE_TTL_JITTER = float(os.getenv('CACHE_TTL_JITTER', 0.1))
+
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Обработка фото рецептов: thread, sync или queue (см. recipes/images.py).
+IMAGE_PIPELINE_MODE = os.getenv('IMAGE_PIPELINE_MODE', 'thread')
+IMAGE_PIPELINE_WORKERS = int(os.getenv('IMAGE_PIPELINE_WORKERS', 2))
+# Наибольший размер загружаемого фото в байтах.
+IMAGE_UPLOAD_MAX_SIZE = int(os.getenv('IMAGE_UPLOAD_MAX_SIZE', 10 * 1024 * 1024))
+# За сколько часов вклад добавления в рейтинг ?ordering=trending
+# уменьшается вдвое (см. recipes/trending.py).
+TRENDING_HALF_LIFE_HOURS = float(os.getenv('TRENDING_HALF_LIFE_HOURS', 48))
+# Рецепты авторов, у которых подписчиков не больше этого, раскладываются по
+# лентам подписок при публикации, остальные читаются при запросе ленты
+# (см. recipes/timeline.py). TIMELINE_BACKFILL - сколько последних
+# рецептов автора попадает в ленту при подписке, TIMELINE_MAX_ENTRIES -
+# сколько записей ленты хранится у пользователя.
+TIMELINE_FANOUT_LIMIT = int(os.getenv('TIMELINE_FANOUT_LIMIT', 1000))
+TIMELINE_BACKFILL = int(os.getenv('TIMELINE_BACKFILL', 50))
+TIMELINE_MAX_ENTRIES = int(os.getenv('TIMELINE_MAX_ENTRIES', 500))
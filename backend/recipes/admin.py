@@ -1,6 +1,7 @@
 from django.contrib import admin
 
-from .models import Ingredients, Product, Recipe, Tag
+from .models import (RECIPE_INGREDIENTS_VERSION, CartProduct, CatalogVersion,
+                     Ingredients, Product, Recipe, Tag)
 
 
 class IngredientsInline(admin.TabularInline):
@@ -15,15 +16,32 @@ class ProductAdmin(admin.ModelAdmin):
 
 @admin.register(Recipe)
 class ResipeAdmin(admin.ModelAdmin):
-    list_display = ('id', 'name', 'author', 'count_recipes')
+    list_display = ('id', 'name', 'author', 'count_recipes', 'cart_count')
     search_fields = ('name', 'tags', 'author')
     list_filter = ('author', 'name', 'tags')
     list_display_links = ('name',)
     inlines = (IngredientsInline,)
 
-    @staticmethod
-    def count_recipes(obj):
-        return obj.in_favorites.count()
+    def save_related(self, request, form, formsets, change):
+        old_amounts = CartProduct.objects.recipe_amounts(form.instance)
+        super().save_related(request, form, formsets, change)
+        CartProduct.objects.change_recipe(
+            form.instance, old_amounts,
+            CartProduct.objects.recipe_amounts(form.instance))
+        Recipe.objects.filter(pk=form.instance.pk).update_search_vector()
+        CatalogVersion.objects.bump(RECIPE_INGREDIENTS_VERSION)
+
+    def save_model(self, request, obj, form, change):
+        # Смену автора сигналы создания и удаления не видят.
+        if change and 'author' in form.changed_data:
+            Recipe.objects.update_counters(
+                [{'author': form.initial['author']}], -1)
+            Recipe.objects.update_counters([{'author': obj.author}], 1)
+        super().save_model(request, obj, form, change)
+
+    @admin.display(description='В избранном', ordering='favorites_count')
+    def count_recipes(self, obj):
+        return obj.favorites_count
 
 
 @admin.register(Tag)
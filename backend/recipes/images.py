@@ -0,0 +1,153 @@
+"""Фоновая обработка фото рецептов.
+
+Из загруженного фото делаются уменьшенные копии (thumbnail, card, full) в
+WebP и JPEG без метаданных. Готовые версии записываются в
+Recipe.image_renditions, до этого API отдаёт исходное фото.
+
+Режим задаётся настройкой IMAGE_PIPELINE_MODE:
+thread - обработка в пуле потоков этого же процесса;
+sync - сразу после сохранения рецепта, в том же запросе;
+queue - только отмечается, обрабатывает команда process_images.
+"""
+import logging
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Название версии -> наибольшая сторона в пикселях.
+RENDITIONS = {
+    'thumbnail': 160,
+    'card': 480,
+    'full': 1280,
+}
+FORMATS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 85, 'optimize': True,
+             'progressive': True},
+}
+RENDITIONS_DIR = 'recipe_images/renditions'
+
+
+def rendition_path(recipe_id, source, rendition, extension):
+    stem = posixpath.splitext(posixpath.basename(source))[0]
+    return (f'{RENDITIONS_DIR}/{recipe_id}/'
+            f'{stem}-{rendition}.{extension}')
+
+
+def open_image(source):
+    """Открывает фото и проверяет, что это целое изображение разумного
+    размера (Image.MAX_IMAGE_PIXELS защищает от «бомб»)."""
+    with default_storage.open(source) as file:
+        data = file.read()
+    with Image.open(BytesIO(data)) as image:
+        image.verify()
+    image = Image.open(BytesIO(data))
+    # Поворот по EXIF, после которого метаданные больше не нужны: при
+    # сохранении версий exif и icc не передаются.
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'L'):
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        image = image.convert('RGBA')
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    return image.convert('RGB')
+
+
+def make_renditions(recipe_id, source):
+    """Сохраняет версии фото и возвращает их описание для
+    Recipe.image_renditions."""
+    image = open_image(source)
+    renditions = {'source': source}
+    for rendition, size in RENDITIONS.items():
+        copy = image.copy()
+        copy.thumbnail((size, size), Image.LANCZOS)
+        files = {}
+        for extension, options in FORMATS.items():
+            buffer = BytesIO()
+            copy.save(buffer, **options)
+            path = rendition_path(recipe_id, source, rendition, extension)
+            if default_storage.exists(path):
+                default_storage.delete(path)
+            files[extension] = default_storage.save(
+                path, ContentFile(buffer.getvalue()))
+        renditions[rendition] = {'width': copy.width, **files}
+    return renditions
+
+
+def delete_renditions(renditions):
+    for rendition in RENDITIONS:
+        for extension in FORMATS:
+            path = renditions.get(rendition, {}).get(extension)
+            if path and default_storage.exists(path):
+                default_storage.delete(path)
+
+
+def process_recipe_image(recipe_id):
+    """Обрабатывает текущее фото рецепта. Если за время обработки фото
+    заменили, результат отбрасывается: новое фото обработает своя
+    задача."""
+    from recipes.models import Recipe
+
+    recipe = Recipe.objects.filter(id=recipe_id).values(
+        'image', 'image_renditions').first()
+    if recipe is None or not recipe['image']:
+        return
+    source = recipe['image']
+    try:
+        renditions = make_renditions(recipe_id, source)
+    except Exception:
+        logger.exception('Не удалось обработать фото %s', source)
+        renditions = {'source': source, 'error': True}
+    updated = Recipe.objects.filter(id=recipe_id, image=source).update(
+        image_renditions=renditions, updated_at=timezone.now())
+    if not updated:
+        delete_renditions(renditions)
+    elif recipe['image_renditions'].get('source') != source:
+        delete_renditions(recipe['image_renditions'])
+
+
+def needs_processing(recipe):
+    return bool(recipe.image) and (
+        recipe.image_renditions.get('source') != recipe.image.name)
+
+
+class ImagePipeline:
+    """Очередь обработки фото в пуле потоков процесса."""
+
+    def __init__(self):
+        self.executor = None
+
+    def run(self, recipe_id):
+        try:
+            process_recipe_image(recipe_id)
+        finally:
+            connections.close_all()
+
+    def submit(self, recipe_id):
+        mode = settings.IMAGE_PIPELINE_MODE
+        if mode == 'sync':
+            process_recipe_image(recipe_id)
+        elif mode == 'thread':
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=settings.IMAGE_PIPELINE_WORKERS,
+                    thread_name_prefix='recipe-images',
+                )
+            self.executor.submit(self.run, recipe_id)
+
+    def schedule(self, recipe):
+        """Ставит фото рецепта в обработку после фиксации транзакции."""
+        if needs_processing(recipe):
+            transaction.on_commit(lambda: self.submit(recipe.id))
+
+
+image_pipeline = ImagePipeline()
@@ -0,0 +1,11 @@
+from django.core.management import BaseCommand
+
+from recipes.recommendations import build_neighbors
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает похожие рецепты для рекомендаций по избранному, '
+            'спискам покупок, продуктам и тэгам')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Записано соседей: {build_neighbors()}')
@@ -1,30 +1,202 @@
+import json
+import time
 from csv import DictReader
+from itertools import islice
 
-from django.core.management import BaseCommand
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
 
-from recipes.models import Product, Tag
+from recipes.models import (PRODUCTS_CATALOG, TAGS_CATALOG, CatalogVersion,
+                            Product, Tag)
 
+DEFAULT_CHUNK_SIZE = 1000
+JSON_READ_SIZE = 64 * 1024
 
-class Command(BaseCommand):
-    help = 'Загружает данные из csv файла в базу данных'
-
-    def handle(self, *args, **kwargs):
-        for row in DictReader(open(
-                'data/ingredients.csv',
-                encoding="utf8")):
-            Product.objects.get_or_create(
-                name=row['name'],
-                measurement_unit=row['measurement_unit'],
+
+def read_csv(path):
+    with open(path, encoding='utf8', newline='') as file:
+        yield from DictReader(file)
+
+
+def read_json(path):
+    """Объекты из json-массива по одному, не загружая файл целиком."""
+    decoder = json.JSONDecoder()
+    with open(path, encoding='utf8') as file:
+        buffer = ''
+        started = False
+        while True:
+            chunk = file.read(JSON_READ_SIZE)
+            buffer += chunk
+            position = 0
+            while True:
+                while (position < len(buffer)
+                       and buffer[position] in ' \t\r\n,'):
+                    position += 1
+                if not started and position < len(buffer):
+                    if buffer[position] != '[':
+                        raise CommandError(f'{path}: ожидается json-массив')
+                    started = True
+                    position += 1
+                    continue
+                if position < len(buffer) and buffer[position] == ']':
+                    return
+                try:
+                    row, position = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    if not chunk:
+                        raise CommandError(f'{path}: неполный json')
+                    break
+                yield row
+            buffer = buffer[position:]
+
+
+def read_rows(path):
+    if str(path).endswith('.json'):
+        return read_json(path)
+    return read_csv(path)
+
+
+def insert_ignore_conflicts(model, fields, rows):
+    """Многострочный INSERT без создания объектов модели: на больших
+    файлах bulk_create тратит большую часть времени на них. Строки,
+    нарушающие уникальность, пропускаются, как в
+    bulk_create(ignore_conflicts=True). Возвращает число добавленных
+    строк."""
+    ops = connection.ops
+    model_fields = [model._meta.get_field(field) for field in fields]
+    columns = ', '.join(ops.quote_name(field.column) for field in model_fields)
+    placeholder = f"({', '.join(['%s'] * len(fields))})"
+    batch_size = ops.bulk_batch_size(model_fields, rows) or len(rows)
+    inserted = 0
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            cursor.execute(
+                f'{ops.insert_statement(ignore_conflicts=True)} '
+                f'{ops.quote_name(model._meta.db_table)} ({columns}) '
+                f"VALUES {', '.join([placeholder] * len(batch))} "
+                f'{ops.ignore_conflicts_suffix_sql(ignore_conflicts=True)}',
+                [row[field] for row in batch for field in fields],
             )
+            inserted += cursor.rowcount
+    return inserted
+
 
-        for row in DictReader(open(
-                'data/tags.csv',
-                encoding="utf8")):
-            Tag.objects.get_or_create(
-                name=row['name'],
-                color=row['color'],
-                slug=row['slug'],
+def chunked(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = ('Загружает продукты и тэги из csv или json файлов в базу данных. '
+            'Повторный запуск добавляет только новые записи')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--products',
+            default=settings.BASE_DIR / 'data' / 'ingredients.csv',
+            help='csv или json файл с полями name, measurement_unit',
+        )
+        parser.add_argument(
+            '--tags',
+            default=settings.BASE_DIR / 'data' / 'tags.csv',
+            help='csv или json файл с полями name, color, slug',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=DEFAULT_CHUNK_SIZE,
+            help='Сколько строк записывать одной транзакцией',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать, что будет добавлено',
+        )
+
+    def handle(self, *args, **options):
+        self.chunk_size = options['chunk_size']
+        self.dry_run = options['dry_run']
+        self.verbosity = options['verbosity']
+        self.load(
+            'Продукты', Product, PRODUCTS_CATALOG,
+            ('name', 'measurement_unit'), (('name', 'measurement_unit'),),
+            options['products'],
+        )
+        self.load(
+            'Тэги', Tag, TAGS_CATALOG,
+            ('name', 'color', 'slug'), (('name',), ('color',), ('slug',)),
+            options['tags'],
+        )
+        if self.dry_run:
+            self.stdout.write('Пробный запуск: база данных не изменена')
+        else:
+            self.stdout.write(
+                'Данные ингредиентов и тэгов загружены в базу данных'
             )
+
+    @staticmethod
+    def keys(row, unique_keys):
+        """Значения всех уникальных ключей строки."""
+        return [(key, tuple(row[field] for field in key))
+                for key in unique_keys]
+
+    def existing_keys(self, model, unique_keys, rows):
+        """Значения уникальных ключей строк чанка, которые уже есть
+        в базе."""
+        existing = set()
+        for key in unique_keys:
+            first_field = key[0]
+            existing.update(
+                (key, values) for values in model.objects.filter(**{
+                    f'{first_field}__in': {row[first_field] for row in rows},
+                }).values_list(*key))
+        return existing
+
+    def load(self, title, model, catalog, fields, unique_keys, path):
+        """Строка считается повтором, если совпадает с уже прочитанной
+        или с записью в базе хотя бы по одному из unique_keys."""
+        started = time.monotonic()
+        total = created = existing = invalid = duplicates = 0
+        seen = set()
+        for chunk in chunked(read_rows(path), self.chunk_size):
+            total += len(chunk)
+            rows = []
+            for row in chunk:
+                row = {field: (row.get(field) or '').strip()
+                       for field in fields}
+                if not all(row.values()):
+                    invalid += 1
+                    continue
+                keys = self.keys(row, unique_keys)
+                if seen.intersection(keys):
+                    duplicates += 1
+                    continue
+                seen.update(keys)
+                rows.append(row)
+            existing_keys = self.existing_keys(model, unique_keys, rows)
+            new_rows = [row for row in rows if existing_keys.isdisjoint(
+                self.keys(row, unique_keys))]
+            existing += len(rows) - len(new_rows)
+            if self.dry_run:
+                created += len(new_rows)
+            else:
+                with transaction.atomic():
+                    created += insert_ignore_conflicts(
+                        model, fields, new_rows)
+            if self.verbosity > 1:
+                for row in new_rows:
+                    self.stdout.write(f"+ {' '.join(row.values())}")
+        if created and not self.dry_run:
+            CatalogVersion.objects.bump(catalog)
+        elapsed = time.monotonic() - started
         self.stdout.write(
-            'Данные ингредиентов и тэгов загружены в базу данных'
+            f'{title}: прочитано {total}, новых {created}, уже были '
+            f'{existing}, дубликатов {duplicates}, с ошибками {invalid}; '
+            f'{elapsed:.2f} с, {total / max(elapsed, 1e-6):.0f} строк/с'
         )
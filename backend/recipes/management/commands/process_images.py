@@ -0,0 +1,53 @@
+import time
+
+from django.core.management import BaseCommand, CommandError
+
+from recipes.images import needs_processing, process_recipe_image
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ('Делает уменьшенные копии фото рецептов, у которых их ещё нет. '
+            'С --loop работает как обработчик очереди для '
+            'IMAGE_PIPELINE_MODE=queue')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Заново обработать все фото',
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Не завершаться, проверять новые фото',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=5,
+            help='Пауза между проверками с --loop, секунд',
+        )
+
+    def handle(self, *args, **options):
+        if options['all'] and options['loop']:
+            raise CommandError(
+                '--all нельзя с --loop: все фото обрабатывались бы заново '
+                'при каждой проверке')
+        while True:
+            processed = self.process(options['all'])
+            if processed or not options['loop']:
+                self.stdout.write(f'Обработано фото: {processed}')
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
+
+    def process(self, process_all):
+        recipes = Recipe.objects.exclude(image='').exclude(
+            image__isnull=True).only('id', 'image', 'image_renditions')
+        processed = 0
+        for recipe in recipes.iterator():
+            if process_all or needs_processing(recipe):
+                process_recipe_image(recipe.id)
+                processed += 1
+        return processed
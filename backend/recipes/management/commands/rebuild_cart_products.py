@@ -0,0 +1,49 @@
+from django.core.management import BaseCommand
+
+from recipes.models import CartProduct
+
+
+class Command(BaseCommand):
+    help = ('Сверяет сводный список покупок с корзинами пользователей и '
+            'пересобирает его')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только найти расхождения, ничего не меняя',
+        )
+
+    def handle(self, *args, **options):
+        expected = {
+            (user_id, product_id): amount
+            for user_id, product_id, amount in CartProduct.objects.calculate()
+        }
+        actual = {
+            (user_id, product_id): amount
+            for user_id, product_id, amount in CartProduct.objects.values_list(
+                'user', 'product', 'amount')
+        }
+        drift = {
+            key for key in {*expected, *actual}
+            if expected.get(key) != actual.get(key)
+        }
+        drifted_users = {user_id for user_id, product_id in drift}
+        for user_id, product_id in sorted(drift):
+            self.stdout.write(
+                f'Пользователь {user_id}, продукт {product_id}: '
+                f'в списке {actual.get((user_id, product_id), 0)}, '
+                f'по корзине {expected.get((user_id, product_id), 0)}'
+            )
+        if options['check']:
+            self.stdout.write(
+                f'Расхождений: {len(drift)} у {len(drifted_users)} '
+                f'пользователей'
+            )
+            return
+        if drifted_users:
+            CartProduct.objects.rebuild(drifted_users)
+        self.stdout.write(
+            f'Списки покупок пересобраны для {len(drifted_users)} '
+            f'пользователей'
+        )
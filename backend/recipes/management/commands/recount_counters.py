@@ -0,0 +1,34 @@
+from django.core.management import BaseCommand
+
+from recipes.models import Cart, FavoritesRecipes, Recipe
+from users.models import Subscriptions
+
+
+class Command(BaseCommand):
+    help = ('Сверяет счётчики рецептов, подписчиков, избранного и списков '
+            'покупок с данными и исправляет расхождения')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только найти расхождения, ничего не меняя',
+        )
+
+    def handle(self, *args, **options):
+        drift = 0
+        for model in (Recipe, Subscriptions, FavoritesRecipes, Cart):
+            for target, counter, pk, stored, count in (
+                    model.objects.counter_drift()):
+                drift += 1
+                self.stdout.write(
+                    f'{target._meta.verbose_name} {pk}, {counter}: '
+                    f'в счётчике {stored}, на самом деле {count}'
+                )
+                if not options['check']:
+                    target._base_manager.filter(pk=pk).update(
+                        **{counter: count})
+        if options['check']:
+            self.stdout.write(f'Расхождений: {drift}')
+            return
+        self.stdout.write(f'Исправлено счётчиков: {drift}')
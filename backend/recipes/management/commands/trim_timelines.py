@@ -0,0 +1,32 @@
+import time
+
+from django.core.management import BaseCommand
+
+from recipes.timeline import trim_all
+
+
+class Command(BaseCommand):
+    help = ('Удаляет из лент подписок записи сверх TIMELINE_MAX_ENTRIES '
+            'на пользователя')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Не завершаться, обрезать ленты периодически',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=3600,
+            help='Пауза между проходами с --loop, секунд',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            deleted = trim_all()
+            if deleted or not options['loop']:
+                self.stdout.write(f'Удалено записей: {deleted}')
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management import BaseCommand
+
+from recipes.trending import update_trending
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает рейтинг «популярное сейчас» по новым добавлениям '
+            'в избранное и списки покупок')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Пересчитать рейтинг заново',
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Не завершаться, пересчитывать периодически',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=300,
+            help='Пауза между пересчётами с --loop, секунд',
+        )
+
+    def handle(self, *args, **options):
+        rebuild = options['rebuild']
+        while True:
+            processed = update_trending(rebuild=rebuild)
+            rebuild = False
+            if processed or not options['loop']:
+                self.stdout.write(f'Учтено добавлений: {processed}')
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,49 @@
+# Generated by Django 3.2.19 on 2026-10-18 18:07
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Sum
+
+
+def fill_cart_products(apps, schema_editor):
+    Ingredients = apps.get_model('recipes', 'Ingredients')
+    CartProduct = apps.get_model('recipes', 'CartProduct')
+    rows = Ingredients.objects.filter(
+        recipe__in_cart__isnull=False,
+    ).values_list(
+        'recipe__in_cart__user', 'ingredients',
+    ).annotate(amount=Sum('amount')).order_by()
+    CartProduct.objects.bulk_create(
+        CartProduct(user_id=user_id, product_id=product_id, amount=amount)
+        for user_id, product_id, amount in rows
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0003_alter_recipe_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CartProduct',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.IntegerField(verbose_name='Количество')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='in_cart_products', to='recipes.product', verbose_name='Продукт')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cart_products', to=settings.AUTH_USER_MODEL, verbose_name='Владелец списка')),
+            ],
+            options={
+                'verbose_name': 'Продукт в списке покупок',
+                'verbose_name_plural': 'Продукты в списке покупок',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='cartproduct',
+            constraint=models.UniqueConstraint(fields=('user', 'product'), name='unique_for_cart_product'),
+        ),
+        migrations.RunPython(fill_cart_products, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+from django.db import migrations
+
+PRODUCT_SEARCH_INDEXES = (
+    # icontains / istartswith: UPPER("name"::text) LIKE UPPER(...)
+    ('recipes_product_name_upper_trgm',
+     'UPPER(("name")::text) gin_trgm_ops'),
+    # trigram_similar: "name" % ...
+    ('recipes_product_name_trgm', '"name" gin_trgm_ops'),
+)
+
+
+def create_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, expression in PRODUCT_SEARCH_INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name} '
+            f'ON recipes_product USING gin ({expression})'
+        )
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, expression in PRODUCT_SEARCH_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_cartproduct'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.2.19 on 2026-10-18 18:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_product_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='Справочник')),
+                ('version', models.PositiveIntegerField(default=0, verbose_name='Версия')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата изменения')),
+            ],
+            options={
+                'verbose_name': 'Версия справочника',
+                'verbose_name_plural': 'Версии справочников',
+            },
+        ),
+    ]
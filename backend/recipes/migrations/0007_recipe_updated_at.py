@@ -0,0 +1,25 @@
+# Generated by Django 3.2.19 on 2026-10-18 18:11
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def copy_pub_date(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Recipe.objects.update(updated_at=F('pub_date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_catalogversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='Дата изменения'),
+        ),
+        migrations.RunPython(copy_pub_date, migrations.RunPython.noop),
+    ]
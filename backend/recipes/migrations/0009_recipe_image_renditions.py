@@ -0,0 +1,18 @@
+# Generated by Django 3.2.19 on 2026-10-18 18:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_recipe_keyset_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_renditions',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Уменьшенные копии фото'),
+        ),
+    ]
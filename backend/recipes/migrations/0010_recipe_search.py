@@ -0,0 +1,54 @@
+# Generated by Django 3.2.19 on 2026-10-18 18:31
+
+import django.contrib.postgres.search
+from django.db import migrations, models
+
+FILL_SEARCH_VECTOR = '''
+UPDATE recipes_recipe AS recipe SET search_vector =
+    setweight(to_tsvector('russian', recipe.name), 'A')
+    || setweight(to_tsvector('russian', COALESCE((
+        SELECT string_agg(product.name, ' ')
+        FROM recipes_ingredients AS ingredient
+        JOIN recipes_product AS product
+            ON product.id = ingredient.ingredients_id
+        WHERE ingredient.recipe_id = recipe.id
+    ), '')), 'B')
+    || setweight(to_tsvector('russian', recipe.text), 'C')
+'''
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS recipes_recipe_search_vector_gin '
+        'ON recipes_recipe USING gin (search_vector)'
+    )
+    schema_editor.execute(FILL_SEARCH_VECTOR)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'DROP INDEX IF EXISTS recipes_recipe_search_vector_gin')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_recipe_image_renditions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый индекс'),
+        ),
+        migrations.AddIndex(
+            model_name='ingredients',
+            index=models.Index(fields=['ingredients', 'recipe'], name='ingredients_product_recipe_idx'),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 3.2.19 on 2026-10-18 18:41
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+COUNTERS = (
+    ('recipes', 'Recipe', 'author', 'users', 'UserFoodgram',
+     'recipes_count'),
+    ('users', 'Subscriptions', 'author', 'users', 'UserFoodgram',
+     'subscribers_count'),
+    ('recipes', 'FavoritesRecipes', 'recipe', 'recipes', 'Recipe',
+     'favorites_count'),
+    ('recipes', 'Cart', 'recipe', 'recipes', 'Recipe', 'cart_count'),
+)
+
+
+def fill_counters(apps, schema_editor):
+    for app, model, field, target_app, target, counter in COUNTERS:
+        rows = apps.get_model(app, model).objects.filter(
+            **{field: OuterRef('pk')},
+        ).order_by().values(field).annotate(count=Count('pk'))
+        apps.get_model(target_app, target).objects.update(**{
+            counter: Coalesce(Subquery(
+                rows.values('count'), output_field=IntegerField()), 0),
+        })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_recipe_search'),
+        ('users', '0002_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='cart_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В списках покупок'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-favorites_count', '-id'], name='recipe_favorites_count_idx'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.2.19 on 2026-10-18 18:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0011_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('epoch', models.DateTimeField(verbose_name='Начало отсчёта')),
+                ('favorites_watermark', models.BigIntegerField(default=0, verbose_name='Учтено избранное до id')),
+                ('cart_watermark', models.BigIntegerField(default=0, verbose_name='Учтены списки покупок до id')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата пересчёта')),
+            ],
+            options={
+                'verbose_name': 'Состояние рейтинга популярности',
+                'verbose_name_plural': 'Состояние рейтинга популярности',
+            },
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='trending_score',
+            field=models.FloatField(default=0, editable=False, verbose_name='Популярность сейчас'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-trending_score', '-id'], include=('pub_date', 'updated_at', 'author'), name='recipe_trending_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.2.19 on 2026-10-18 18:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_trending'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeNeighbor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField(verbose_name='Похожесть')),
+                ('neighbor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='recipes.recipe', verbose_name='Похожий рецепт')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbors', to='recipes.recipe', verbose_name='Рецепт')),
+            ],
+            options={
+                'verbose_name': 'Похожий рецепт',
+                'verbose_name_plural': 'Похожие рецепты',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='recipeneighbor',
+            index=models.Index(fields=['recipe', '-score'], include=('neighbor',), name='recipe_neighbor_idx'),
+        ),
+    ]
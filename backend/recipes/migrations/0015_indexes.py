@@ -0,0 +1,82 @@
+# Generated by Django 3.2.19 on 2026-10-18 18:58
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0014_timeline'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cart',
+            name='recipe',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='in_cart', to='recipes.recipe', verbose_name='Список покупок (Корзина)'),
+        ),
+        migrations.AlterField(
+            model_name='cart',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='cart', to=settings.AUTH_USER_MODEL, verbose_name='Владелец списка'),
+        ),
+        migrations.AlterField(
+            model_name='cartproduct',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='cart_products', to=settings.AUTH_USER_MODEL, verbose_name='Владелец списка'),
+        ),
+        migrations.AlterField(
+            model_name='favoritesrecipes',
+            name='recipe',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='in_favorites', to='recipes.recipe', verbose_name='Избранные рецепты'),
+        ),
+        migrations.AlterField(
+            model_name='favoritesrecipes',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='favorites', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь'),
+        ),
+        migrations.AlterField(
+            model_name='ingredients',
+            name='ingredients',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='recipe', to='recipes.product', verbose_name='Ингредиенты из рецепта'),
+        ),
+        migrations.AlterField(
+            model_name='ingredients',
+            name='recipe',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='product', to='recipes.recipe', verbose_name='В каких рецептах'),
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='author',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='recipes', to=settings.AUTH_USER_MODEL, verbose_name='Автор рецепта'),
+        ),
+        migrations.AlterField(
+            model_name='timelineentry',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='timeline', to=settings.AUTH_USER_MODEL, verbose_name='Подписчик'),
+        ),
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['user', '-date_added'], include=('recipe',), name='cart_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='favoritesrecipes',
+            index=models.Index(fields=['user', '-date_added'], include=('recipe',), name='favorite_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', '-pub_date', '-id'], include=('updated_at',), name='recipe_author_pub_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['updated_at'], name='recipe_updated_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(django.db.models.functions.text.Upper('name'), name='recipe_name_upper_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.2.19 on 2026-10-18 19:32
+
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef
+
+
+def mark_pushed(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    TimelineEntry = apps.get_model('recipes', 'TimelineEntry')
+    Recipe.objects.filter(Exists(TimelineEntry.objects.filter(
+        recipe=OuterRef('pk')))).update(timeline_pushed=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0015_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='timeline_pushed',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Разложен по лентам подписок'),
+        ),
+        migrations.RunPython(mark_pushed, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(condition=models.Q(('timeline_pushed', False)), fields=['author', '-pub_date', '-id'], name='recipe_timeline_pull_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.19 on 2026-10-18 19:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0016_timeline_pushed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingRemoval',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=50, verbose_name='Таблица')),
+                ('relation_id', models.BigIntegerField(verbose_name='id удалённой строки')),
+                ('date_added', models.DateTimeField(verbose_name='Дата добавления удалённой строки')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='recipes.recipe', verbose_name='Рецепт')),
+            ],
+            options={
+                'verbose_name': 'Удаление для рейтинга популярности',
+                'verbose_name_plural': 'Удаления для рейтинга популярности',
+            },
+        ),
+    ]
@@ -1,10 +1,21 @@
 from colorful.fields import RGBColorField
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.core.validators import MinValueValidator
-from django.db.models import (CASCADE, SET_NULL, CharField, CheckConstraint,
-                              DateTimeField, ForeignKey, ImageField,
-                              ManyToManyField, Model, PositiveIntegerField, Q,
-                              SlugField, TextField, UniqueConstraint)
+from django.db import connection, transaction
+from django.db.models import (CASCADE, SET_NULL, BigIntegerField, BooleanField,
+                              CharField, CheckConstraint, DateTimeField,
+                              Exists, F, FloatField, ForeignKey, ImageField,
+                              Index, IntegerField, JSONField, ManyToManyField,
+                              Model, OuterRef, PositiveIntegerField, Prefetch,
+                              Q, QuerySet, SlugField, Subquery, Sum, TextField,
+                              UniqueConstraint, Value)
+from django.db.models.functions import Coalesce, Upper
+from django.utils import timezone
+
+from users.models import CountedQuerySet, RelationModel, Subscriptions
 
 User = get_user_model()
 
@@ -13,6 +24,82 @@ RED_COLOR = "#ff0000"
 YELLOW_COLOR = "#ffff00"
 BLACK_COLOR = "#000000"
 
+TAGS_CATALOG = 'tags'
+PRODUCTS_CATALOG = 'products'
+# Меняется при любом изменении состава рецептов (см. api/pantry.py). Не
+# справочник: в ETag рецептов не входит.
+RECIPE_INGREDIENTS_VERSION = 'recipe_ingredients'
+
+
+class CatalogVersionQuerySet(QuerySet):
+
+    def current(self, name):
+        """Версия каталога и время её изменения. Для каталога, который ещё
+        не менялся, - (0, None)."""
+        row = self.filter(name=name).values_list(
+            'version', 'updated_at').first()
+        return row or (0, None)
+
+    def bump(self, name):
+        if not self.filter(name=name).update(
+                version=F('version') + 1, updated_at=timezone.now()):
+            self.get_or_create(name=name, defaults={'version': 1})
+
+
+class CatalogVersion(Model):
+    """Версии справочников (тэги, продукты). Версия увеличивается при
+    каждом изменении справочника, по ней процессы сбрасывают свои кэши."""
+    name = CharField(
+        verbose_name='Справочник',
+        max_length=50,
+        unique=True,
+    )
+    version = PositiveIntegerField(
+        verbose_name='Версия',
+        default=0,
+    )
+    updated_at = DateTimeField(
+        verbose_name='Дата изменения',
+        auto_now=True,
+    )
+
+    objects = CatalogVersionQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Версия справочника'
+        verbose_name_plural = 'Версии справочников'
+
+    def __str__(self) -> str:
+        return f'{self.name}: {self.version}'
+
+
+class TrendingState(Model):
+    """Состояние пересчёта Recipe.trending_score (одна строка): от какого
+    момента отсчитываются баллы и до каких id избранного и списков покупок
+    они уже учтены (см. recipes/trending.py)."""
+    epoch = DateTimeField(
+        verbose_name='Начало отсчёта',
+    )
+    favorites_watermark = BigIntegerField(
+        verbose_name='Учтено избранное до id',
+        default=0,
+    )
+    cart_watermark = BigIntegerField(
+        verbose_name='Учтены списки покупок до id',
+        default=0,
+    )
+    updated_at = DateTimeField(
+        verbose_name='Дата пересчёта',
+        auto_now=True,
+    )
+
+    class Meta:
+        verbose_name = 'Состояние рейтинга популярности'
+        verbose_name_plural = 'Состояние рейтинга популярности'
+
+    def __str__(self) -> str:
+        return f'Рейтинг от {self.epoch:%d.%m.%Y %H:%M}'
+
 
 class Tag(Model):
     """Тэги для рецептов."""
@@ -33,6 +120,8 @@ class Tag(Model):
         verbose_name='Слаг тэга латинскими буквами',
         max_length=150,
         unique=True,
+        # Индекс уже даёт unique; без db_index PostgreSQL не создаёт
+        # второй индекс для LIKE, а фильтр tags__slug ищет по равенству.
         db_index=False,
         blank=False,
     )
@@ -86,6 +175,85 @@ class Product(Model):
         return f'{self.name} {self.measurement_unit}'
 
 
+class RecipeQuerySet(CountedQuerySet):
+    """Выборка рецептов с заранее посчитанными флагами пользователя."""
+
+    def with_user_flags(self, user):
+        """Флаги is_favorited и is_in_shopping_cart одним запросом."""
+        if not user.is_authenticated:
+            return self.annotate(
+                is_favorited=Value(False, output_field=BooleanField()),
+                is_in_shopping_cart=Value(False, output_field=BooleanField()),
+            )
+        return self.annotate(
+            is_favorited=Exists(FavoritesRecipes.objects.filter(
+                recipe=OuterRef('pk'), user=user)),
+            is_in_shopping_cart=Exists(Cart.objects.filter(
+                recipe=OuterRef('pk'), user=user)),
+        )
+
+    def with_related(self, user):
+        """Автор, тэги и ингредиенты рецептов фиксированным числом
+        запросов, независимо от размера страницы."""
+        if user.is_authenticated:
+            is_subscribed = Exists(Subscriptions.objects.filter(
+                author=OuterRef('pk'), user=user))
+        else:
+            is_subscribed = Value(False, output_field=BooleanField())
+        return self.prefetch_related(
+            Prefetch('author', queryset=User.objects.annotate(
+                is_subscribed=is_subscribed)),
+            Prefetch('product', queryset=Ingredients.objects.select_related(
+                'ingredients')),
+            'tags',
+        )
+
+    def for_user(self, user):
+        return self.with_user_flags(user).with_related(user)
+
+    def update_search_vector(self):
+        """Пересчитывает search_vector: название (вес A), названия
+        продуктов (B) и описание (C), с русской морфологией. Только для
+        PostgreSQL, на других базах поиск строит индекс в памяти."""
+        if connection.vendor != 'postgresql':
+            return 0
+        product_names = Subquery(
+            Ingredients.objects.filter(recipe=OuterRef('pk')).order_by()
+            .values('recipe')
+            .annotate(names=StringAgg('ingredients__name', ' '))
+            .values('names'),
+            output_field=TextField(),
+        )
+        return self.update(search_vector=(
+            SearchVector('name', weight='A', config='russian')
+            + SearchVector(
+                Coalesce(product_names, Value(''), output_field=TextField()),
+                weight='B', config='russian')
+            + SearchVector('text', weight='C', config='russian')
+        ))
+
+    def shared(self):
+        """Рецепты, какими их видит анонимный пользователь: общая для всех
+        часть выдачи, флаги пользователя - False без запросов."""
+        return self.for_user(AnonymousUser())
+
+    def etag_state(self, user):
+        """Всё, от чего зависит выдача рецептов пользователю, без загрузки
+        самих рецептов: id, pub_date, updated_at, дата изменения профиля
+        автора, is_favorited, is_in_shopping_cart и подписан ли
+        пользователь на автора."""
+        if user.is_authenticated:
+            is_subscribed = Exists(Subscriptions.objects.filter(
+                author=OuterRef('author'), user=user))
+        else:
+            is_subscribed = Value(False, output_field=BooleanField())
+        return self.with_user_flags(user).prefetch_related(None).annotate(
+            author_is_subscribed=is_subscribed,
+        ).values('id', 'pub_date', 'updated_at', 'is_favorited',
+                 'is_in_shopping_cart', 'author_is_subscribed',
+                 author_updated_at=F('author__updated_at'))
+
+
 class Recipe(Model):
     """Модель описывает рецепты."""
     author = ForeignKey(
@@ -95,6 +263,7 @@ class Recipe(Model):
         on_delete=SET_NULL,
         blank=False,
         null=True,
+        db_index=False,
     )
     name = CharField(
         verbose_name='Название блюда',
@@ -106,6 +275,12 @@ class Recipe(Model):
         blank=True,
         null=True
     )
+    image_renditions = JSONField(
+        verbose_name='Уменьшенные копии фото',
+        default=dict,
+        blank=True,
+        editable=False,
+    )
     text = TextField(
         verbose_name='Описание блюда',
         max_length=5000,
@@ -139,16 +314,104 @@ class Recipe(Model):
         auto_now_add=True,
         editable=False,
     )
+    updated_at = DateTimeField(
+        verbose_name='Дата изменения',
+        auto_now=True,
+    )
+    search_vector = SearchVectorField(
+        verbose_name='Поисковый индекс',
+        null=True,
+        editable=False,
+    )
+    favorites_count = PositiveIntegerField(
+        verbose_name='В избранном',
+        default=0,
+        editable=False,
+    )
+    cart_count = PositiveIntegerField(
+        verbose_name='В списках покупок',
+        default=0,
+        editable=False,
+    )
+    trending_score = FloatField(
+        verbose_name='Популярность сейчас',
+        default=0,
+        editable=False,
+    )
+    timeline_pushed = BooleanField(
+        verbose_name='Разложен по лентам подписок',
+        default=False,
+        editable=False,
+    )
+
+    objects = RecipeQuerySet.as_manager()
+    counters = {'author': 'recipes_count'}
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
-        ordering = ('-pub_date',)
+        ordering = ('-pub_date', '-id')
+        indexes = (
+            Index(fields=('-pub_date', '-id'), name='recipe_pub_date_id_idx'),
+            # Рецепты автора: фильтр author, превью в подписках, лента
+            # подписок и состояние для кэша подписок (Max(updated_at)).
+            Index(fields=('author', '-pub_date', '-id'),
+                  include=('updated_at',),
+                  name='recipe_author_pub_date_idx'),
+            # Дочитывание изменённых рецептов индексами в памяти (подбор по
+            # продуктам, поиск без PostgreSQL) и их Max(updated_at).
+            Index(fields=('updated_at',), name='recipe_updated_at_idx'),
+            # Проверка названия на повтор (name__iexact), только PostgreSQL:
+            # в SQLite iexact - это LIKE, который такой индекс не использует.
+            Index(Upper('name'), name='recipe_name_upper_idx'),
+            # Рецепты, которые лента подписок читает по автору.
+            Index(fields=('author', '-pub_date', '-id'),
+                  condition=Q(timeline_pushed=False),
+                  name='recipe_timeline_pull_idx'),
+            Index(fields=('-favorites_count', '-id'),
+                  name='recipe_favorites_count_idx'),
+            # include - всё, что нужно для etag_state из этой таблицы, без
+            # чтения её строк (только PostgreSQL).
+            Index(fields=('-trending_score', '-id'),
+                  include=('pub_date', 'updated_at', 'author'),
+                  name='recipe_trending_idx'),
+        )
 
     def __str__(self) -> str:
         return f'{self.name}. Автор: {self.author}'
 
 
+class RecipeNeighbor(Model):
+    """Похожие рецепты: лучшие соседи каждого рецепта, пересчитываются
+    командой build_recommendations (см. recipes/recommendations.py)."""
+    recipe = ForeignKey(
+        verbose_name='Рецепт',
+        related_name='neighbors',
+        to=Recipe,
+        on_delete=CASCADE,
+    )
+    neighbor = ForeignKey(
+        verbose_name='Похожий рецепт',
+        related_name='+',
+        to=Recipe,
+        on_delete=CASCADE,
+    )
+    score = FloatField(
+        verbose_name='Похожесть',
+    )
+
+    class Meta:
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        indexes = (
+            Index(fields=('recipe', '-score'), include=('neighbor',),
+                  name='recipe_neighbor_idx'),
+        )
+
+    def __str__(self) -> str:
+        return f'{self.recipe_id} -> {self.neighbor_id}: {self.score:.3f}'
+
+
 class Ingredients(Model):
     """Количество продуктов в конкретном блюде.
     Модель связывает Recipe и Product с указанием количества продукта для
@@ -160,12 +423,14 @@ class Ingredients(Model):
         related_name='product',
         to=Recipe,
         on_delete=CASCADE,
+        db_index=False,
     )
     ingredients = ForeignKey(
         verbose_name='Ингредиенты из рецепта',
         related_name='recipe',
         to=Product,
         on_delete=CASCADE,
+        db_index=False,
     )
     amount = PositiveIntegerField(
         verbose_name='Количество',
@@ -180,6 +445,11 @@ class Ingredients(Model):
         verbose_name = 'Ингридиент'
         verbose_name_plural = 'Ингридиенты'
         ordering = ('recipe',)
+        indexes = (
+            # Поиск рецептов, в которых есть все заданные продукты.
+            Index(fields=('ingredients', 'recipe'),
+                  name='ingredients_product_recipe_idx'),
+        )
         constraints = (
             UniqueConstraint(
                 fields=('recipe', 'ingredients',),
@@ -191,19 +461,65 @@ class Ingredients(Model):
         return f'{self.amount} {self.ingredients}'
 
 
-class FavoritesRecipes(Model):
+class TrendingRemoval(Model):
+    """Удалённые строки избранного и списков покупок, вклад которых ещё
+    не вычтен из Recipe.trending_score (см. recipes/trending.py)."""
+    source = CharField(
+        verbose_name='Таблица',
+        max_length=50,
+    )
+    relation_id = BigIntegerField(
+        verbose_name='id удалённой строки',
+    )
+    recipe = ForeignKey(
+        verbose_name='Рецепт',
+        related_name='+',
+        to=Recipe,
+        on_delete=CASCADE,
+    )
+    date_added = DateTimeField(
+        verbose_name='Дата добавления удалённой строки',
+    )
+
+    class Meta:
+        verbose_name = 'Удаление для рейтинга популярности'
+        verbose_name_plural = 'Удаления для рейтинга популярности'
+
+    def __str__(self) -> str:
+        return f'{self.source} {self.relation_id}'
+
+
+class TrendingRelation(RelationModel):
+    """Связь с рецептом, добавления которой учитываются в рейтинге
+    «популярное сейчас»: удаления записываются в TrendingRemoval."""
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def on_remove(cls, queryset):
+        TrendingRemoval.objects.bulk_create(
+            TrendingRemoval(source=cls._meta.model_name, relation_id=pk,
+                            recipe_id=recipe_id, date_added=date_added)
+            for pk, recipe_id, date_added in queryset.order_by().values_list(
+                'pk', 'recipe', 'date_added').iterator())
+
+
+class FavoritesRecipes(TrendingRelation):
     """Избранные рецепты. Модель связывает Recipe и User."""
     recipe = ForeignKey(
         verbose_name='Избранные рецепты',
         related_name='in_favorites',
         to=Recipe,
         on_delete=CASCADE,
+        db_index=False,
     )
     user = ForeignKey(
         verbose_name='Пользователь',
         related_name='favorites',
         to=User,
         on_delete=CASCADE,
+        db_index=False,
     )
     date_added = DateTimeField(
         verbose_name='Дата добавления',
@@ -211,6 +527,8 @@ class FavoritesRecipes(Model):
         editable=False
     )
 
+    counters = {'recipe': 'favorites_count'}
+
     class Meta:
         verbose_name = 'Избранный рецепт'
         verbose_name_plural = 'Избранные рецепты'
@@ -220,24 +538,32 @@ class FavoritesRecipes(Model):
                 name='\n%(app_label)s_%(class)s recipe is favorite already\n',
             ),
         )
+        # Отдельные индексы recipe и user не нужны: их заменяют уникальность
+        # (recipe, user) и индекс избранного пользователя по дате.
+        indexes = (
+            Index(fields=('user', '-date_added'), include=('recipe',),
+                  name='favorite_user_date_idx'),
+        )
 
     def __str__(self) -> str:
         return f'{self.user} -> {self.recipe}'
 
 
-class Cart(Model):
+class Cart(TrendingRelation):
     """Рецепты в списке покупок. Модель связывает Recipe и User."""
     recipe = ForeignKey(
         verbose_name='Список покупок (Корзина)',
         related_name='in_cart',
         to=Recipe,
         on_delete=CASCADE,
+        db_index=False,
     )
     user = ForeignKey(
         verbose_name='Владелец списка',
         related_name='cart',
         to=User,
         on_delete=CASCADE,
+        db_index=False,
     )
     date_added = DateTimeField(
         verbose_name='Дата добавления',
@@ -245,6 +571,8 @@ class Cart(Model):
         editable=False
     )
 
+    counters = {'recipe': 'cart_count'}
+
     class Meta:
         verbose_name = 'Рецепт в списке покупок'
         verbose_name_plural = 'Рецепты в списке покупок'
@@ -254,6 +582,183 @@ class Cart(Model):
                 name='\n%(app_label)s_%(class)s recipe is cart already\n',
             ),
         )
+        # Как у FavoritesRecipes.
+        indexes = (
+            Index(fields=('user', '-date_added'), include=('recipe',),
+                  name='cart_user_date_idx'),
+        )
 
     def __str__(self) -> str:
         return f'{self.user} -> {self.recipe}'
+
+
+class TimelineEntry(Model):
+    """Лента новых рецептов авторов, на которых подписан пользователь:
+    записи добавляются при публикации рецепта (см. recipes/timeline.py)."""
+    user = ForeignKey(
+        verbose_name='Подписчик',
+        related_name='timeline',
+        to=User,
+        on_delete=CASCADE,
+        db_index=False,
+    )
+    recipe = ForeignKey(
+        verbose_name='Рецепт',
+        related_name='+',
+        to=Recipe,
+        on_delete=CASCADE,
+    )
+    author = ForeignKey(
+        verbose_name='Автор рецепта',
+        related_name='+',
+        to=User,
+        on_delete=CASCADE,
+    )
+    pub_date = DateTimeField(
+        verbose_name='Дата публикации',
+    )
+
+    class Meta:
+        verbose_name = 'Запись ленты подписок'
+        verbose_name_plural = 'Лента подписок'
+        constraints = (
+            UniqueConstraint(
+                fields=('user', 'recipe'),
+                name='timeline_user_recipe_unique',
+            ),
+        )
+        indexes = (
+            Index(fields=('user', '-pub_date', '-recipe'),
+                  name='timeline_user_pub_date_idx'),
+        )
+
+    def __str__(self) -> str:
+        return f'{self.user} <- {self.recipe_id}'
+
+
+class CartProductQuerySet(QuerySet):
+    """Поддержка сводного списка покупок в актуальном состоянии."""
+
+    def apply_deltas(self, user_ids, deltas):
+        """Прибавляет к количеству продуктов в списках покупок пользователей
+        user_ids изменения deltas вида {product_id: amount}. Продукты с
+        нулевым количеством из списка удаляются."""
+        deltas = {product_id: amount
+                  for product_id, amount in deltas.items() if amount}
+        user_ids = list(user_ids)
+        if not deltas or not user_ids:
+            return
+        products_by_delta = {}
+        for product_id, amount in deltas.items():
+            products_by_delta.setdefault(amount, []).append(product_id)
+        with transaction.atomic():
+            self.bulk_create(
+                [CartProduct(user_id=user_id, product_id=product_id, amount=0)
+                 for user_id in user_ids for product_id in deltas],
+                ignore_conflicts=True,
+            )
+            rows = self.filter(user_id__in=user_ids)
+            for amount, product_ids in products_by_delta.items():
+                rows.filter(product_id__in=product_ids).update(
+                    amount=F('amount') + amount)
+            rows.filter(amount__lte=0).delete()
+
+    def add_recipes(self, user_ids, recipes, sign=1):
+        """Учитывает рецепты в списках покупок (sign=-1 - убирает)."""
+        deltas = {}
+        for product_id, amount in Ingredients.objects.filter(
+                recipe__in=recipes).values_list('ingredients', 'amount'):
+            deltas[product_id] = deltas.get(product_id, 0) + sign * amount
+        self.apply_deltas(user_ids, deltas)
+
+    def remove_recipes(self, user_ids, recipes):
+        self.add_recipes(user_ids, recipes, sign=-1)
+
+    def add_recipe(self, user_ids, recipe):
+        self.add_recipes(user_ids, (recipe,))
+
+    def remove_recipe(self, user_ids, recipe):
+        self.remove_recipes(user_ids, (recipe,))
+
+    @staticmethod
+    def recipe_amounts(recipe):
+        """Состав рецепта в базе: {product_id: amount}."""
+        return dict(Ingredients.objects.filter(recipe=recipe).values_list(
+            'ingredients', 'amount'))
+
+    def change_recipe(self, recipe, old_amounts, new_amounts):
+        """Переносит изменение состава рецепта в списки покупок всех, у
+        кого рецепт в корзине. old_amounts и new_amounts - словари
+        {product_id: amount} до и после изменения."""
+        deltas = {
+            product_id: (new_amounts.get(product_id, 0)
+                         - old_amounts.get(product_id, 0))
+            for product_id in {*old_amounts, *new_amounts}
+        }
+        self.apply_deltas(
+            recipe.in_cart.values_list('user', flat=True), deltas)
+
+    @staticmethod
+    def calculate(user_ids=None):
+        """Список покупок, посчитанный заново по корзинам: строки
+        (user_id, product_id, amount)."""
+        if user_ids is None:
+            ingredients = Ingredients.objects.filter(
+                recipe__in_cart__isnull=False)
+        else:
+            ingredients = Ingredients.objects.filter(
+                recipe__in_cart__user__in=user_ids)
+        return ingredients.values_list(
+            'recipe__in_cart__user', 'ingredients',
+        ).annotate(amount=Sum('amount')).order_by()
+
+    def rebuild(self, user_ids=None):
+        """Пересобирает сводный список покупок из корзин."""
+        with transaction.atomic():
+            rows = self.all()
+            if user_ids is not None:
+                rows = rows.filter(user_id__in=user_ids)
+            rows.delete()
+            self.bulk_create(
+                CartProduct(user_id=user_id, product_id=product_id,
+                            amount=amount)
+                for user_id, product_id, amount in self.calculate(user_ids)
+            )
+
+
+class CartProduct(Model):
+    """Сводный список покупок: сколько каждого продукта нужно пользователю
+    для всех рецептов в его корзине. Обновляется при изменении корзины,
+    состава рецептов (в API и админке) и удалении рецепта (сигнал
+    pre_delete), пересобирается командой rebuild_cart_products."""
+    user = ForeignKey(
+        verbose_name='Владелец списка',
+        related_name='cart_products',
+        to=User,
+        on_delete=CASCADE,
+        db_index=False,
+    )
+    product = ForeignKey(
+        verbose_name='Продукт',
+        related_name='in_cart_products',
+        to=Product,
+        on_delete=CASCADE,
+    )
+    amount = IntegerField(
+        verbose_name='Количество',
+    )
+
+    objects = CartProductQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Продукт в списке покупок'
+        verbose_name_plural = 'Продукты в списке покупок'
+        constraints = (
+            UniqueConstraint(
+                fields=('user', 'product',),
+                name='unique_for_cart_product',
+            ),
+        )
+
+    def __str__(self) -> str:
+        return f'{self.user} -> {self.amount} {self.product}'
@@ -0,0 +1,257 @@
+"""Рекомендации «вам может понравиться».
+
+Похожесть рецептов считается командой build_recommendations и хранится в
+RecipeNeighbor как RECOMMENDATION_NEIGHBORS лучших соседей каждого
+рецепта. Складываются три косинусные меры по разреженным векторам;
+произведения векторов для первых двух считает база группировкой
+соединения таблицы с самой собой:
+- кто добавлял рецепты в избранное (вес 1) и список покупок (вес 0.5);
+- общие продукты, без самых распространённых (соль, вода и т.п.);
+- общие тэги, только для уже найденных по первым двум мерам соседей.
+При запросе объединяются списки соседей рецептов пользователя.
+"""
+import heapq
+from collections import Counter, defaultdict
+from math import sqrt
+
+from django.db import connections, transaction
+from django.db.models import Count, F, Q
+
+from users.models import Subscriptions
+
+from .models import Cart, FavoritesRecipes, Ingredients, Recipe, RecipeNeighbor
+
+RECOMMENDATION_NEIGHBORS = 30
+# Модель, вес добавления рецепта.
+INTERACTIONS = ((FavoritesRecipes, 1.0), (Cart, 0.5))
+# Те же таблицы со стороны пользователя: related_name, вес.
+RELATED_INTERACTIONS = (('favorites', 1.0), ('cart', 0.5))
+# Вклад мер похожести в итоговую оценку.
+COOCCURRENCE_WEIGHT = 1.0
+PRODUCTS_WEIGHT = 0.6
+TAGS_WEIGHT = 0.2
+# Пользователи, у которых в избранном или списке покупок больше рецептов,
+# не учитываются: пары считаются по квадрату их числа.
+MAX_USER_RECIPES = 200
+# Продукты, которые есть в большей доле рецептов, похожести не добавляют.
+MAX_PRODUCT_SHARE = 0.05
+# Сколько последних рецептов пользователя берётся для подбора.
+MAX_SEEDS = 100
+# Во сколько раз выше оценка рецептов авторов, на которых подписан
+# пользователь.
+SUBSCRIBED_BOOST = 1.5
+MAX_RECOMMENDATIONS = 200
+# Сколько рецептов обрабатывается за раз.
+RECIPES_PER_BATCH = 500
+BATCH_SIZE = 5000
+
+
+def heavy_users():
+    """Пользователи, у которых больше MAX_USER_RECIPES рецептов в
+    избранном или списке покупок: их пары рецептов не учитываются."""
+    condition = Q()
+    for model, weight in INTERACTIONS:
+        condition |= Q(user__in=model.objects.order_by().values(
+            'user').annotate(count=Count('pk')).filter(
+                count__gt=MAX_USER_RECIPES).values('user'))
+    return condition
+
+
+def raw_rows(queryset):
+    """Строки запроса как есть, без преобразования значений в Django:
+    пар рецептов миллионы, а значения - целые числа."""
+    sql, params = queryset.query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchmany(BATCH_SIZE)
+        while rows:
+            yield from rows
+            rows = cursor.fetchmany(BATCH_SIZE)
+
+
+def cooccurrence(recipes, excluded_users):
+    """Скалярные произведения векторов рецептов recipes (выборка) со
+    всеми рецептами, у которых есть общие пользователи: {(recipe_id,
+    other_id): значение}. Вектор рецепта - сумма весов INTERACTIONS по
+    пользователям; произведения считаются в базе соединением таблиц
+    избранного и списков покупок с самими собой через пользователя."""
+    products = Counter()
+    for model, weight in INTERACTIONS:
+        for related_name, other_weight in RELATED_INTERACTIONS:
+            rows = model.objects.filter(**{
+                'recipe__in': recipes,
+                f'user__{related_name}__isnull': False,
+            }).exclude(excluded_users).order_by().values_list(
+                'recipe', f'user__{related_name}__recipe',
+            ).annotate(count=Count('pk'))
+            for recipe_id, other_id, count in raw_rows(rows):
+                products[recipe_id, other_id] += weight * other_weight * count
+    return products
+
+
+def cooccurrence_norms(excluded_users):
+    """Квадраты норм векторов всех рецептов."""
+    norms = Counter()
+    for model, weight in INTERACTIONS:
+        for related_name, other_weight in RELATED_INTERACTIONS:
+            rows = model.objects.filter(**{
+                f'user__{related_name}__recipe': F('recipe'),
+            }).exclude(excluded_users).order_by().values_list(
+                'recipe').annotate(count=Count('pk'))
+            for recipe_id, count in rows.iterator():
+                norms[recipe_id] += weight * other_weight * count
+    return norms
+
+
+def common_products(recipes, frequent):
+    """Число общих продуктов, кроме frequent, рецептов recipes с другими
+    рецептами: {(recipe_id, other_id): число}."""
+    return {
+        (recipe_id, other_id): count
+        for recipe_id, other_id, count in raw_rows(Ingredients.objects.filter(
+            recipe__in=recipes,
+        ).exclude(ingredients__in=frequent).order_by().values_list(
+            'recipe', 'ingredients__recipe__recipe',
+        ).annotate(count=Count('pk')))
+    }
+
+
+def frequent_products():
+    """Продукты, которые есть больше чем в MAX_PRODUCT_SHARE рецептов
+    (но не меньше чем в двух)."""
+    max_count = max(2, int(Recipe.objects.count() * MAX_PRODUCT_SHARE))
+    return list(Ingredients.objects.order_by().values('ingredients').annotate(
+        count=Count('pk')).filter(count__gt=max_count).values_list(
+            'ingredients', flat=True))
+
+
+def recipe_sets(rows):
+    sets = defaultdict(set)
+    for recipe_id, value in rows.iterator():
+        sets[recipe_id].add(value)
+    return sets
+
+
+def add_cosine(candidates, products, norms, weight):
+    """candidates[recipe_id][other_id] += weight * косинус."""
+    roots = {}
+    for (recipe_id, other_id), value in products.items():
+        if other_id == recipe_id:
+            continue
+        for pk in (recipe_id, other_id):
+            if pk not in roots:
+                roots[pk] = sqrt(norms[pk])
+        candidates[recipe_id][other_id] += weight * value / (
+            roots[recipe_id] * roots[other_id])
+
+
+def nearest(recipe_id, candidates, tags):
+    """Лучшие соседи с учётом тэгов. Тэги добавляют не больше
+    TAGS_WEIGHT, поэтому проверяются только кандидаты, которые с такой
+    прибавкой могут попасть в лучшие."""
+    best = heapq.nlargest(
+        RECOMMENDATION_NEIGHBORS, candidates.values())
+    if not best:
+        return []
+    threshold = best[-1] - TAGS_WEIGHT
+    recipe_tags = tags.get(recipe_id, set())
+    scores = []
+    for other_id, score in candidates.items():
+        if score < threshold:
+            continue
+        other_tags = tags.get(other_id, set())
+        if recipe_tags and other_tags:
+            score += TAGS_WEIGHT * len(recipe_tags & other_tags) / sqrt(
+                len(recipe_tags) * len(other_tags))
+        scores.append((score, other_id))
+    return heapq.nlargest(RECOMMENDATION_NEIGHBORS, scores)
+
+
+def build_neighbors():
+    """Пересчитывает RecipeNeighbor пачками по RECIPES_PER_BATCH
+    рецептов: в памяти только пары рецептов пачки, соседи каждой пачки
+    заменяются отдельной транзакцией. Возвращает число записей."""
+    excluded_users = heavy_users()
+    norms = cooccurrence_norms(excluded_users)
+    products_norms = dict(Ingredients.objects.order_by().values_list(
+        'recipe').annotate(count=Count('pk')))
+    frequent = frequent_products()
+    tags = recipe_sets(Recipe.tags.through.objects.values_list(
+        'recipe', 'tag'))
+    recipe_ids = list(Recipe.objects.order_by('id').values_list(
+        'id', flat=True))
+    written = 0
+    for start in range(0, len(recipe_ids), RECIPES_PER_BATCH):
+        batch = recipe_ids[start:start + RECIPES_PER_BATCH]
+        candidates = defaultdict(Counter)
+        add_cosine(candidates, cooccurrence(batch, excluded_users), norms,
+                   COOCCURRENCE_WEIGHT)
+        add_cosine(candidates, common_products(batch, frequent),
+                   products_norms, PRODUCTS_WEIGHT)
+        neighbors = [
+            RecipeNeighbor(recipe_id=recipe_id, neighbor_id=other_id,
+                           score=score)
+            for recipe_id, recipe_candidates in candidates.items()
+            for score, other_id in nearest(
+                recipe_id, recipe_candidates, tags)
+        ]
+        with transaction.atomic():
+            RecipeNeighbor.objects.filter(recipe__in=batch).delete()
+            RecipeNeighbor.objects.bulk_create(
+                neighbors, batch_size=BATCH_SIZE)
+        written += len(neighbors)
+    return written
+
+
+def seed_weights(user):
+    """Последние рецепты пользователя в избранном и списке покупок."""
+    seeds = Counter()
+    for model, weight in INTERACTIONS:
+        for recipe_id in model.objects.filter(user=user).order_by(
+                '-date_added').values_list('recipe', flat=True)[:MAX_SEEDS]:
+            seeds[recipe_id] = max(seeds[recipe_id], weight)
+    return seeds
+
+
+def popular(user):
+    return [
+        (recipe_id, 0.0) for recipe_id in Recipe.objects.exclude(
+            in_favorites__user=user,
+        ).exclude(in_cart__user=user).exclude(author=user).order_by(
+            '-trending_score', '-id',
+        ).values_list('id', flat=True)[:MAX_RECOMMENDATIONS]
+    ]
+
+
+def recommend(user):
+    """Рецепты для пользователя по убыванию оценки: [(recipe_id, оценка)].
+    Без рецептов из его избранного и списка покупок и собственных; если
+    подобрать нечего - популярное сейчас."""
+    seeds = seed_weights(user)
+    scores = Counter()
+    for recipe_id, neighbor_id, score in RecipeNeighbor.objects.filter(
+            recipe__in=list(seeds)).values_list(
+                'recipe', 'neighbor', 'score'):
+        if neighbor_id not in seeds:
+            scores[neighbor_id] += seeds[recipe_id] * score
+    # Подписки, избранное и список покупок проверяются только у лучших
+    # кандидатов: seeds - лишь последние MAX_SEEDS рецептов.
+    scores = dict(scores.most_common(MAX_RECOMMENDATIONS * 2))
+    excluded = set()
+    for model, weight in INTERACTIONS:
+        excluded.update(model.objects.filter(
+            user=user, recipe__in=list(scores),
+        ).values_list('recipe', flat=True))
+    subscribed = set(Subscriptions.objects.filter(user=user).values_list(
+        'author', flat=True))
+    for recipe_id, author_id in Recipe.objects.filter(
+            id__in=list(scores)).values_list('id', 'author'):
+        if author_id == user.id:
+            excluded.add(recipe_id)
+        elif author_id in subscribed:
+            scores[recipe_id] *= SUBSCRIBED_BOOST
+    ranked = sorted(
+        ((recipe_id, score) for recipe_id, score in scores.items()
+         if recipe_id not in excluded),
+        key=lambda item: (-item[1], -item[0]))
+    return ranked[:MAX_RECOMMENDATIONS] or popular(user)
@@ -0,0 +1,63 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+
+from recipes.models import Cart, CartProduct, Ingredients, Product, Recipe, Tag
+
+User = get_user_model()
+
+
+class CartProductsAdminTest(TestCase):
+    """Сводный список покупок после правок рецепта в админке."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password')
+        cls.buyer = User.objects.create(
+            username='buyer', email='buyer@example.com')
+        cls.tag = Tag.objects.create(name='Тэг', color='#00ff00', slug='tag')
+        cls.salt, cls.sugar = (
+            Product.objects.create(name=name, measurement_unit='г')
+            for name in ('соль', 'сахар'))
+        cls.recipe = Recipe.objects.create(
+            author=cls.admin, name='Рецепт', text='Описание',
+            cooking_time=10)
+        cls.recipe.tags.set((cls.tag,))
+        cls.ingredient = Ingredients.objects.create(
+            recipe=cls.recipe, ingredients=cls.salt, amount=5)
+        Cart.objects.create_if_absent(user=cls.buyer, recipe=cls.recipe)
+        CartProduct.objects.add_recipe((cls.buyer.id,), cls.recipe)
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def cart_products(self):
+        return dict(CartProduct.objects.filter(user=self.buyer).values_list(
+            'product', 'amount'))
+
+    def test_change_ingredients(self):
+        url = f'/admin/recipes/recipe/{self.recipe.id}/change/'
+        response = self.client.post(url, {
+            'author': self.admin.id, 'name': 'Рецепт', 'text': 'Описание',
+            'cooking_time': 10, 'tags': [self.tag.id],
+            'product-TOTAL_FORMS': 2, 'product-INITIAL_FORMS': 1,
+            'product-MIN_NUM_FORMS': 0, 'product-MAX_NUM_FORMS': 1000,
+            'product-0-id': self.ingredient.id,
+            'product-0-recipe': self.recipe.id,
+            'product-0-ingredients': self.salt.id, 'product-0-amount': 7,
+            'product-1-recipe': self.recipe.id,
+            'product-1-ingredients': self.sugar.id, 'product-1-amount': 3,
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.cart_products(),
+                         {self.salt.id: 7, self.sugar.id: 3})
+        self.assertEqual(self.cart_products(), {
+            product_id: amount for user_id, product_id, amount
+            in CartProduct.objects.calculate((self.buyer.id,))})
+
+    def test_delete_recipe(self):
+        response = self.client.post(
+            f'/admin/recipes/recipe/{self.recipe.id}/delete/',
+            {'post': 'yes'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.cart_products(), {})
@@ -0,0 +1,62 @@
+import shutil
+import tempfile
+from io import StringIO
+from pathlib import Path
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from recipes.models import Product, Tag
+
+PRODUCTS = '''name,measurement_unit
+соль,г
+соль,г
+сахар,г
+'''
+TAGS = '''name,color,slug
+Завтрак,#ff0000,breakfast
+Обед,#ff0000,lunch
+Завтрак,#00ff00,morning
+Ужин,#0000ff,dinner
+Полдник,#808080,dinner
+Перекус,#ffff00,snack
+'''
+
+
+class LoadDataTest(TestCase):
+    """Подсчёт новых записей с учётом всех уникальных полей."""
+
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.directory)
+        for name, content in (('products.csv', PRODUCTS),
+                              ('tags.csv', TAGS)):
+            (self.directory / name).write_text(content, encoding='utf8')
+        Tag.objects.create(name='Перекус', color='#123456', slug='bite')
+
+    def load(self, *args):
+        out = StringIO()
+        call_command('load_data',
+                     '--products', self.directory / 'products.csv',
+                     '--tags', self.directory / 'tags.csv',
+                     *args, stdout=out)
+        return out.getvalue()
+
+    def test_counts_match_for_dry_run_and_load(self):
+        for args in (('--dry-run',), ()):
+            with self.subTest(args=args):
+                output = self.load(*args)
+                self.assertIn(
+                    'Продукты: прочитано 3, новых 2, уже были 0, '
+                    'дубликатов 1', output)
+                self.assertIn(
+                    'Тэги: прочитано 6, новых 2, уже были 1, '
+                    'дубликатов 3', output)
+        self.assertEqual(Product.objects.count(), 2)
+        self.assertEqual(Tag.objects.count(), 3)
+
+    def test_reload_adds_nothing(self):
+        self.load()
+        output = self.load()
+        self.assertIn('Продукты: прочитано 3, новых 0, уже были 2', output)
+        self.assertIn('Тэги: прочитано 6, новых 0, уже были 3', output)
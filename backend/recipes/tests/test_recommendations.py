@@ -0,0 +1,32 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+
+from recipes.models import Cart, Recipe, RecipeNeighbor
+from recipes.recommendations import recommend
+
+User = get_user_model()
+
+
+class RecommendTest(TestCase):
+
+    def test_old_cart_recipes_are_excluded(self):
+        """Рецепт из списка покупок не рекомендуется, даже если он не
+        среди последних MAX_SEEDS."""
+        author = User.objects.create(
+            username='author', email='author@example.com')
+        user = User.objects.create(username='user', email='user@example.com')
+        other, old, new = (
+            Recipe.objects.create(author=author, name=f'Рецепт {i}',
+                                  text='Описание', cooking_time=10)
+            for i in range(3))
+        Cart.objects.create(user=user, recipe=old)
+        Cart.objects.create(user=user, recipe=new)
+        RecipeNeighbor.objects.bulk_create(
+            RecipeNeighbor(recipe=new, neighbor=neighbor, score=score)
+            for neighbor, score in ((old, 0.9), (other, 0.5)))
+        with mock.patch('recipes.recommendations.MAX_SEEDS', 1):
+            self.assertEqual(
+                [recipe_id for recipe_id, score in recommend(user)],
+                [other.id])
@@ -0,0 +1,71 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+
+from recipes import timeline
+from recipes.models import Recipe, TimelineEntry
+from users.models import Subscriptions
+
+User = get_user_model()
+
+
+@override_settings(TIMELINE_FANOUT_LIMIT=1)
+class TimelineTest(TestCase):
+    """Рецепты в ленте при переходе числа подписчиков через предел."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(
+            username='author', email='author@example.com')
+        cls.first, cls.second, cls.third = (
+            User.objects.create(username=name, email=f'{name}@example.com')
+            for name in ('first', 'second', 'third'))
+
+    def subscribe(self, user):
+        Subscriptions.objects.create(user=user, author=self.author)
+        timeline.follow(user, self.author)
+
+    def unsubscribe(self, user):
+        Subscriptions.objects.remove(user=user, author=self.author)
+        timeline.unfollow(user, self.author.id)
+
+    def publish(self, name):
+        recipe = Recipe.objects.create(
+            author=User.objects.get(pk=self.author.pk), name=name,
+            text='Описание', cooking_time=10)
+        timeline.publish(recipe)
+        return recipe
+
+    def read(self, user):
+        return [item['id'] for item in timeline.read(user, limit=10)]
+
+    def test_pulled_recipe_stays_when_author_drops_below_limit(self):
+        self.subscribe(self.first)
+        self.subscribe(self.second)
+        recipe = self.publish('Рецепт')
+        self.assertFalse(recipe.timeline_pushed)
+        self.unsubscribe(self.second)
+        self.assertEqual(self.read(self.first), [recipe.id])
+
+    def test_pushed_recipe_reaches_followers_above_limit(self):
+        self.subscribe(self.first)
+        recipe = self.publish('Рецепт')
+        self.assertTrue(recipe.timeline_pushed)
+        self.subscribe(self.second)
+        self.subscribe(self.third)
+        newer = self.publish('Новый рецепт')
+        self.assertFalse(newer.timeline_pushed)
+        for user in (self.first, self.second, self.third):
+            self.assertEqual(self.read(user), [newer.id, recipe.id])
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=10, TIMELINE_MAX_ENTRIES=2)
+    def test_trim_keeps_newest_entries(self):
+        self.subscribe(self.first)
+        recipes = [self.publish(f'Рецепт {i}') for i in range(4)]
+        self.subscribe(self.second)
+        self.assertEqual(timeline.trim_all(), 2)
+        self.assertEqual(
+            set(TimelineEntry.objects.filter(
+                user=self.first).values_list('recipe', flat=True)),
+            {recipes[2].id, recipes[3].id})
+        self.assertEqual(
+            TimelineEntry.objects.filter(user=self.second).count(), 2)
@@ -0,0 +1,65 @@
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.utils import timezone
+
+from recipes.models import Cart, FavoritesRecipes, Recipe, TrendingRemoval
+from recipes.trending import update_trending
+
+User = get_user_model()
+
+
+class TrendingRemovalTest(TestCase):
+    """Удаление из избранного и списков покупок уменьшает рейтинг."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(
+            username='author', email='author@example.com')
+        cls.user = User.objects.create(
+            username='user', email='user@example.com')
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='Рецепт', text='Описание',
+            cooking_time=10)
+
+    def add(self, model, user=None):
+        model.objects.create_if_absent(
+            user=user or self.user, recipe=self.recipe)
+        model.objects.update(
+            date_added=timezone.now() - timedelta(minutes=5))
+
+    def score(self):
+        return Recipe.objects.get(pk=self.recipe.pk).trending_score
+
+    def test_removal_subtracts_counted_row(self):
+        for model in (FavoritesRecipes, Cart):
+            self.add(model)
+        update_trending()
+        self.assertGreater(self.score(), 0)
+        FavoritesRecipes.objects.remove(user=self.user, recipe=self.recipe)
+        Cart.objects.filter(user=self.user).delete()
+        self.assertEqual(update_trending(), 2)
+        self.assertAlmostEqual(self.score(), 0)
+        self.assertFalse(TrendingRemoval.objects.exists())
+
+    def test_removal_before_counting_is_skipped(self):
+        update_trending()
+        self.add(FavoritesRecipes)
+        FavoritesRecipes.objects.remove(user=self.user, recipe=self.recipe)
+        self.add(Cart)
+        update_trending()
+        self.assertAlmostEqual(self.score(), 0.5, places=2)
+
+    def test_user_delete(self):
+        self.add(FavoritesRecipes)
+        update_trending()
+        self.user.delete()
+        update_trending()
+        self.assertAlmostEqual(self.score(), 0)
+
+    def test_recipe_delete(self):
+        self.add(FavoritesRecipes)
+        self.recipe.delete()
+        self.assertFalse(TrendingRemoval.objects.exists())
+        update_trending()
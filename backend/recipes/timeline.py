@@ -0,0 +1,121 @@
+"""Лента подписок: новые рецепты авторов, на которых подписан
+пользователь.
+
+Рецепт при публикации раскладывается по лентам подписчиков автора
+(TimelineEntry), и чтение ленты - это выборка по индексу
+(user, -pub_date, -recipe). У авторов, подписчиков которых больше
+TIMELINE_FANOUT_LIMIT, рецепты не раскладываются: при чтении они
+выбираются напрямую по автору и сливаются с лентой. Способ доставки
+запоминается в рецепте (timeline_pushed), поэтому рецепты не пропадают
+из лент, когда число подписчиков автора переходит через предел.
+В ленте пользователя хранится не больше TIMELINE_MAX_ENTRIES записей,
+лишние удаляет manage.py trim_timelines.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count, Q
+
+from users.models import Subscriptions
+
+from .models import Recipe, TimelineEntry
+
+User = get_user_model()
+
+BATCH_SIZE = 1000
+
+
+def fan_out(author):
+    return author.subscribers_count <= settings.TIMELINE_FANOUT_LIMIT
+
+
+def publish(recipe):
+    """Раскладывает новый рецепт по лентам подписчиков автора."""
+    author = recipe.author
+    if author is None or not fan_out(author):
+        return
+    with transaction.atomic():
+        TimelineEntry.objects.bulk_create(
+            (TimelineEntry(user_id=user_id, recipe=recipe, author=author,
+                           pub_date=recipe.pub_date)
+             for user_id in Subscriptions.objects.filter(
+                 author=author).values_list('user', flat=True).iterator()),
+            batch_size=BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+        Recipe.objects.filter(pk=recipe.pk).update(timeline_pushed=True)
+    recipe.timeline_pushed = True
+
+
+def follow(user, author):
+    """Добавляет в ленту последние разложенные рецепты нового автора:
+    остальные и так читаются по автору."""
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user=user, recipe_id=recipe_id, author=author,
+                       pub_date=pub_date)
+         for recipe_id, pub_date in Recipe.objects.filter(
+             author=author, timeline_pushed=True).order_by(
+                 '-pub_date', '-id').values_list(
+                     'id', 'pub_date')[:settings.TIMELINE_BACKFILL]),
+        ignore_conflicts=True,
+    )
+    trim(user)
+
+
+def unfollow(user, author_id):
+    TimelineEntry.objects.filter(user=user, author=author_id).delete()
+
+
+def trim(user_id):
+    """Оставляет в ленте пользователя TIMELINE_MAX_ENTRIES новых записей."""
+    entries = TimelineEntry.objects.filter(user=user_id)
+    cutoff = entries.order_by('-pub_date', '-recipe').values_list(
+        'pub_date', 'recipe')[settings.TIMELINE_MAX_ENTRIES:][:1]
+    if not cutoff:
+        return 0
+    pub_date, pk = cutoff[0]
+    deleted, _ = entries.filter(
+        Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, recipe__lte=pk),
+    ).delete()
+    return deleted
+
+
+def trim_all():
+    """Обрезает ленты всех пользователей, где записей больше предела."""
+    return sum(
+        trim(user_id)
+        for user_id in TimelineEntry.objects.values('user').annotate(
+            entries=Count('id'),
+        ).filter(
+            entries__gt=settings.TIMELINE_MAX_ENTRIES,
+        ).values_list('user', flat=True).iterator()
+    )
+
+
+def before(position, recipe_field):
+    if position is None:
+        return Q()
+    pub_date, pk = position
+    return (Q(pub_date__lt=pub_date)
+            | Q(pub_date=pub_date, **{f'{recipe_field}__lt': pk}))
+
+
+def read(user, position=None, limit=10):
+    """Рецепты ленты от новых к старым, после position = (pub_date, id):
+    до limit словарей {'id', 'pub_date'}. Два запроса по индексам: лента
+    и неразложенные рецепты авторов."""
+    pushed = TimelineEntry.objects.filter(
+        before(position, 'recipe'), user=user,
+    ).order_by('-pub_date', '-recipe').values_list('recipe', 'pub_date')
+    pulled = Recipe.objects.filter(
+        before(position, 'id'),
+        timeline_pushed=False,
+        author__in=User.objects.filter(subscribers__user=user).values('id'),
+    ).order_by('-pub_date', '-id').values_list('id', 'pub_date')
+    items = dict(pushed[:limit])
+    items.update(pulled[:limit])
+    return [{'id': recipe_id, 'pub_date': pub_date}
+            for pub_date, recipe_id in sorted(
+                ((pub_date, recipe_id)
+                 for recipe_id, pub_date in items.items()),
+                reverse=True)[:limit]]
@@ -0,0 +1,137 @@
+"""Рейтинг «популярное сейчас» (Recipe.trending_score).
+
+Каждое добавление рецепта в избранное или список покупок даёт ему вклад
+weight * 2 ** ((date_added - epoch) / half_life). Все вклады растут со
+временем одинаково, поэтому порядок по их сумме совпадает с порядком по
+баллам, затухающим вдвое за half_life, и старые вклады не пересчитываются:
+update_trending только прибавляет вклады строк, добавленных с прошлого
+запуска. Удалённые строки записываются в TrendingRemoval (см.
+TrendingRelation), и update_trending вычитает их вклады, если они были
+учтены. Когда показатель степени становится слишком большим, все баллы
+умножаются на общий множитель, а epoch переносится на текущий момент.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Max, Value, When
+from django.utils import timezone
+
+from .models import (Cart, FavoritesRecipes, Recipe, TrendingRemoval,
+                     TrendingState)
+
+# Модель, поле TrendingState с последним учтённым id, вес добавления.
+SOURCES = (
+    (FavoritesRecipes, 'favorites_watermark', 1.0),
+    (Cart, 'cart_watermark', 0.5),
+)
+# Строки моложе этого могут быть в ещё не завершённых транзакциях с
+# меньшими id, их учтёт следующий запуск.
+SETTLE_TIME = timedelta(seconds=30)
+MAX_EXPONENT = 64
+# При полном пересчёте не учитываются строки старше стольких периодов
+# полураспада: их вклад меньше миллионной доли.
+FORGET_AFTER = 20
+BATCH_SIZE = 1000
+
+
+def half_life():
+    return timedelta(hours=settings.TRENDING_HALF_LIFE_HOURS)
+
+
+def exponent(moment, epoch):
+    return (moment - epoch) / half_life()
+
+
+def add_scores(deltas):
+    """Прибавляет к баллам рецептов {recipe_id: вклад} пачками по
+    BATCH_SIZE рецептов за запрос."""
+    items = list(deltas.items())
+    for start in range(0, len(items), BATCH_SIZE):
+        batch = items[start:start + BATCH_SIZE]
+        Recipe.objects.filter(pk__in=[pk for pk, delta in batch]).update(
+            trending_score=F('trending_score') + Case(
+                *(When(pk=pk, then=Value(delta)) for pk, delta in batch),
+                default=Value(0.0),
+                output_field=FloatField(),
+            ))
+
+
+def reset(state, now):
+    Recipe.objects.exclude(trending_score=0).update(trending_score=0)
+    state.epoch = now
+    forgotten = now - half_life() * FORGET_AFTER
+    for model, watermark, weight in SOURCES:
+        setattr(state, watermark, model.objects.filter(
+            date_added__lt=forgotten).aggregate(Max('id'))['id__max'] or 0)
+
+
+def rebase(state, now):
+    Recipe.objects.exclude(trending_score=0).update(
+        trending_score=F('trending_score')
+        * 2 ** -exponent(now, state.epoch))
+    state.epoch = now
+
+
+def add_new(state, model, watermark, weight, now):
+    """Прибавляет вклады строк model, добавленных после watermark:
+    множество их id."""
+    last = getattr(state, watermark)
+    deltas = defaultdict(float)
+    added = set()
+    rows = model.objects.filter(
+        id__gt=last, date_added__lt=now - SETTLE_TIME,
+    ).order_by('id').values_list('id', 'recipe', 'date_added')
+    for pk, recipe_id, date_added in rows.iterator():
+        deltas[recipe_id] += weight * 2 ** exponent(date_added, state.epoch)
+        last = pk
+        added.add(pk)
+    add_scores(deltas)
+    setattr(state, watermark, last)
+    return added
+
+
+def subtract_removed(state, model, weight, counted_until, added):
+    """Вычитает вклады удалённых строк model, учтённых прошлыми запусками
+    (id не больше counted_until) или этим (id в added): сколько удалений
+    обработано. Удаления читаются после новых строк: строка, удалённая
+    после того, как её прочитал add_new, уже есть в added."""
+    deltas = defaultdict(float)
+    pks = []
+    removals = TrendingRemoval.objects.filter(
+        source=model._meta.model_name,
+    ).values_list('id', 'relation_id', 'recipe', 'date_added')
+    for pk, relation_id, recipe_id, date_added in removals.iterator():
+        pks.append(pk)
+        if relation_id <= counted_until or relation_id in added:
+            deltas[recipe_id] -= (
+                weight * 2 ** exponent(date_added, state.epoch))
+    add_scores(deltas)
+    for start in range(0, len(pks), BATCH_SIZE):
+        TrendingRemoval.objects.filter(
+            pk__in=pks[start:start + BATCH_SIZE]).delete()
+    return len(pks)
+
+
+def update_trending(rebuild=False):
+    """Учитывает новые и удалённые строки избранного и списков покупок,
+    с rebuild - пересчитывает баллы заново. Возвращает, сколько строк
+    учтено."""
+    now = timezone.now()
+    processed = 0
+    with transaction.atomic():
+        state, created = TrendingState.objects.select_for_update(
+        ).get_or_create(pk=1, defaults={'epoch': now})
+        if rebuild:
+            reset(state, now)
+        elif exponent(now, state.epoch) > MAX_EXPONENT:
+            rebase(state, now)
+        for model, watermark, weight in SOURCES:
+            # После reset ни одна строка ещё не учтена.
+            counted_until = 0 if rebuild else getattr(state, watermark)
+            added = add_new(state, model, watermark, weight, now)
+            processed += len(added) + subtract_removed(
+                state, model, weight, counted_until, added)
+        state.save()
+    return processed
@@ -1,4 +1,5 @@
 from django.contrib import admin
+from django.db.models import Count
 
 from .models import Subscriptions, UserFoodgram
 
@@ -11,18 +12,27 @@ class UserFoodgramAdmin(admin.ModelAdmin):
         'username',
         'count_recipes',
         'count_subs',
+        'count_subscribers',
         'last_name',
         'first_name')
     search_fields = ('email', 'username')
     list_filter = ('email', 'username')
 
-    @staticmethod
-    def count_recipes(obj):
-        return obj.recipes.count()
+    @admin.display(description='Рецептов', ordering='recipes_count')
+    def count_recipes(self, obj):
+        return obj.recipes_count
 
-    @staticmethod
-    def count_subs(obj):
-        return obj.subscriptions.count()
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            subscriptions_count=Count('subscriptions'))
+
+    @admin.display(description='Подписок', ordering='subscriptions_count')
+    def count_subs(self, obj):
+        return obj.subscriptions_count
+
+    @admin.display(description='Подписчиков', ordering='subscribers_count')
+    def count_subscribers(self, obj):
+        return obj.subscribers_count
 
 
 @admin.register(Subscriptions)
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.19 on 2026-10-18 18:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userfoodgram',
+            name='recipes_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Рецептов'),
+        ),
+        migrations.AddField(
+            model_name='userfoodgram',
+            name='subscribers_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Подписчиков'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.2.19 on 2026-10-18 18:58
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_counters'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='subscriptions',
+            name='author',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='subscribers', to=settings.AUTH_USER_MODEL, verbose_name='Автор рецепта'),
+        ),
+        migrations.AlterField(
+            model_name='subscriptions',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='subscriptions', to=settings.AUTH_USER_MODEL, verbose_name='Подписчики'),
+        ),
+        migrations.AddIndex(
+            model_name='subscriptions',
+            index=models.Index(fields=['user', '-date_added'], include=('author',), name='subscription_user_date_idx'),
+        ),
+    ]
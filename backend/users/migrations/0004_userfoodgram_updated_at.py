@@ -0,0 +1,27 @@
+# Generated by Django 3.2.19 on 2026-10-18 20:05
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F
+
+
+def copy_date_joined(apps, schema_editor):
+    User = apps.get_model('users', 'UserFoodgram')
+    User.objects.update(updated_at=F('date_joined'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userfoodgram',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now, verbose_name='Дата изменения профиля'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(copy_date_joined, migrations.RunPython.noop),
+    ]
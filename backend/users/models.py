@@ -1,13 +1,191 @@
+from collections import Counter
+
 from django.contrib.auth.models import AbstractUser
-from django.db import models
-from django.db.models import CASCADE, DateTimeField, F, ForeignKey, Model, Q
-from django.db.models.functions import Length
+from django.db import connections, models, transaction
+from django.db.models import (CASCADE, Count, DateTimeField, F, ForeignKey,
+                              IntegerField, Model, OuterRef,
+                              PositiveIntegerField, Q, QuerySet, Subquery)
+from django.db.models.functions import Coalesce, Length
+from django.db.models.sql import InsertQuery
 
 from .validators import validate_user_name
 
 models.CharField.register_lookup(Length)
 
 
+class CountedQuerySet(QuerySet):
+    """Модели, число строк которых хранится в счётчиках связанных
+    моделей. model.counters - {поле ForeignKey: поле счётчика}.
+    Model.save() меняет счётчики через сигнал, запросы этого класса -
+    сами, без сигналов. Удаление рецепта меняет счётчик через сигнал
+    post_delete, удаление связей - см. RelationModel."""
+
+    def related_pks(self, rows, field_name):
+        """id объектов, на которые ссылаются строки rows - словари
+        значений полей: {'recipe': объект или id} или {'recipe_id': id}."""
+        attname = self.model._meta.get_field(field_name).attname
+        for row in rows:
+            value = row.get(field_name, row.get(attname))
+            if value is not None:
+                yield getattr(value, 'pk', value)
+
+    def add_counts(self, field_name, counts, sign):
+        """Прибавляет к счётчикам sign * counts[id]: по одному UPDATE на
+        каждое различное значение."""
+        counter = self.model.counters[field_name]
+        target = self.model._meta.get_field(field_name).related_model
+        by_delta = {}
+        for pk, count in counts.items():
+            if pk is not None:
+                by_delta.setdefault(sign * count, []).append(pk)
+        for delta, pks in by_delta.items():
+            target._base_manager.filter(pk__in=pks).update(
+                **{counter: F(counter) + delta})
+
+    def update_counters(self, rows, sign):
+        """Прибавляет sign к счётчикам для каждой строки rows."""
+        for field_name in self.model.counters:
+            self.add_counts(
+                field_name, Counter(self.related_pks(rows, field_name)), sign)
+
+    def discount(self):
+        """Вычитает строки выборки из счётчиков, не загружая сами строки:
+        одна группировка на каждый счётчик."""
+        for field_name in self.model.counters:
+            self.add_counts(field_name, dict(
+                self.order_by().values_list(field_name).annotate(
+                    count=Count('pk'))), -1)
+
+    def counter_drift(self, rows=None):
+        """Расхождения счётчиков с данными: (модель, поле счётчика, id,
+        значение счётчика, настоящее число строк). С rows проверяются
+        только объекты, на которые ссылаются эти строки."""
+        for field_name, counter in self.model.counters.items():
+            target = self.model._meta.get_field(field_name).related_model
+            targets = target._base_manager.all()
+            if rows is not None:
+                targets = targets.filter(
+                    pk__in=set(self.related_pks(rows, field_name)))
+            actual = Coalesce(Subquery(
+                self.model._base_manager.filter(
+                    **{field_name: OuterRef('pk')},
+                ).order_by().values(field_name).annotate(
+                    count=Count('pk')).values('count'),
+                output_field=IntegerField(),
+            ), 0)
+            drift = targets.annotate(actual=actual).exclude(
+                **{counter: F('actual')},
+            ).order_by().values_list('pk', counter, 'actual')
+            for pk, stored, count in drift.iterator():
+                yield target, counter, pk, stored, count
+
+    def recount(self, rows=None):
+        """Исправляет расхождения счётчиков (с rows - только объектов,
+        на которые ссылаются эти строки): сколько значений исправлено."""
+        fixed = 0
+        with transaction.atomic(using=self.db):
+            for target, counter, pk, stored, count in self.counter_drift(
+                    rows):
+                fixed += target._base_manager.filter(pk=pk).update(
+                    **{counter: count})
+        return fixed
+
+
+class RelationQuerySet(CountedQuerySet):
+    """Связи с уникальной парой полей: подписки, избранное, корзина.
+    Добавление и удаление - одним запросом, без проверки заранее, так что
+    параллельные запросы не падают на уникальном ограничении."""
+
+    def insert_ignore(self, objs):
+        """INSERT ... ON CONFLICT DO NOTHING: сколько строк добавлено."""
+        if not objs:
+            return 0
+        query = InsertQuery(self.model, ignore_conflicts=True)
+        query.insert_values(
+            [field for field in self.model._meta.local_concrete_fields
+             if not field.primary_key],
+            objs,
+        )
+        inserted = 0
+        with connections[self.db].cursor() as cursor:
+            for sql, params in query.get_compiler(self.db).as_sql():
+                cursor.execute(sql, params)
+                inserted += max(cursor.rowcount, 0)
+        return inserted
+
+    def create_if_absent(self, **fields):
+        """True, если строка добавлена, False - если такая уже есть."""
+        with transaction.atomic(using=self.db):
+            created = self.insert_ignore([self.model(**fields)]) > 0
+            if created:
+                self.update_counters([fields], 1)
+        return created
+
+    def create_many(self, rows):
+        """Добавляет строки rows (словари значений полей), пропуская уже
+        существующие: сколько строк добавлено. Если добавлены не все,
+        счётчики объектов, на которые ссылаются rows, пересчитываются."""
+        if not rows:
+            return 0
+        with transaction.atomic(using=self.db):
+            inserted = self.insert_ignore([self.model(**row) for row in rows])
+            if inserted == len(rows):
+                self.update_counters(rows, 1)
+            else:
+                self.recount(rows)
+        return inserted
+
+    def remove(self, **fields):
+        """True, если строка была."""
+        with transaction.atomic(using=self.db):
+            rows = self.filter(**fields)
+            self.model.on_remove(rows)
+            removed = rows._raw_delete(self.db) > 0
+            if removed:
+                self.update_counters([fields], -1)
+        return removed
+
+    def delete(self):
+        """Удаление из админки и queryset.delete(): один DELETE и
+        обновление счётчиков."""
+        rows = self.remove_all()
+        return len(rows), {self.model._meta.label: len(rows)}
+
+    def remove_all(self):
+        """Удаляет выбранные строки: список значений полей удалённых."""
+        with transaction.atomic(using=self.db):
+            rows = list(self.select_for_update().values(
+                'pk', *self.model.counters))
+            removed = self.model._base_manager.filter(
+                pk__in=[row['pk'] for row in rows])
+            self.model.on_remove(removed)
+            removed._raw_delete(self.db)
+            self.update_counters(rows, -1)
+        return rows
+
+
+class RelationModel(Model):
+    """Связь со счётчиками. Удаление строки и выборки меняет счётчики
+    без сигналов post_delete: с ними Django удалял бы каскадом каждую
+    строку отдельным запросом. При каскадном удалении пользователя
+    счётчики меняет сигнал pre_delete (api/signals.py), рецепта - не
+    нужно менять: счётчики были у него самого."""
+
+    objects = RelationQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def on_remove(cls, queryset):
+        """Вызывается в транзакции удаления перед удалением строк
+        queryset, в том числе при каскадном удалении пользователя."""
+
+    def delete(self, using=None, keep_parents=False):
+        return type(self)._default_manager.using(
+            using or self._state.db).filter(pk=self.pk).delete()
+
+
 class UserFoodgram(AbstractUser):
     """Пользователи."""
     username = models.CharField(
@@ -33,6 +211,21 @@ class UserFoodgram(AbstractUser):
         verbose_name='Фамилия',
         max_length=150
     )
+    recipes_count = PositiveIntegerField(
+        verbose_name='Рецептов',
+        default=0,
+        editable=False,
+    )
+    subscribers_count = PositiveIntegerField(
+        verbose_name='Подписчиков',
+        default=0,
+        editable=False,
+    )
+    # Счётчики меняются запросами update() и эту дату не трогают.
+    updated_at = models.DateTimeField(
+        verbose_name='Дата изменения профиля',
+        auto_now=True,
+    )
 
     class Meta:
         verbose_name = 'Пользователь'
@@ -43,19 +236,21 @@ class UserFoodgram(AbstractUser):
         return f'{self.username}'
 
 
-class Subscriptions(Model):
+class Subscriptions(RelationModel):
     """Подписки и подписчики."""
     author = ForeignKey(
         verbose_name='Автор рецепта',
         related_name='subscribers',
         to=UserFoodgram,
         on_delete=CASCADE,
+        db_index=False,
     )
     user = ForeignKey(
         verbose_name='Подписчики',
         related_name='subscriptions',
         to=UserFoodgram,
         on_delete=CASCADE,
+        db_index=False,
     )
     date_added = DateTimeField(
         verbose_name='Дата подписки',
@@ -63,6 +258,8 @@ class Subscriptions(Model):
         editable=False
     )
 
+    counters = {'author': 'subscribers_count'}
+
     class Meta:
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
@@ -76,6 +273,10 @@ class Subscriptions(Model):
                 name='\nNo self sibscription\n'
             )
         )
+        indexes = (
+            models.Index(fields=('user', '-date_added'), include=('author',),
+                         name='subscription_user_date_idx'),
+        )
 
     def __str__(self) -> str:
         return f'{self.user.username} -> {self.author.username}'
@@ -1,12 +1,12 @@
-import base64
-
 from django.contrib.auth import get_user_model
-from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from djoser.serializers import TokenCreateSerializer
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
 from api.pagination import RecipeSubscribePagination
+from api.uploads import decode_base64_image, strip_metadata
+from recipes.images import FORMATS, RENDITIONS
 from recipes.models import Recipe
 
 from .models import Subscriptions
@@ -28,6 +28,8 @@ class UserFoodgramSerializer(serializers.ModelSerializer):
         model = User
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         user = self.context.get('request').user
         return (user.is_authenticated and Subscriptions.objects.filter(
             user=user, author=obj).exists())
@@ -78,7 +80,7 @@ class SubscriptionsSerializer(serializers.ModelSerializer):
     """Подписчики."""
     is_subscribed = serializers.SerializerMethodField()
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.ReadOnlyField()
 
     class Meta:
         fields = ('email',
@@ -93,26 +95,86 @@ class SubscriptionsSerializer(serializers.ModelSerializer):
         model = User
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         user = self.context.get('request').user
         return (user.is_authenticated and Subscriptions.objects.filter(
             user=user, author=obj).exists())
 
     def get_recipes(self, obj):
-        recipes = Recipe.objects.filter(author=obj,)
-        recipes = recipes[:int(RecipeSubscribePagination.page_size)]
+        if hasattr(obj, 'recipes_preview'):
+            recipes = obj.recipes_preview
+        else:
+            recipes_limit = RecipeSubscribePagination().get_page_size(
+                self.context.get('request'))
+            recipes = Recipe.objects.filter(author=obj,)[:recipes_limit]
         return RecipeOfSubscribersSerializer(recipes, many=True).data
 
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
+
+def rendition_url(path, request):
+    url = default_storage.url(path)
+    return request.build_absolute_uri(url) if request else url
+
+
+def image_renditions(value):
+    """Готовые уменьшенные копии фото рецепта (см. recipes/images.py)."""
+    if not value:
+        return {}
+    renditions = getattr(value.instance, 'image_renditions', None) or {}
+    if renditions.get('source') != value.name or renditions.get('error'):
+        return {}
+    return renditions
 
 
 class Base64ImageField(serializers.ImageField):
+    """rendition - какую уменьшенную копию (jpeg) отдавать вместо
+    исходного фото, когда она готова. Вид может переопределить её через
+    image_rendition в контексте сериализатора."""
+
+    def __init__(self, rendition=None, **kwargs):
+        self.rendition = rendition
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        rendition = self.context.get('image_rendition', self.rendition)
+        renditions = image_renditions(value)
+        if rendition in renditions:
+            return rendition_url(renditions[rendition]['jpeg'],
+                                 self.context.get('request'))
+        return super().to_representation(value)
+
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
-        return super().to_internal_value(data)
+            data = decode_base64_image(data)
+        return strip_metadata(super().to_internal_value(data))
+
+
+class ImageSrcsetField(serializers.Field):
+    """srcset уменьшенных копий фото для каждого формата:
+    {"webp": "url 160w, url 480w, ...", "jpeg": "..."}.
+    None, пока копии не готовы."""
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        kwargs.setdefault('source', 'image')
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        renditions = image_renditions(value)
+        if not renditions:
+            return None
+        request = self.context.get('request')
+        return {
+            extension: ', '.join(
+                f"{rendition_url(rendition[extension], request)} "
+                f"{rendition['width']}w"
+                for rendition in sorted(
+                    (renditions[name] for name in RENDITIONS
+                     if name in renditions),
+                    key=lambda rendition: rendition['width'])
+            )
+            for extension in FORMATS
+        }
 
 
 class UserTokenCreateSerializer(TokenCreateSerializer):
@@ -125,13 +187,16 @@ class UserTokenCreateSerializer(TokenCreateSerializer):
 class RecipeOfSubscribersSerializer(serializers.ModelSerializer):
     """ Рецепты подписчиков. Рецепты в избранном подписчиков. Рецепты в списке
     покупок подписчиков."""
-    image = Base64ImageField(required=False, allow_null=True)
+    image = Base64ImageField(
+        rendition='thumbnail', required=False, allow_null=True)
+    image_srcset = ImageSrcsetField()
 
     class Meta:
         fields = (
             'id',
             'name',
             'image',
+            'image_srcset',
             'cooking_time',
         )
         model = Recipe
@@ -1,4 +1,6 @@
 from django.contrib.auth import get_user_model
+from django.db.models import (BooleanField, Count, Max, OuterRef, Prefetch,
+                              Subquery, Value)
 from django.shortcuts import get_object_or_404
 from djoser.views import UserViewSet
 from rest_framework import status, viewsets
@@ -7,24 +9,60 @@ from rest_framework.pagination import PageNumberPagination
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
+from api.cache import cached_response
+from api.pagination import RecipeSubscribePagination, UserPagination
+from recipes import timeline
+from recipes.models import Recipe
+
 from .models import Subscriptions
 from .serializers import SubscriptionsSerializer, UserFoodgramSerializer
 
 User = get_user_model()
 
 
+def subscriptions_state(request):
+    """Меняется при подписке, отписке и любом изменении рецептов авторов,
+    на которых подписан пользователь."""
+    return (
+        tuple(Subscriptions.objects.filter(user=request.user).aggregate(
+            Count('id'), Max('id')).values()),
+        tuple(Recipe.objects.filter(
+            author__subscribers__user=request.user,
+        ).aggregate(Count('id'), Max('updated_at')).values()),
+    )
+
+
 class UserFoodgramViewSet(UserViewSet):
     serializer_class = UserFoodgramSerializer
+    pagination_class = UserPagination
+
+    def get_subscribed_authors(self, authors):
+        """Авторы, на которых подписан пользователь, вместе с первыми
+        recipes_limit рецептами каждого.
+        Первые рецепты автора выбираются коррелированным подзапросом с
+        LIMIT, поэтому все превью загружаются одним запросом."""
+        recipes_limit = RecipeSubscribePagination().get_page_size(
+            self.request)
+        first_recipes = Recipe.objects.filter(
+            author=OuterRef('author')).values('pk')[:recipes_limit]
+        return authors.annotate(
+            is_subscribed=Value(True, output_field=BooleanField()),
+        ).order_by('id').prefetch_related(Prefetch(
+            'recipes',
+            queryset=Recipe.objects.filter(pk__in=Subquery(first_recipes)),
+            to_attr='recipes_preview',
+        ))
 
     @action(methods=['get'],
             detail=False,
             url_path='subscriptions',
             permission_classes=(IsAuthenticated,),
             )
+    @cached_response(per_user=True, state=subscriptions_state)
     def subscriptions(self, request):
-        subscriptions = User.objects.filter(
+        subscriptions = self.get_subscribed_authors(User.objects.filter(
             subscribers__user=self.request.user
-        )
+        ))
         page = self.paginate_queryset(subscriptions)
         serializer = SubscriptionsSerializer(
             page, many=True, context={'request': request}
@@ -38,36 +76,39 @@ class UserFoodgramViewSet(UserViewSet):
             )
     def subscribe(self, request, id):
         user = self.request.user
+        if request.method == 'DELETE':
+            if Subscriptions.objects.remove(user=user, author=id):
+                timeline.unfollow(user, id)
+                return Response(status=status.HTTP_204_NO_CONTENT)
+            author = get_object_or_404(User, id=id)
+            if user == author:
+                return self.self_subscription_error()
+            return Response(
+                {'detail': 'Ошибка отписки. Сначала нужно подписаться.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         author = get_object_or_404(User, id=id)
         if user == author:
+            return self.self_subscription_error()
+        if not Subscriptions.objects.create_if_absent(
+                user=user, author=author):
             return Response(
-                {'detail': 'Нельзя подписаться на самого себя!'},
+                {'detail': 'Вы уже подписаны на этого автора'},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        timeline.follow(user, author)
+        author = self.get_subscribed_authors(
+            User.objects.filter(id=author.id)).get()
+        serializer = SubscriptionsSerializer(author,
+                                             context={'request': request})
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-        if request.method == 'POST':
-            subscribe_obj, created = Subscriptions.objects.get_or_create(
-                user=user, author=author
-            )
-            if not created:
-                return Response(
-                    {'detail': 'Вы уже подписаны на этого автора'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-
-            serializer = SubscriptionsSerializer(subscribe_obj.author,
-                                                 context={'request': request})
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        elif request.method == 'DELETE':
-            subscribe_obj = Subscriptions.objects.filter(user=user,
-                                                         author=author)
-            if not subscribe_obj.exists():
-                return Response(
-                    {'detail': 'Ошибка отписки. Сначала нужно подписаться.'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            subscribe_obj.delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
+    @staticmethod
+    def self_subscription_error():
+        return Response(
+            {'detail': 'Нельзя подписаться на самого себя!'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
 
 
 class SubscriptionsViewSet(viewsets.ModelViewSet):